@@ -1,55 +1,240 @@
 """ Creat an load SPacy DocBin files """
 import functools
+import hashlib
 import os, json
+import shutil
 import logging
 from multiprocessing import Pool
 import multiprocessing
 from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 import click
 import spacy
 from spacy.tokens import DocBin
 from spacy.tokens import Doc
 from util import _NLP_FILES_PATH, _PARSED_FILES_PATH
-from util import load_spacy_model, get_eba_2017_ids
+from util import load_spacy_model, get_eba_2017_ids, files_to_exclude
+from util import get_file_id, is_parsed_content_file, load_parsed_content
+from util import load_category_ranges, add_content_categories, _CATEGORIES_SUFFIX
 import time, datetime
 
 _SPACY_MODELS = ["en_core_web_sm", "en_core_web_lg"]
+_DOC_BIN_ATTRS = ["TAG", "POS", "LEMMA", "HEAD", "DEP", "ENT_IOB", "ENT_TYPE"]
+
+# Blocks which are only tokenized: parsed block types without running text and texts shorter than
+# _MIN_PIPELINE_TEXT_LENGTH characters. All other blocks are processed by the full pipeline (tagger, parser, ner).
+# The props of tokenizer only docs have "tokenizer_only": True, loaded docs do not show whether they were processed
+# by the pipeline (e.g. is_parsed is true for all docs in spacy 2.3).
+_TOKENIZER_ONLY_TYPES = [
+    "page_number",
+    "footnote_id",
+    "footnote_text_id",
+    "toc_orig_text",
+]
+_MIN_PIPELINE_TEXT_LENGTH = 3
+
+# Content hash, spacy model and attrs of each bin file of a version (see create_spacy_doc_bins)
+_DOC_BIN_MANIFEST_FILE = "manifest.json"
+
+# Spacy model of the process creating doc bins (see _init_worker)
+_nlp, _nlp_model = None, None
+
+
+def _load_model(spacy_model: str) -> spacy.language.Language:
+    if spacy_model in _SPACY_MODELS:
+        print("Loading model '{}'...".format(spacy_model))
+        return spacy.load(spacy_model)
+    print(
+        "Model {} not available. Loading model 'en_core_web_sm'...".format(spacy_model)
+    )
+    return spacy.load("en_core_web_sm")
+
+
+def _init_worker(spacy_model: str):
+    """Loads the spacy model once per process (forked workers share the model of the parent process)."""
+    global _nlp, _nlp_model
+    if not Doc.has_extension("props"):
+        Doc.set_extension("props", default=None)
+    if _nlp_model != spacy_model:
+        _nlp, _nlp_model = _load_model(spacy_model), spacy_model
+
+
+def _pipeline_block(content: Dict) -> bool:
+    """Whether a block is processed by the full pipeline, other blocks get a tokenizer only Doc."""
+    return (
+        content.get("type") not in _TOKENIZER_ONLY_TYPES
+        and len(content["text"].strip()) >= _MIN_PIPELINE_TEXT_LENGTH
+    )
+
+
+def _create_doc_bin(task: Tuple[int, str, str, int, int, bool]) -> Tuple[str, Dict]:
+    """Process pool task: creates the DocBin of a parsed content file and writes it to the results folder.
+    Docs are added in the order of the content blocks, also the docs of tokenizer only blocks (see _pipeline_block)
+    which are marked by "tokenizer_only" in their props.
+
+    :returns: (bin file name, dict with the number of blocks, pipeline blocks and the process time)
+    """
+    idx, parsed_filename, results_path, n_process, batch_size, full_pipeline = task
+    print("Processing {}: {}".format(idx, parsed_filename))
+    start_time = time.time()
+    parsed_content = load_parsed_content(
+        os.path.join(_PARSED_FILES_PATH, parsed_filename)
+    )
+    category_ranges = load_category_ranges(
+        get_file_id(parsed_filename), _PARSED_FILES_PATH
+    )
+    if category_ranges is not None:
+        add_content_categories(parsed_content, category_ranges)
+    texts = [content["text"] for content in parsed_content]
+    pipeline_blocks = [
+        full_pipeline or _pipeline_block(content) for content in parsed_content
+    ]
+
+    doc_bin = DocBin(attrs=_DOC_BIN_ATTRS, store_user_data=True)
+    pipeline_docs = _nlp.pipe(
+        (text for text, pipeline in zip(texts, pipeline_blocks) if pipeline),
+        n_process=n_process,
+        batch_size=batch_size,
+    )
+    for ii, text in enumerate(texts):
+        doc = next(pipeline_docs) if pipeline_blocks[ii] else _nlp.make_doc(text)
+        text_attributes = parsed_content[ii]
+        del text_attributes["text"]
+        if not pipeline_blocks[ii]:
+            text_attributes["tokenizer_only"] = True
+        doc._.props = text_attributes
+        doc_bin.add(doc)
+
+    # The bin file is replaced instead of overwritten: it may be a hardlink to the bin file of a previous version
+    # (see _reuse_doc_bin) when files are processed again into an existing version
+    bin_file_name = parsed_filename.split(".")[0] + ".bin"
+    bin_path = os.path.join(results_path, bin_file_name)
+    tmp_path = "{}.{}.tmp".format(bin_path, os.getpid())
+    with open(tmp_path, "wb") as f:
+        f.write(doc_bin.to_bytes())
+    os.replace(tmp_path, bin_path)
+
+    process_time = round(time.time() - start_time, 1)
+    print(
+        "Finished writing: {}; Process time: {} seconds".format(
+            bin_file_name, process_time
+        )
+    )
+    return bin_file_name, {
+        "blocks": len(texts),
+        "pipeline_blocks": sum(pipeline_blocks),
+        "process_time": process_time,
+    }
+
+
+def _doc_bin_manifest_entry(
+    parsed_filename: str, spacy_model: str, full_pipeline: bool
+) -> Dict:
+    """Manifest entry of a bin file: a bin file can be reused if the entry is unchanged. The content hash
+    includes the category ranges of the document as the categories are stored in the doc props.
+    """
+    sha256 = hashlib.sha256()
+    category_ranges_path = os.path.join(
+        _PARSED_FILES_PATH, get_file_id(parsed_filename) + _CATEGORIES_SUFFIX
+    )
+    for file_path in [
+        os.path.join(_PARSED_FILES_PATH, parsed_filename),
+        category_ranges_path,
+    ]:
+        if os.path.exists(file_path):
+            with open(file_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    sha256.update(chunk)
+    return {
+        "content_sha256": sha256.hexdigest(),
+        "spacy_model": spacy_model,
+        "model_version": _nlp.meta.get("version"),
+        "spacy_version": spacy.__version__,
+        "attrs": _DOC_BIN_ATTRS,
+        "tokenizer_only": (
+            None
+            if full_pipeline
+            else {
+                "types": _TOKENIZER_ONLY_TYPES,
+                "min_text_length": _MIN_PIPELINE_TEXT_LENGTH,
+                "prop": "tokenizer_only",
+            }
+        ),
+    }
+
+
+def load_doc_bin_manifest(results_path: str) -> Dict:
+    """Loads the manifest of a version folder which maps each bin file name to its manifest entry."""
+    manifest_path = os.path.join(results_path, _DOC_BIN_MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, "r") as f:
+        return json.load(f)
+
+
+def _reuse_doc_bin(source_path: str, target_path: str):
+    """Hardlinks an unchanged bin file of a previous version (copies it if hardlinks are not supported)."""
+    if os.path.exists(target_path):
+        os.remove(target_path)
+    try:
+        os.link(source_path, target_path)
+    except OSError:
+        shutil.copy2(source_path, target_path)
+
+
+def _previous_doc_bin(
+    previous_manifests: List[Tuple[str, Dict]], bin_file_name: str, manifest_entry: Dict
+) -> Optional[str]:
+    """Path of the bin file of the first (newest) previous version whose manifest entry of the bin file is
+    unchanged, None if the bin file has to be processed."""
+    for previous_path, previous_manifest in previous_manifests:
+        previous_bin_path = os.path.join(previous_path, bin_file_name)
+        if previous_manifest.get(bin_file_name) == manifest_entry and os.path.exists(
+            previous_bin_path
+        ):
+            return previous_bin_path
+    return None
 
 
 def create_spacy_doc_bins(
-    spacy_model: str = "en_core_web_sm", version: int = -1, file_name: str = None
+    spacy_model: str = "en_core_web_sm",
+    version: int = -1,
+    file_name: str = None,
+    corpus_only: bool = False,
+    workers: int = 1,
+    batch_size: int = 1000,
+    large_file_size: int = 2 ** 20,
+    rebuild: bool = False,
+    full_pipeline: bool = False,
 ):
     """ Creates Spacy Doc objects, serialize's the information and stores as bytes files. 
     :param spacy_model: Spcay model to use for text processing.
     :param version: Version number to save spacy docbin objects to (default -1 -> add new version number).
+    :param corpus_only: skip files excluded from the eba analysis by their crawler metadata (see files_to_exclude).
+    :param workers: number of worker processes. Files larger than large_file_size (bytes) are processed one at a
+        time with workers processes (nlp.pipe n_process), all other files are distributed to workers processes
+        which load the model once and write their own bin files.
+    :param batch_size: number of texts per nlp.pipe batch.
+    :param rebuild: process all files. By default each bin file of the newest previous version whose parsed
+        content, category ranges, spacy model and attrs are unchanged (see manifest.json) is hardlinked instead.
+        Files processed into an existing version are merged into its manifest and meta file.
+    :param full_pipeline: process all blocks with the full pipeline. By default page numbers, footnote ids, toc
+        text and very short blocks are only tokenized (see _pipeline_block).
     """
 
     assert isinstance(version, int), "Version number must be an integer!"
-    if spacy_model in _SPACY_MODELS:
-        print("Loading model '{}'...".format(spacy_model))
-        nlp = spacy.load(spacy_model)
-    else:
-        print(
-            "Model {} not available. Loading model 'en_core_web_sm'...".format(
-                spacy_model
-            )
-        )
-        nlp = spacy.load("en_core_web_sm")
-
-    doc_bin_attrs = ["TAG", "POS", "LEMMA", "HEAD", "DEP", "ENT_IOB", "ENT_TYPE"]
-
-    Doc.set_extension("props", default=None)
+    _init_worker(spacy_model)
 
     if not os.path.exists(_NLP_FILES_PATH):
         os.mkdir(_NLP_FILES_PATH)
+    versions = sorted(
+        [
+            int(f[1:])
+            for f in os.listdir(_NLP_FILES_PATH)
+            if os.path.isdir(os.path.join(_NLP_FILES_PATH, f))
+        ]
+    )
     if version < 0:
-        versions = sorted(
-            [
-                int(f[1:])
-                for f in os.listdir(_NLP_FILES_PATH)
-                if os.path.isdir(os.path.join(_NLP_FILES_PATH, f))
-            ]
-        )
         if versions:
             version = versions[-1] + 1
         else:
@@ -61,57 +246,116 @@ def create_spacy_doc_bins(
     if not os.path.exists(_NLP_RESULTS_PATH):
         os.mkdir(_NLP_RESULTS_PATH)
 
+    # Files processed into an existing version are merged into its manifest and the doc_bins of its meta file
+    meta_path = os.path.join(_NLP_RESULTS_PATH, "meta.json")
+    manifest, doc_bins = load_doc_bin_manifest(_NLP_RESULTS_PATH), {}
+    if os.path.exists(meta_path):
+        with open(meta_path, "r") as f:
+            doc_bins = json.load(f).get("doc_bins", {})
+
     # Create meta file
-    with open(os.path.join(_NLP_RESULTS_PATH, "meta.json"), "w") as f:
-        meta = {
-            "spacy_model": spacy_model,
-            "date": str(datetime.datetime.now()),
-            "attrs": doc_bin_attrs,
-            "run_type": file_name,
-        }
+    meta = {
+        "spacy_model": spacy_model,
+        "date": str(datetime.datetime.now()),
+        "attrs": _DOC_BIN_ATTRS,
+        "run_type": file_name,
+    }
+    with open(meta_path, "w") as f:
         f.write(json.dumps(meta))
 
+    excluded_file_ids = set(
+        files_to_exclude(crawler_metadata=True) if corpus_only else []
+    )
+
+    # Manifests of all previous versions, newest first: each unchanged bin file is reused from the newest version
+    # which has it, e.g. bin files of a version processed for a single file_name and of the full version before it
+    previous_manifests = []
+    for previous_version in sorted(versions, reverse=True):
+        if previous_version == version or rebuild:
+            continue
+        previous_path = os.path.join(_NLP_FILES_PATH, "v{}".format(previous_version))
+        previous_manifest = load_doc_bin_manifest(previous_path)
+        if previous_manifest:
+            previous_manifests.append((previous_path, previous_manifest))
+    if previous_manifests:
+        print(
+            "Reusing unchanged files of versions: {}".format(
+                ", ".join(os.path.basename(path) for path, _ in previous_manifests)
+            )
+        )
+
     print("Processing files from: {}".format(_PARSED_FILES_PATH))
+    large_files, files = [], []
     for idx, parsed_filename in enumerate(os.listdir(_PARSED_FILES_PATH)):
-        doc_bin = DocBin(attrs=doc_bin_attrs, store_user_data=True)
-
         # if a file_name is specified create docbin only for that specific file
         if file_name == "eba2017":
             eba2017_ids = [_id for _id in get_eba_2017_ids()]
-            if parsed_filename.replace("_content.json", "") not in eba2017_ids:
+            if get_file_id(parsed_filename) not in eba2017_ids:
                 continue
         elif file_name:
             if parsed_filename != file_name:
                 continue
 
-        if parsed_filename.endswith("_content.json"):
-            print("Processing {}: {}".format(idx, parsed_filename))
-            start_time = time.time()
-            with open(os.path.join(_PARSED_FILES_PATH, parsed_filename)) as f:
-                parsed_content, texts = [], []
-                for line in f:
-                    content = json.loads(line)
-                    parsed_content.append(content)
-                    texts.append(content["text"])
-        else:
+        if get_file_id(parsed_filename) in excluded_file_ids:
             continue
 
-        for ii, doc in enumerate(nlp.pipe(texts)):
-            text_attributes = parsed_content[ii]
-            del text_attributes["text"]
-            doc._.props = text_attributes
-            doc_bin.add(doc)
+        if not is_parsed_content_file(parsed_filename):
+            continue
 
         bin_file_name = parsed_filename.split(".")[0] + ".bin"
-        with open(os.path.join(_NLP_RESULTS_PATH, bin_file_name), "wb") as f:
-            f.write(doc_bin.to_bytes())
+        manifest_entry = _doc_bin_manifest_entry(
+            parsed_filename, spacy_model, full_pipeline
+        )
+        manifest[bin_file_name] = manifest_entry
+        previous_bin_path = _previous_doc_bin(
+            previous_manifests, bin_file_name, manifest_entry
+        )
+        if previous_bin_path:
+            _reuse_doc_bin(
+                previous_bin_path, os.path.join(_NLP_RESULTS_PATH, bin_file_name)
+            )
+            doc_bins[bin_file_name] = {
+                "reused": os.path.basename(os.path.dirname(previous_bin_path))
+            }
+            continue
 
-        print(
-            "Finished writing: {}; Process time: {} seconds".format(
-                bin_file_name, round(time.time() - start_time, 1)
+        file_size = os.path.getsize(os.path.join(_PARSED_FILES_PATH, parsed_filename))
+        if workers > 1 and file_size > large_file_size:
+            large_files.append(
+                (
+                    idx,
+                    parsed_filename,
+                    _NLP_RESULTS_PATH,
+                    workers,
+                    batch_size,
+                    full_pipeline,
+                )
+            )
+        else:
+            files.append(
+                (idx, parsed_filename, _NLP_RESULTS_PATH, 1, batch_size, full_pipeline)
             )
-        )
-        doc_bin = None
+
+    # Large files are split into batches processed in parallel, then the remaining files are processed in parallel
+    doc_bins.update(_create_doc_bin(task) for task in large_files)
+    if workers > 1 and files:
+        with Pool(
+            processes=min(workers, len(files)),
+            initializer=_init_worker,
+            initargs=(spacy_model,),
+        ) as pool:
+            doc_bins.update(pool.imap_unordered(_create_doc_bin, files))
+    else:
+        doc_bins.update(_create_doc_bin(task) for task in files)
+
+    # Merged meta file of all bin files
+    meta["workers"] = workers
+    meta["full_pipeline"] = full_pipeline
+    meta["doc_bins"] = dict(sorted(doc_bins.items()))
+    with open(meta_path, "w") as f:
+        f.write(json.dumps(meta))
+    with open(os.path.join(_NLP_RESULTS_PATH, _DOC_BIN_MANIFEST_FILE), "w") as f:
+        f.write(json.dumps(dict(sorted(manifest.items())), indent=1))
 
     # yield bin_file, docs, nlp
 
@@ -132,14 +376,65 @@ def create_spacy_doc_bins(
     default="all",
     prompt="Do you want to process a specific file? ( all / eba2017 / json_file_name)",
 )
-def main(spacy_model, version, file_name):
+@click.option(
+    "--corpus_only",
+    is_flag=True,
+    default=False,
+    help="Skip files excluded from the eba analysis by their crawler metadata.",
+)
+@click.option(
+    "--workers",
+    default=1,
+    type=click.IntRange(min=1),
+    help="Number of worker processes used for processing files in parallel.",
+)
+@click.option(
+    "--batch_size", default=1000, help="Number of texts per spacy pipe batch."
+)
+@click.option(
+    "--large_file_size",
+    default=2 ** 20,
+    help="Parsed content files larger than this (bytes) are processed one at a time using all workers.",
+)
+@click.option(
+    "--rebuild",
+    is_flag=True,
+    default=False,
+    help="Process all files instead of reusing unchanged files of previous versions.",
+)
+@click.option(
+    "--full_pipeline",
+    is_flag=True,
+    default=False,
+    help="Process all blocks with the full pipeline (page numbers, footnote ids, toc text and very short blocks are only tokenized by default).",
+)
+def main(
+    spacy_model,
+    version,
+    file_name,
+    corpus_only,
+    workers,
+    batch_size,
+    large_file_size,
+    rebuild,
+    full_pipeline,
+):
     if file_name == "all":
         file_name = None
-    create_spacy_doc_bins(spacy_model, int(version), file_name)
+    create_spacy_doc_bins(
+        spacy_model,
+        int(version),
+        file_name,
+        corpus_only,
+        workers,
+        batch_size,
+        large_file_size,
+        rebuild,
+        full_pipeline,
+    )
 
 
 if __name__ == "__main__":
     # pylint: disable=no-value-for-parameter
     # python -m nlp_processing.process_docs
     main()
-
@@ -0,0 +1,345 @@
+"""Columnar binary storage of the parsed content blocks of a document."""
+
+from array import array
+import json
+import mmap
+import shutil
+import sys
+import tempfile
+from typing import BinaryIO, Dict, Iterator, List
+
+_MAGIC = b"EBABLOCK"
+_VERSION = 1
+# blocks kept in memory by ContentStoreWriter before they are spooled to its column files
+_SPOOL_BLOCKS = 1000
+
+
+class ContentStore:
+    """
+    Compact binary alternative to the json lines content file (one dict per content block) written by ParseDoc.
+
+    Numeric block fields are stored in typed array columns, the string fields of all blocks in a single utf-8 heap
+    and linebreak_indexes in a flat integer column, each indexed by per block offsets. Blocks can therefore be
+    decoded individually, by block index or by page (blocks are ordered by page), without decoding the rest of the
+    document. Fields which are missing from a block or do not have the column type, and all other fields (e.g.
+    category), are stored as json per block.
+
+    block(idx) returns the same dict as json decoding the block's line of the json lines content file.
+    """
+
+    # field order of the blocks of ParseDoc.parse_content
+    FIELDS = [
+        "text",
+        "tag",
+        "size",
+        "color",
+        "page_id",
+        "merged_tags",
+        "linebreak_indexes",
+        "block_id",
+        "line_id",
+        "bbox",
+        "type",
+        "footnote_id_pos",
+    ]
+    INT_FIELDS = ["color", "page_id", "block_id", "line_id", "footnote_id_pos"]
+    STR_FIELDS = ["text", "tag", "merged_tags", "type"]
+    _EXTRA = len(STR_FIELDS)  # string slot of the json encoded other fields
+
+    def __init__(self):
+        self.fields = array("q")  # bit mask of the FIELDS stored in columns
+        self.ints = {field: array("q") for field in self.INT_FIELDS}
+        self.size = array("d")
+        self.bbox = array("d")  # flat x0, y0, x1, y1 per block
+        self.linebreak_indexes = array("q")
+        self.linebreak_offsets = array("q", [0])
+        self.string_offsets = array("q", [0])  # STR_FIELDS and extra fields per block
+        self.page_run_ids = array("q")  # page_id of each run of blocks on the same page
+        self.page_run_starts = array("q")
+        self._heap_parts = []
+        self._heap = b""
+        self._page_runs = None
+        # number of blocks removed from the columns by ContentStoreWriter
+        self._spooled = 0
+
+    def add(self, block: Dict):
+        """Append a content block."""
+        mask, extra = 0, {}
+        for field, value in block.items():
+            if field in _FIELD_CHECKS and _FIELD_CHECKS[field](value):
+                mask |= _FIELD_BITS[field]
+            else:
+                extra[field] = value
+
+        def stored(field, default):
+            return block[field] if mask & _FIELD_BITS[field] else default
+
+        for field in self.INT_FIELDS:
+            self.ints[field].append(stored(field, 0))
+        self.size.append(stored("size", 0.0))
+        self.bbox.extend(stored("bbox", (0.0, 0.0, 0.0, 0.0)))
+        linebreak_indexes = stored("linebreak_indexes", [])
+        self.linebreak_indexes.extend(linebreak_indexes)
+        self.linebreak_offsets.append(
+            self.linebreak_offsets[-1] + len(linebreak_indexes)
+        )
+        for field in self.STR_FIELDS:
+            self._add_string(stored(field, ""))
+        self._add_string(json.dumps(extra, ensure_ascii=False) if extra else "")
+        self.fields.append(mask)
+
+        page_id = self.ints["page_id"][-1]
+        if not self.page_run_ids or self.page_run_ids[-1] != page_id:
+            self.page_run_ids.append(page_id)
+            self.page_run_starts.append(self._spooled + len(self.fields) - 1)
+        self._page_runs = None
+
+    def _add_string(self, text: str):
+        data = text.encode("utf-8")
+        self._heap_parts.append(data)
+        self.string_offsets.append(self.string_offsets[-1] + len(data))
+
+    def pack(self):
+        """Join strings appended since the last call into the string heap."""
+        if self._heap_parts:
+            self._heap += b"".join(self._heap_parts)
+            self._heap_parts = []
+
+    def __len__(self) -> int:
+        return len(self.fields)
+
+    def _string(self, idx: int, slot: int) -> str:
+        pos = idx * (len(self.STR_FIELDS) + 1) + slot
+        return str(
+            self._heap[self.string_offsets[pos] : self.string_offsets[pos + 1]], "utf-8"
+        )
+
+    def text(self, idx: int) -> str:
+        return self._string(idx, 0)
+
+    def block(self, idx: int) -> Dict:
+        """Returns content block idx as a dict."""
+        self.pack()
+        mask, block = self.fields[idx], {}
+        for field in self.FIELDS:
+            if not mask & _FIELD_BITS[field]:
+                continue
+            if field in self.INT_FIELDS:
+                block[field] = self.ints[field][idx]
+            elif field == "size":
+                block[field] = self.size[idx]
+            elif field == "bbox":
+                block[field] = self.bbox[4 * idx : 4 * idx + 4].tolist()
+            elif field == "linebreak_indexes":
+                block[field] = self.linebreak_indexes[
+                    self.linebreak_offsets[idx] : self.linebreak_offsets[idx + 1]
+                ].tolist()
+            else:
+                block[field] = self._string(idx, self.STR_FIELDS.index(field))
+        extra = self._string(idx, self._EXTRA)
+        if extra:
+            block.update(json.loads(extra))
+        return block
+
+    def __iter__(self) -> Iterator[Dict]:
+        for idx in range(len(self)):
+            yield self.block(idx)
+
+    def blocks(self) -> List[Dict]:
+        return list(self)
+
+    def page_block_idxs(self, page_id: int) -> List[int]:
+        """Indexes of all blocks on a page."""
+        if self._page_runs is None:
+            self._page_runs = {}
+            run_ends = list(self.page_run_starts[1:]) + [len(self)]
+            for run_page_id, start, end in zip(
+                self.page_run_ids, self.page_run_starts, run_ends
+            ):
+                self._page_runs.setdefault(run_page_id, []).append(range(start, end))
+        return [idx for run in self._page_runs.get(page_id, []) for idx in run]
+
+    def page_blocks(self, page_id: int) -> List[Dict]:
+        """Content blocks on a page."""
+        return [self.block(idx) for idx in self.page_block_idxs(page_id)]
+
+    def _columns(self) -> Dict[str, array]:
+        columns = {
+            "fields": self.fields,
+            "size": self.size,
+            "bbox": self.bbox,
+            "linebreak_indexes": self.linebreak_indexes,
+            "linebreak_offsets": self.linebreak_offsets,
+            "string_offsets": self.string_offsets,
+            "page_run_ids": self.page_run_ids,
+            "page_run_starts": self.page_run_starts,
+        }
+        columns.update({"int_" + field: column for field, column in self.ints.items()})
+        return columns
+
+    def write(self, f: BinaryIO):
+        """Write the store to a binary file: magic, header length, json header with the byte offsets of the
+        columns and the string heap, followed by the (8 byte aligned) column data."""
+        self.pack()
+        data = {name: column.tobytes() for name, column in self._columns().items()}
+        data["heap"] = self._heap
+        _write_file(
+            f,
+            {name: len(column_data) for name, column_data in data.items()},
+            lambda name: f.write(data[name]),
+        )
+
+    @classmethod
+    def read(cls, f: BinaryIO) -> "ContentStore":
+        """
+        Read a store written by write. Files are memory mapped (other binary files are read) and the columns and
+        the string heap are views of the file data at the offsets of the header, hence only the data of the blocks
+        which are decoded is read from disk. The store is read-only.
+        """
+        if f.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError("Not a parsed content store file")
+        header_length = int.from_bytes(f.read(8), "little")
+        header = json.loads(f.read(_aligned(header_length))[:header_length])
+        if header["version"] != _VERSION:
+            raise ValueError(
+                "Unsupported parsed content store version: {}".format(header["version"])
+            )
+        try:
+            data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            data = data[f.tell() :]
+        except (AttributeError, OSError, ValueError):  # e.g. io.BytesIO
+            data = memoryview(f.read())
+        store = cls()
+        for name, column in store._columns().items():
+            offset, length = header["columns"][name]
+            if header["byteorder"] == sys.byteorder:
+                column = data[offset : offset + length].cast(column.typecode)
+            else:
+                del column[:]
+                column.frombytes(data[offset : offset + length])
+                column.byteswap()
+            if name.startswith("int_"):
+                store.ints[name[len("int_") :]] = column
+            else:
+                setattr(store, name, column)
+        offset, length = header["columns"]["heap"]
+        store._heap = data[offset : offset + length]
+        return store
+
+    @classmethod
+    def from_file(cls, file_path) -> "ContentStore":
+        with open(file_path, "rb") as f:
+            return cls.read(f)
+
+
+class ContentStoreWriter:
+    """
+    Writes a content store file while the blocks are added, e.g. while a document is parsed page by page.
+
+    The columns of the blocks (all but the small page run columns) are spooled to temporary files every
+    _SPOOL_BLOCKS blocks, hence memory does not grow with the blocks of the document. close() writes the file,
+    which is the same file as written by ContentStore.write.
+    """
+
+    # columns which start with a 0 offset, their last offset is kept for the next blocks
+    _OFFSET_COLUMNS = ["linebreak_offsets", "string_offsets"]
+
+    def __init__(self, f: BinaryIO):
+        self.f = f
+        self.store = ContentStore()
+        self.spools = {
+            name: tempfile.TemporaryFile()
+            for name in list(self.store._columns()) + ["heap"]
+            if not name.startswith("page_run")
+        }
+        for name in self._OFFSET_COLUMNS:
+            self.spools[name].write(array("q", [0]).tobytes())
+
+    def add(self, block: Dict):
+        """Append a content block."""
+        self.store.add(block)
+        if len(self.store) >= _SPOOL_BLOCKS:
+            self._spool()
+
+    def _spool(self):
+        store = self.store
+        store.pack()
+        store._spooled += len(store)
+        columns = store._columns()
+        for name, spool in self.spools.items():
+            if name == "heap":
+                spool.write(store._heap)
+                store._heap = b""
+            elif name in self._OFFSET_COLUMNS:
+                spool.write(columns[name][1:].tobytes())
+                del columns[name][:-1]
+            else:
+                spool.write(columns[name].tobytes())
+                del columns[name][:]
+
+    def close(self):
+        """Write the content store file and remove the temporary column files."""
+        self._spool()
+        columns = self.store._columns()
+        lengths = {}
+        for name in list(columns) + ["heap"]:
+            if name in self.spools:
+                lengths[name] = self.spools[name].tell()
+            else:
+                lengths[name] = len(columns[name].tobytes())
+
+        def write_column(name):
+            if name in self.spools:
+                self.spools[name].seek(0)
+                shutil.copyfileobj(self.spools[name], self.f)
+            else:
+                self.f.write(columns[name].tobytes())
+
+        try:
+            _write_file(self.f, lengths, write_column)
+        finally:
+            for spool in self.spools.values():
+                spool.close()
+
+
+def _write_file(f: BinaryIO, column_lengths: Dict[str, int], write_column):
+    """Writes the magic, header and the columns (in the order of column_lengths) of a content store file."""
+    header = {"version": _VERSION, "byteorder": sys.byteorder, "columns": {}}
+    offset = 0
+    for name, length in column_lengths.items():
+        header["columns"][name] = [offset, length]
+        offset += _aligned(length)
+    header = json.dumps(header).encode("utf-8")
+    f.write(_MAGIC)
+    f.write(len(header).to_bytes(8, "little"))
+    f.write(header + b"\0" * (_aligned(len(header)) - len(header)))
+    for name, length in column_lengths.items():
+        write_column(name)
+        f.write(b"\0" * (_aligned(length) - length))
+
+
+def _is_bbox(value) -> bool:
+    return (
+        isinstance(value, (list, tuple))
+        and len(value) == 4
+        and all(type(v) is float for v in value)
+    )
+
+
+def _is_int_list(value) -> bool:
+    return isinstance(value, list) and all(type(v) is int for v in value)
+
+
+# Type of the values stored in the columns of each field (bool is not stored as int)
+_FIELD_CHECKS = {
+    **{field: lambda v: type(v) is int for field in ContentStore.INT_FIELDS},
+    **{field: lambda v: type(v) is str for field in ContentStore.STR_FIELDS},
+    "size": lambda v: type(v) is float,
+    "bbox": _is_bbox,
+    "linebreak_indexes": _is_int_list,
+}
+_FIELD_BITS = {field: 1 << bit for bit, field in enumerate(ContentStore.FIELDS)}
+
+
+def _aligned(length: int) -> int:
+    return (length + 7) // 8 * 8
@@ -6,26 +6,89 @@ import json
 import click
 from urllib import request
 from collections import Counter
-from typing import Any, Mapping, Optional, Sequence, Tuple, Union, List, Dict
+from contextlib import contextmanager
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import wait
+from typing import Any, Iterator, Mapping, Optional, Sequence, Tuple, Union, List, Dict
 import re
+import numpy as np
 from fuzzywuzzy import fuzz
-from itertools import product
-
+from itertools import chain, product
+
+import functools
+import hashlib
+import inspect
+import pickle
+import resource
+import signal
+import time
+from parse_evaluations import content_store, span_store, toc_match
+from parse_evaluations.content_store import ContentStoreWriter
+from parse_evaluations.span_store import SpanStore
+from parse_evaluations.toc_match import TocMatcher, TocTextIndex
 from util import (
+    _CONTENT_JSON_SUFFIX,
+    _CONTENT_STORE_SUFFIX,
     _PARSED_FILES_PATH,
     _FETCHED_FILES_PATH,
+    _FRONT_MATTER_PARSED_FILES_PATH,
     _PROJECT_PATH,
+    files_to_exclude,
+    get_file_id,
+    is_parsed_content_file,
     load_jsonl,
     dump_jsonl,
 )
 
-
 _ROMAN_NUMERAL_PATTERN = (
     r"^(?=\b[MDCLXVI]+\b)M{0,4}(?:CM|CD|D?C{0,3})(?:XC|XL|L?X{0,3})(?:IX|IV|V?I{0,3})"
 )
 _SECTION_DIGIT_PATTERN = r"^([0-9]+[\.]?)+"
 _SECTION_DIGIT_DOT_SPACE_PATTERN = r"^([0-9]+[\.])+[\s]+"
 _SPECIAL_CHAR_PATTERNS = r"[\n\r\t]"
+# Patterns evaluated for every span are compiled once
+_ROMAN_NUMERAL_REGEX = re.compile(_ROMAN_NUMERAL_PATTERN)
+_SECTION_DIGIT_REGEX = re.compile(_SECTION_DIGIT_PATTERN[1:])
+_SECTION_DIGIT_DOT_SPACE_REGEX = re.compile(_SECTION_DIGIT_DOT_SPACE_PATTERN)
+_TOC_DOTS_PAGE_NUMBER_REGEX = re.compile(r"[\.]{2,}[\s]?[0-9]+")
+# ParseDoc settings used when parsing the fetched evaluations
+_PARSE_SETTINGS = {
+    "granularity": True,
+    "font_size_remainder": 1,
+    "pageNumberStyleMatch": None,
+}
+# Number of pages parsed in front matter mode (the table of contents is searched for on the first 20 pages)
+_FRONT_MATTER_PAGES = 20
+# The table of contents is searched for in the content blocks of pages with page_id up to _TOC_PAGE_LIMIT
+_TOC_PAGE_LIMIT = 20
+# Minimum number of outline entries with page targets for using the pdf outline as table of contents
+_OUTLINE_MIN_ROWS = 3
+# Source files whose content defines the parser version recorded in the parsing manifest
+_PARSER_SOURCE_FILES = [
+    __file__,
+    span_store.__file__,
+    toc_match.__file__,
+    content_store.__file__,
+]
+_PARSING_MANIFEST_FILE = "summary/parsing_manifest.json"
+# Files which exceeded the time or memory limit of batch parsing or failed, skipped until their pdf content changes
+_QUARANTINE_FILE = "summary/quarantine.json"
+# Failed MuPDF allocations (raised as RuntimeError by fitz), reported as exceeding the memory limit
+_MUPDF_MEMORY_ERROR = re.compile(r"(malloc|calloc|realloc).*failed|out of memory", re.I)
+# Documents with at least this many pages have their pages extracted by all workers in batch parsing
+# if they would otherwise take longer than the rest of the batch
+_PAGE_PARALLEL_MIN_PAGES = 200
+# Estimated peak memory (MB) of parsing a document: per worker process plus per page
+_PARSE_BASE_MEMORY_MB = 100
+_PARSE_PAGE_MEMORY_MB = 2
+# Parsing stages that can be restored from the parse cache, in parsing order
+_CHECKPOINT_STAGES = [
+    "fonts_and_page_numbers",
+    "font_tags",
+    "get_footnotes",
+    "parse_content",
+]
+
 _CHAR_TO_REMOVE = [
     "\u00a0",
     "\u00ad",
@@ -37,6 +100,156 @@ _CHAR_TO_REMOVE = [
 ]
 
 
+class FootnoteTracker:
+    """
+    Footnotes accepted so far in a document. Keeps running counts of the footnote digits and the last
+    accepted footnote so that each new footnote candidate can be checked in constant time.
+    """
+
+    def __init__(self):
+        self.footnotes = []
+        self.counts = Counter()
+
+    def __len__(self) -> int:
+        return len(self.footnotes)
+
+    def add(self, footnote: Dict):
+        self.footnotes.append(footnote)
+        self.counts[footnote["text"]] += 1
+
+    def count(self, text: str) -> int:
+        """Number of accepted footnotes with digit text."""
+        return self.counts[text]
+
+    @property
+    def last_number(self) -> int:
+        """Number of the last accepted footnote."""
+        return int(self.footnotes[-1]["text"])
+
+
+class SpanFeatures:
+    """
+    Feature columns of all text spans of a document, computed once from its SpanStore.
+
+    Text flags (page number candidates, digits, section numbers) use the precompiled patterns and the
+    vertical distances to the previous non empty span are computed for all spans at once with NumPy.
+    The previous non empty span may be on the previous page, as in ParseDoc.parse_content.
+    """
+
+    def __init__(
+        self, spans: SpanStore, doc_length: int, font_size_remainder: int = None
+    ):
+        raw_texts = [spans.text(idx) for idx in range(len(spans))]
+        self.text = [t.strip() for t in raw_texts]
+        self.size = (
+            [round(size, font_size_remainder) for size in spans.size]
+            if font_size_remainder
+            else spans.size.tolist()
+        )
+        self.is_digit = [t.isdigit() for t in self.text]
+        self.is_page_number = [
+            self.is_page_number_text(t, doc_length) for t in self.text
+        ]
+        self.has_section_digit = [
+            _SECTION_DIGIT_REGEX.search(t) is not None for t in self.text
+        ]
+        self.starts_with_section_number = [
+            "0" <= t[:1] <= "9" and _SECTION_DIGIT_DOT_SPACE_REGEX.search(t) is not None
+            for t in raw_texts
+        ]
+
+        # index of the previous non empty span (-1 if none)
+        non_empty = np.array([len(t) > 0 for t in self.text], dtype=bool)
+        idxs = np.where(non_empty, np.arange(len(non_empty)), -1)
+        prev_idxs = np.empty_like(idxs)
+        prev_idxs[:1] = -1
+        prev_idxs[1:] = np.maximum.accumulate(idxs)[:-1]
+
+        bbox = np.frombuffer(spans.bbox, dtype=np.float64).reshape(-1, 4)
+        prev_bbox = bbox[prev_idxs]
+        has_prev = prev_idxs >= 0
+        # distance between span y0 and previous span y1
+        self.prev_gap = np.where(
+            has_prev, np.abs(bbox[:, 1] - prev_bbox[:, 3]), 0.0
+        ).tolist()
+        # span y0 and y1 both differ from the previous span
+        self.vertical_shift = (
+            has_prev
+            & (np.abs(bbox[:, 1] - prev_bbox[:, 1]) > 2)
+            & (np.abs(bbox[:, 3] - prev_bbox[:, 3]) > 2)
+        ).tolist()
+
+    @staticmethod
+    def is_page_number_text(text: str, doc_length: int) -> bool:
+        """Text is an arabic number smaller than doc length + increment (some docs have more pages than numbered) or a roman numeral."""
+        if len(text) >= 6 or "+" in text:  # page numbers must be smaller than 10000
+            return False
+        try:
+            if 0 <= int(text) < (doc_length + 50):
+                return True
+        except ValueError:  # raises ValueError if text cannot be converted to int
+            pass
+        roman_numeral = _ROMAN_NUMERAL_REGEX.search(text.upper())
+        return (
+            roman_numeral is not None
+            and roman_numeral.end() - roman_numeral.start() == len(text)
+        )
+
+
+_checkpoint_registry = {}  # stage -> (method, helpers, attributes)
+
+
+def _checkpoint(attributes: Sequence[str], helpers: Sequence[str] = ()):
+    """Decorator for parsing stages of ParseDoc whose output can be restored from the parse cache.
+
+    The output of a stage is checkpointed if the ParseDoc has a cache. A checkpoint is only valid for the same raw
+    extraction, the same ParseDoc settings and the same source code of the stage and all preceding stages (see
+    ParseDoc.stage_key), hence a change to e.g. the table of contents heuristics does not invalidate parsed content.
+
+    :param attributes: ParseDoc attributes set by the stage.
+    :param helpers: names of ParseDoc methods and module level functions, classes or constants used by the stage.
+    """
+
+    def decorator(method):
+        _checkpoint_registry[method.__name__] = (method, helpers, attributes)
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self.cache is None:
+                return method(self, *args, **kwargs)
+            stage, key = method.__name__, self.stage_key(method.__name__)
+            checkpoint = self.cache.load(stage, key)
+            if checkpoint is None:
+                result = method(self, *args, **kwargs)
+                self.cache.save(
+                    stage,
+                    key,
+                    {
+                        "result": result,
+                        "attributes": {a: getattr(self, a) for a in attributes},
+                    },
+                )
+                return result
+            for attribute, value in checkpoint["attributes"].items():
+                setattr(self, attribute, value)
+            return checkpoint["result"]
+
+        return wrapper
+
+    return decorator
+
+
+@functools.lru_cache(maxsize=None)
+def _stage_source(stage: str) -> str:
+    """Source code of a checkpointed stage and its helpers."""
+    method, helpers, _ = _checkpoint_registry[stage]
+    sources = [inspect.getsource(method)]
+    for name in helpers:
+        obj = getattr(ParseDoc, name, None) or globals()[name]
+        sources.append(inspect.getsource(obj) if callable(obj) else repr(obj))
+    return "\n".join(sources)
+
+
 class ParseDoc:
     """
     Parsing of SIDA evaluation PDF documents (https://www.sida.se/English/publications/publicationsearch/). 
@@ -57,18 +270,50 @@ class ParseDoc:
         font_size_remainder: int = None,
         granularity: bool = False,
         pageNumberStyleMatch=None,
+        page_range: Sequence[int] = None,
+        cache_path: str = None,
+        page_workers: int = 1,
     ):
         """
-        Initializes parsing class. 
+        Initializes parsing class.
         :param doc_path: location of PDF file to be parsed.
         :param font_size_remainder: level of parsing detail for font size.
         :param granularity: include font type in parsing.
         :param pageNumberStyleMatch: granularity of page numbers can be set to rough or exact or any (exact: font and size must be equal; rough: size must be equal, font must almost match; else: match on font size only)
+        :param page_range: (start, stop) page_ids to parse, stop excluded (default: all pages). Only these pages are extracted
+            and classified, page_ids of the parsed content still refer to the full document. Note that font tags and page numbers
+            are derived from the parsed pages only.
+        :param cache_path: folder for checkpoints of the raw span extraction and of the parsing stages (default: no cache).
+            With a valid checkpoint the pdf is not opened by MuPDF and stages are restored instead of re-run.
+        :param page_workers: number of worker processes extracting pages of the document (see SpanStore.from_file).
+            The extracted pages are joined in page order before parsing, hence results do not depend on page_workers.
 
         """
-        self.doc = fitz.open(doc_path)
+        self.doc_path = doc_path
+        self._doc = None
         self.filename = doc_path.split("/")[-1]
-        self.doc_length = len(self.doc)
+        self.settings = {
+            "font_size_remainder": font_size_remainder,
+            "granularity": granularity,
+            "pageNumberStyleMatch": pageNumberStyleMatch,
+            "page_range": page_range,
+        }
+        self.page_workers = page_workers
+        self.cache = (
+            ParseCache(cache_path, doc_path, page_range) if cache_path else None
+        )
+        self.raw_checkpoint = self.cache.load_raw() if self.cache else None
+        self.doc_length = (
+            self.raw_checkpoint["doc_length"] if self.raw_checkpoint else len(self.doc)
+        )
+        self.page_range = (
+            range(self.doc_length)[slice(*page_range)]
+            if page_range
+            else range(self.doc_length)
+        )
+        self.spans = None  # SpanStore with the text spans of all pages
+        self.outline = None  # pdf outline (doc.getToC)
+        self.span_features = None  # SpanFeatures of the text spans
         self.styles = None
         self.font_counts = None
         self.parsed_content = []
@@ -76,8 +321,10 @@ class ParseDoc:
         self.pageNumberStyleMatch = pageNumberStyleMatch
         self.granularity = granularity
         self.page_numbers = None
+        self.page_numbers_by_page_id = None  # page_id -> page number on page
         self.max_page_num_bbox = None  # Max of all bbox coordinates for page numbers
         self.footnotes = None
+        self.footnotes_by_span = None  # (page_id, text, bbox) -> footnote
         self.size_tags = None
         self.toc = []
 
@@ -142,6 +389,66 @@ class ParseDoc:
         """ Get outer bounds of two bboxes. """
         return (min(a[0], c[0]), min(a[1], c[1]), max(a[2], c[2]), max(a[3], c[3]))
 
+    @property
+    def doc(self):
+        """The fitz document, opened on first use."""
+        if self._doc is None:
+            self._doc = fitz.open(self.doc_path)
+        return self._doc
+
+    def extract_spans(self) -> SpanStore:
+        """Extracts the text spans of all pages once. The result is shared by all parsing passes.
+        The raw extraction (spans and outline) is restored from or written to the parse cache if the ParseDoc has one.
+
+        :returns: SpanStore of the document.
+        """
+        if self.spans is None:
+            if self.raw_checkpoint:
+                self.spans, self.outline = (
+                    self.raw_checkpoint["spans"],
+                    self.raw_checkpoint["outline"],
+                )
+            else:
+                self.spans = (
+                    SpanStore.from_file(
+                        self.doc_path, self.page_range, self.page_workers
+                    )
+                    if self.page_workers > 1
+                    else SpanStore.from_doc(self.doc, self.page_range)
+                )
+                self.outline = self.doc.getToC(simple=True)
+                if self.cache:
+                    self.cache.save_raw(
+                        {
+                            "doc_length": self.doc_length,
+                            "spans": self.spans,
+                            "outline": self.outline,
+                        }
+                    )
+        return self.spans
+
+    def stage_key(self, stage: str) -> str:
+        """Key of a checkpointed parsing stage: hash of the raw extraction key, the settings and the source code of
+        the stage and all preceding stages."""
+        sha256 = hashlib.sha256(self.cache.raw_key.encode())
+        sha256.update(repr(sorted(self.settings.items())).encode())
+        for name in _CHECKPOINT_STAGES:
+            sha256.update(_stage_source(name).encode())
+            if name == stage:
+                break
+        return sha256.hexdigest()
+
+    def extract_span_features(self) -> SpanFeatures:
+        """Computes the feature columns of all text spans once.
+
+        :returns: SpanFeatures of the document.
+        """
+        if self.span_features is None:
+            self.span_features = SpanFeatures(
+                self.extract_spans(), self.doc_length, self.font_size_remainder
+            )
+        return self.span_features
+
     def extract_page_numbers(self, potential_page_numbers: List[Tuple]) -> List[Dict]:
         """ Method for extracting page numbers. Takes list of potential page numbers 
         (digits on page smaller than the number pages present in doc). Looks for the longest sequence of 
@@ -153,131 +460,116 @@ class ParseDoc:
         potential_page_numbers = sorted(
             potential_page_numbers, key=lambda x: x[2]
         )  # sort by page_id
-        potential_page_numbers_by_page_id = {}
-
-        for (
-            ppn,
-            bbox,
-            pageId,
-            styles,
-            verticalPage,
-            numeral_type,
-        ) in potential_page_numbers:
-            potential_page_numbers_by_page_id.setdefault(pageId, []).append(
-                (ppn, bbox, styles, verticalPage, numeral_type)
-            )
 
-        cnt_ppn = len(potential_page_numbers)
-        potential_page_sequence = {}
+        # Numeral style and value are computed once for each candidate
+        numeral_styles = [
+            "arabic" if val[0].isdigit() else "roman" for val in potential_page_numbers
+        ]
+        numeral_values = [
+            int(val[0]) if val[0].isdigit() else self.romanToInt(val[0])
+            for val in potential_page_numbers
+        ]
+        # Candidates continuing a sequence on a page are found by (page_id, numeral style, number)
+        candidates_by_page_number = {}
         for idx, val in enumerate(potential_page_numbers):
-            numeral_style = "arabic" if val[0].isdigit() else "roman"
-            ppn = int(val[0]) if val[0].isdigit() else self.romanToInt(val[0])
-            _, y0, _, y1 = val[1]
-            pageId = val[2]
-            styles = val[3]
-            verticalPage = val[4]
-
-            for ii in range(1, cnt_ppn + 1):
-                nextPageCandidate = ()
-                nextPageIdNumbers = potential_page_numbers_by_page_id.get(
-                    pageId + ii, []
-                )
-
-                for (
-                    _ppn,
-                    bbox,
-                    _styles,
-                    _verticalPage,
-                    numeral_type,
-                ) in nextPageIdNumbers:
-                    # Next page number must equal the previous number + 1
-                    _numeral_style = "arabic" if _ppn.isdigit() else "roman"
-                    _ppn_str = _ppn
-                    _ppn = int(_ppn) if _ppn.isdigit() else self.romanToInt(_ppn)
-
-                    if _ppn == ppn + ii and numeral_style == _numeral_style:
-                        error_sum = abs(bbox[1] - y0) + abs(bbox[3] - y1)
-
-                        if pageNumberStyleMatch == "exact":
-                            style_match = all(
-                                [_styles.get(k) == v for k, v in styles.items()]
-                            )
-                        elif pageNumberStyleMatch == "rough":
-                            style_match = any(
-                                [
-                                    x == y
-                                    for x, y in product(
-                                        _styles["font"].split("+"),
-                                        styles["font"].split("+"),
-                                    )
-                                ]
-                            ) * (_styles["size"] == styles["size"])
-                        else:
-                            style_match = _styles["size"] == styles["size"]
-
-                        # if page direction is the same as start page and error_sum is high then it is likely not a page number
-                        if verticalPage == _verticalPage and error_sum > 200:
-                            continue
-
-                        if nextPageCandidate:
-                            prev_bbox = nextPageCandidate[1]
-                            nextPageCandidate = (
-                                (
-                                    _ppn_str,
-                                    bbox,
-                                    pageId + ii,
-                                    styles,
-                                    _verticalPage,
-                                    error_sum,
-                                    style_match,
-                                    numeral_type,
-                                )
-                                if error_sum
-                                < (abs(prev_bbox[1] - y0) + abs(prev_bbox[3] - y1))
-                                and style_match
-                                else nextPageCandidate
-                            )
-                        elif style_match:
-                            nextPageCandidate = (
-                                _ppn_str,
-                                bbox,
-                                pageId + ii,
-                                styles,
-                                _verticalPage,
-                                error_sum,
-                                style_match,
-                                numeral_type,
-                            )
-
-                if len(nextPageCandidate) > 0:
-                    potential_page_sequence[idx] = potential_page_sequence.get(
-                        idx, [val]
-                    ) + [nextPageCandidate]
-                else:
-                    break
+            candidates_by_page_number.setdefault(
+                (val[2], numeral_styles[idx], numeral_values[idx]), []
+            ).append(idx)
+
+        def style_match(styles: dict, _styles: dict) -> bool:
+            if pageNumberStyleMatch == "exact":
+                return all([_styles.get(k) == v for k, v in styles.items()])
+            elif pageNumberStyleMatch == "rough":
+                return any(
+                    [
+                        x == y
+                        for x, y in product(
+                            _styles["font"].split("+"),
+                            styles["font"].split("+"),
+                        )
+                    ]
+                ) * (_styles["size"] == styles["size"])
+            return _styles["size"] == styles["size"]
+
+        def next_page_number(idx: int, ii: int) -> Optional[int]:
+            """Best candidate ii pages after the sequence start idx: the number must equal the start number + ii
+            and the candidate with the smallest vertical bbox distance to the start (first on ties) is chosen.
+            """
+            _, bbox, pageId, styles, verticalPage, _ = potential_page_numbers[idx]
+            _, y0, _, y1 = bbox
+            next_idx, next_error_sum = None, None
+            for _idx in candidates_by_page_number.get(
+                (pageId + ii, numeral_styles[idx], numeral_values[idx] + ii), []
+            ):
+                _, _bbox, _, _styles, _verticalPage, _ = potential_page_numbers[_idx]
+                error_sum = abs(_bbox[1] - y0) + abs(_bbox[3] - y1)
+                # if page direction is the same as start page and error_sum is high then it is likely not a page number
+                if verticalPage == _verticalPage and error_sum > 200:
+                    continue
+                if style_match(styles, _styles) and (
+                    next_idx is None or error_sum < next_error_sum
+                ):
+                    next_idx, next_error_sum = _idx, error_sum
+            return next_idx
+
+        def sequence_signature(idx: int) -> tuple:
+            """Candidates with equal signatures select the same candidates on the following pages."""
+            _, bbox, _, styles, verticalPage, _ = potential_page_numbers[idx]
+            return (bbox[1], bbox[3], styles["size"], styles["font"], verticalPage)
+
+        # Longest sequence of page numbers starting at each candidate (dynamic programming from the last page).
+        # If a start and its next page number have the same signature the sequence continues as the sequence
+        # of the next page number, otherwise the sequence is followed page by page.
+        sequence_next = {}  # idx -> next page number in sequence started at idx
+        sequence_links = (
+            {}
+        )  # idx -> idx of the start whose sequence continues the sequence
+        sequence_lengths = {}
+        for idx in reversed(range(len(potential_page_numbers))):
+            next_idx = next_page_number(idx, 1)
+            if next_idx is None:
+                continue
+            if sequence_signature(idx) == sequence_signature(next_idx):
+                sequence_links[idx] = next_idx
+                sequence_lengths[idx] = 1 + sequence_lengths.get(next_idx, 1)
+            else:
+                ii, sequence = 1, []
+                while next_idx is not None:
+                    sequence.append(next_idx)
+                    ii += 1
+                    next_idx = next_page_number(idx, ii)
+                sequence_next[idx] = sequence
+                sequence_lengths[idx] = 1 + len(sequence)
+
+        def iter_sequence(idx: int):
+            """Yields the candidates of the sequence starting at idx."""
+            yield idx
+            while idx in sequence_links:
+                idx = sequence_links[idx]
+                yield idx
+            yield from sequence_next.get(idx, [])
 
         page_numbers = []
-        added_page_number_sequence_start = []
-        for idx, val in sorted(
-            potential_page_sequence.items(), key=lambda item: len(item[1]), reverse=True
+        added_page_number_sequence_start = set()
+        for idx in sorted(
+            sequence_lengths, key=lambda idx: (-sequence_lengths[idx], idx)
         ):
-
-            # if idx == 0:
             page_number_sequence = []
-            for v in val:
-                id_str = v[0] + str(v[1])
+            for _idx in iter_sequence(idx):
+                text, bbox, pageId, _, verticalPage, _ = potential_page_numbers[_idx]
+                id_str = text + str(bbox)
                 if id_str in added_page_number_sequence_start:
                     break
                 else:
                     page_number_sequence.append(
                         {
-                            "text": v[0],
-                            "bbox": v[1],
-                            "page_id": v[2],
-                            "verticalpage": v[4],
+                            "text": text,
+                            "bbox": bbox,
+                            "page_id": pageId,
+                            "verticalpage": verticalPage,
                         }
                     )
-                    added_page_number_sequence_start.append(id_str)
+                    added_page_number_sequence_start.add(id_str)
             if (
                 len(page_number_sequence) > 4
             ):  # page number sequences are assumed to be at least 5
@@ -294,6 +586,7 @@ class ParseDoc:
 
         return page_numbers
 
+    @_checkpoint(attributes=["size_tags"])
     def font_tags(self) -> dict:
         """Returns dictionary with font sizes as keys and tags as value.
 
@@ -359,6 +652,24 @@ class ParseDoc:
         self.size_tags = size_tags
         return size_tags
 
+    @_checkpoint(
+        attributes=[
+            "styles",
+            "font_counts",
+            "page_numbers",
+            "page_numbers_by_page_id",
+            "max_page_num_bbox",
+        ],
+        helpers=[
+            "extract_span_features",
+            "extract_page_numbers",
+            "_max_bbox",
+            "SpanFeatures",
+            "_ROMAN_NUMERAL_PATTERN",
+            "_SECTION_DIGIT_PATTERN",
+            "_SECTION_DIGIT_DOT_SPACE_PATTERN",
+        ],
+    )
     def fonts_and_page_numbers(
         self, granularity: bool = False
     ) -> Tuple[List, Dict, List]:
@@ -369,83 +680,49 @@ class ParseDoc:
         :param granularity: also use 'font', 'flags' and 'color' to discriminate text
         :returns: Most used Fonts sorted by count, List of font style information according to granularity, List of Page numbers and bbox info
         """
-        doc = self.doc
-        doc_length = len(doc)
+        spans, features = self.extract_spans(), self.extract_span_features()
 
         styles = {}
         font_counts = {}
         potential_page_numbers = []
-        font_size_remainder = self.font_size_remainder
         granularity = self.granularity
         page_numbers = None
 
-        for page_id, page in enumerate(doc):
-            page_dict = page.getText("dict")
-            blocks = page_dict["blocks"]
-            for b in blocks:  # iterate through the text blocks
-                if b["type"] == 0:  # block contains text
-                    for l in b["lines"]:  # iterate through the text lines
-                        for s in l["spans"]:  # iterate through the text spans
-                            font_size = (
-                                round(s["size"], font_size_remainder)
-                                if font_size_remainder
-                                else s["size"]
-                            )
-                            if granularity:
-                                identifier = "{0}_{1}".format(font_size, s["font"])
-                                styles[identifier] = {
-                                    "size": font_size,
-                                    "font": s["font"],
-                                }
-                            else:
-                                identifier = "{0}".format(font_size)
-                                styles[identifier] = {
-                                    "size": font_size,
-                                    "font": s["font"],
-                                }
-                            bbox = s["bbox"]
-                            text = s["text"].strip()
-
-                            # if text str is digit and digit is smaller than doc length + increment (some docs have more pages than numbered)
-                            if (
-                                len(text) < 6 and text.count("+") == 0
-                            ):  # page numbers must be smaller than 10000
-                                try:
-                                    arabic_page_number = (
-                                        0 <= int(text) < (doc_length + 50)
-                                    )
-                                except ValueError:  # raises ValueError f text cannot be converted to int
-                                    arabic_page_number = False
-
-                                roman_numeral = re.search(
-                                    _ROMAN_NUMERAL_PATTERN, text.upper()
-                                )
-
-                                if arabic_page_number or (
-                                    roman_numeral
-                                    and (
-                                        roman_numeral.span()[1]
-                                        - roman_numeral.span()[0]
-                                    )
-                                    == len(text)
-                                ):
-                                    verticalPage = int(page_dict["height"]) > int(
-                                        page_dict["width"]
-                                    )
-                                    potential_page_numbers.append(
-                                        (
-                                            text,
-                                            bbox,
-                                            page_id,
-                                            styles[identifier],
-                                            verticalPage,
-                                            "digit" if text.isdigit() else "roman",
-                                        )
-                                    )
+        for page_id in range(spans.page_count):
+            verticalPage = int(spans.page_height[page_id]) > int(
+                spans.page_width[page_id]
+            )
+            for span_idx in spans.page_spans(page_id):  # iterate through the text spans
+                font = spans.font(span_idx)
+                font_size = features.size[span_idx]
+                if granularity:
+                    identifier = "{0}_{1}".format(font_size, font)
+                    styles[identifier] = {
+                        "size": font_size,
+                        "font": font,
+                    }
+                else:
+                    identifier = "{0}".format(font_size)
+                    styles[identifier] = {
+                        "size": font_size,
+                        "font": font,
+                    }
+
+                if features.is_page_number[span_idx]:
+                    potential_page_numbers.append(
+                        (
+                            features.text[span_idx],
+                            spans.span_bbox(span_idx),
+                            page_id,
+                            styles[identifier],
+                            verticalPage,
+                            "digit" if features.is_digit[span_idx] else "roman",
+                        )
+                    )
 
-                            font_counts[identifier] = (
-                                font_counts.get(identifier, 0) + 1
-                            )  # count the fonts usage
+                font_counts[identifier] = (
+                    font_counts.get(identifier, 0) + 1
+                )  # count the fonts usage
 
         page_numbers = self.extract_page_numbers(potential_page_numbers)
 
@@ -462,9 +739,15 @@ class ParseDoc:
         self.styles = styles
         self.font_counts = font_counts
         self.page_numbers = page_numbers
+        self.page_numbers_by_page_id = {}
+        for p in page_numbers:
+            self.page_numbers_by_page_id.setdefault(p["page_id"], p)
 
         return font_counts, styles, page_numbers
 
+    @_checkpoint(
+        attributes=["footnotes", "footnotes_by_span"], helpers=["FootnoteTracker"]
+    )
     def get_footnotes(self) -> List[Dict]:
         """Identifies footnotes (numbers) in PDF document. 
 
@@ -474,77 +757,66 @@ class ParseDoc:
         """
         assert self.size_tags, "Size tags need to be calculated first"
 
-        doc = self.doc
-        doc_length = len(doc)
+        spans, features = self.extract_spans(), self.extract_span_features()
         prev_s = {}
-        potential_footnotes = []
-        font_size_remainder = self.font_size_remainder
+        footnotes = FootnoteTracker()
         size_tags = self.size_tags
         granularity = self.granularity
         added_potential_footnote = False
-        for page_id, page in enumerate(doc):
-            page_dict = page.getText("dict")
-            blocks = page_dict["blocks"]
+        for page_id in range(spans.page_count):
             potential_page_footnotes = []
-            for b in blocks:  # iterate through the text blocks
-                if b["type"] == 0:  # block contains text
-                    for line_id, l in enumerate(
-                        b["lines"]
-                    ):  # iterate through the text lines
-                        for s in l["spans"]:  # iterate through the text spans
-                            font_size = (
-                                round(s["size"], font_size_remainder)
-                                if font_size_remainder
-                                else s["size"]
-                            )
-                            s["line_id"] = line_id
-
-                            bbox = s["bbox"]
-                            text = s["text"].strip()
-                            font = s["font"]
-
-                            if added_potential_footnote:
-                                if len(potential_page_footnotes) > 0:
-                                    potential_page_footnotes[-1]["next_s"] = {
-                                        "bbox": bbox,
-                                        "size": font_size,
-                                    }
-                                added_potential_footnote = False
-
-                            if text.isdigit():
-                                potential_page_footnotes.append(
-                                    {
-                                        "text": text,
-                                        "page_id": page_id,
-                                        "bbox": bbox,
-                                        "size": font_size,
-                                        "font": font,
-                                        "is_page_bottom": False,
-                                        "prev_s": {
-                                            "bbox": prev_s.get("bbox"),
-                                            "size": prev_s.get("size"),
-                                        },
-                                        "next_s": None,
-                                    }
-                                )
-                                added_potential_footnote = True
+            for _, _, _, line_spans in spans.page_lines(
+                page_id
+            ):  # iterate through the text lines
+                for span_idx in line_spans:  # iterate through the text spans
+                    font_size = features.size[span_idx]
+                    bbox = spans.span_bbox(span_idx)
+                    text = features.text[span_idx]
+                    font = spans.font(span_idx)
+
+                    if added_potential_footnote:
+                        if len(potential_page_footnotes) > 0:
+                            potential_page_footnotes[-1]["next_s"] = {
+                                "bbox": bbox,
+                                "size": font_size,
+                            }
+                        added_potential_footnote = False
+
+                    if features.is_digit[span_idx]:
+                        potential_page_footnotes.append(
+                            {
+                                "text": text,
+                                "page_id": page_id,
+                                "bbox": bbox,
+                                "size": font_size,
+                                "font": font,
+                                "is_page_bottom": False,
+                                "prev_s": {
+                                    "bbox": prev_s.get("bbox"),
+                                    "size": prev_s.get("size"),
+                                },
+                                "next_s": None,
+                            }
+                        )
+                        added_potential_footnote = True
 
-                        prev_s = s
+                if len(line_spans) > 0:  # previous span is the last span of the line
+                    prev_s = {
+                        "bbox": spans.span_bbox(line_spans[-1]),
+                        "size": spans.size[line_spans[-1]],
+                    }
 
             # count page frequency identified potential footnote digits
-            ppf_count = dict(Counter([pf["text"] for pf in potential_page_footnotes]))
+            ppf_count = Counter(pf["text"] for pf in potential_page_footnotes)
 
             # add ppf_count key to dict (counts number of occurences of potential footnote digit on page)
-            potential_page_footnotes = [
-                {**ppf, **{"ppf_count": ppf_count[ppf["text"]]}}
-                for ppf in potential_page_footnotes
-            ]
+            for ppf in potential_page_footnotes:
+                ppf["ppf_count"] = ppf_count[ppf["text"]]
 
-            # Create a list of invalid potential page footnotes
+            # Remove invalid potential page footnotes
             # Footnotes are invalid if tag is paragraph or header or if not subscripted
-            invalid_footnotes = []
-
-            for idx, pf in enumerate(potential_page_footnotes):
+            valid_page_footnotes = []
+            for pf in potential_page_footnotes:
                 size_tag = (
                     size_tags["{}_{}".format(pf["size"], pf["font"])]
                     if granularity
@@ -552,523 +824,507 @@ class ParseDoc:
                 )
 
                 if "<h" in size_tag or "<p" in size_tag:
-                    invalid_footnotes.append(idx)
+                    continue
                 elif not (
                     pf["next_s"] == None
                     or pf["prev_s"]["size"] > pf["size"]
                     or pf["next_s"]["size"] > pf["size"]
                 ):
-                    invalid_footnotes.append(idx)
-
-            # Delete all invalid footnotes
-            for idx in sorted(invalid_footnotes, reverse=True):
-                del potential_page_footnotes[idx]
+                    continue
+                valid_page_footnotes.append(pf)
+            potential_page_footnotes = valid_page_footnotes
 
             # Create a new count page frequency of identified potential footnotes
-            ppf_count = dict(Counter([pf["text"] for pf in potential_page_footnotes]))
+            ppf_count = Counter(pf["text"] for pf in potential_page_footnotes)
 
             # Add potential page footnotes to potential document footnotes (sort using frequency counts)
-            added_page_footnotes = []
+            added_page_footnotes = set()
             for ppf in potential_page_footnotes:
-                pf_count = dict(Counter([pf["text"] for pf in potential_footnotes]))
-                if len(potential_footnotes) > 0:
+                if ppf_count[ppf["text"]] != 2:
+                    continue
+                if len(footnotes) > 0:
                     if (
-                        ppf_count[ppf["text"]] == 2
-                        and int(ppf["text"]) == int(potential_footnotes[-1]["text"]) + 1
+                        int(ppf["text"]) == footnotes.last_number + 1
                         and ppf["text"] not in added_page_footnotes
                     ):
-
                         ppf["ppf_count"] = 2
-                        potential_footnotes.append(ppf)
-                        added_page_footnotes.append(ppf["text"])
-                    elif (
-                        ppf_count[ppf["text"]] == 2
-                        and pf_count.get(ppf["text"], 10) < 2
-                    ):
+                        footnotes.add(ppf)
+                        added_page_footnotes.add(ppf["text"])
+                    elif footnotes.count(ppf["text"]) == 1:
                         ppf["ppf_count"] = 2
                         ppf["is_page_bottom"] = True
-                        potential_footnotes.append(ppf)
-                        added_page_footnotes.append(ppf["text"])
-                elif ppf_count[ppf["text"]] == 2:
+                        footnotes.add(ppf)
+                        added_page_footnotes.add(ppf["text"])
+                else:
                     ppf["ppf_count"] = 2
-                    potential_footnotes.append(ppf)
-                    added_page_footnotes.append(ppf["text"])
-
-        self.footnotes = potential_footnotes
-        return potential_footnotes
-
+                    footnotes.add(ppf)
+                    added_page_footnotes.add(ppf["text"])
+
+        self.footnotes = footnotes.footnotes
+        self.footnotes_by_span = {}
+        for f in self.footnotes:
+            self.footnotes_by_span.setdefault(
+                (f["page_id"], f["text"], tuple(f["bbox"])), f
+            )
+        return footnotes.footnotes
+
+    @_checkpoint(
+        attributes=["parsed_content"],
+        helpers=[
+            "iter_content",
+            "_remove_rowbreak_dashes",
+            "TocTextIndex",
+            "_TOC_DOTS_PAGE_NUMBER_REGEX",
+            "_SPECIAL_CHAR_PATTERNS",
+        ],
+    )
     def parse_content(self) -> List[Dict]:
         """Extracts headers & paragraphs from PDF and return texts with element tags.
         Identifies also if text excerpt is a page number or a footnote.
 
-        :param write_files: if True outputs a markdown and text file of parsed document.
         :return: List of text blocks with pre-prended element tags, type (footnote, page_number,...).
         """
-        doc, size_tag = self.doc, self.size_tags
-        parsed_content = []  # list with headers and paragraphs
+        parsed_content = [bl for blocks in self.iter_content() for bl in blocks]
+        self.parsed_content = parsed_content
+
+        return parsed_content
+
+    def iter_content(self) -> Iterator[List[Dict]]:
+        """Extracts the content blocks page by page (see parse_content). Blocks only depend on the blocks of their
+        own page once the page has been parsed, hence the blocks of a page are final when they are yielded.
+
+        :return: iterator of the list of text blocks of each page.
+        """
+        spans, size_tag = self.extract_spans(), self.size_tags
+        features = self.extract_span_features()
+        last_block = None  # last finished block
         prev_s, ps = (
             {},
             {},
         )  # prev_s: previous span / ps: previous non empty string span
-        prev_line_id, prev_block_id, prev_line_length = 0, 0, 0
+        prev_line_id, prev_line_length = 0, 0
         s_footnote = {}
         prev_page_id = 0
         cnt_spans = 0
         last_footnote_id_pos = -1
         block_dict = {}
         granularity = self.granularity
-        font_size_remainder = self.font_size_remainder
         potential_header = ""
-        toc = ""  # temporary table of content holder
+        toc = TocTextIndex()  # temporary table of content holder
         toc_numbers = []
         toc_page_ids = set()  # temporary table of content page_ids holder
-        for page_id, page in enumerate(doc):
+        for page_id in range(spans.page_count):
+            parsed_content = []  # list with headers and paragraphs of the page
             is_new_footnote = False
-            blocks = page.getText("dict")["blocks"]
-            page_number = next(
-                (p for p in self.page_numbers if p.get("page_id") == page_id), None
-            )
-            page_footnotes = [f for f in self.footnotes if f.get("page_id") == page_id]
-            for block_id, b in enumerate(blocks):  # iterate through the text blocks
-                if b["type"] == 0:  # this block contains text
-
-                    # REMEMBER: multiple fonts and sizes are possible IN one block
-                    for line_id, l in enumerate(
-                        b["lines"]
-                    ):  # iterate through the text lines
-                        spans_length = len(l["spans"])
-                        line_length = l["bbox"][2] - l["bbox"][0]
-
-                        for span_id, s in enumerate(
-                            l["spans"]
-                        ):  # iterate through the text spans
-                            # s["text"] = s["text"].encode("ascii", "ignore").decode()
-
-                            # s_text = self.clean_text(
-                            #    s["text"]
-                            # )  # removing whitespaces and unicode chars
-                            s_text = "{}".format(s["text"].strip())
-                            s["size"] = (
-                                round(s["size"], font_size_remainder)
-                                if font_size_remainder
-                                else s["size"]
-                            )
-                            s_size = s["size"]
-                            s_bbox = s["bbox"]
+            page_number = self.page_numbers_by_page_id.get(page_id)
+            # REMEMBER: multiple fonts and sizes are possible IN one block
+            for block_id, line_id, line_length, line_spans in spans.page_lines(
+                page_id
+            ):  # iterate through the text lines
+                spans_length = len(line_spans)
+
+                for span_idx in line_spans:  # iterate through the text spans
+                    s = spans.span(span_idx)
+                    # s["text"] = s["text"].encode("ascii", "ignore").decode()
+
+                    # s_text = self.clean_text(
+                    #    s["text"]
+                    # )  # removing whitespaces and unicode chars
+                    s_text = features.text[span_idx]
+                    s["size"] = features.size[span_idx]
+                    s_size = s["size"]
+                    s_bbox = s["bbox"]
+
+                    # whether to distinguish between font type in tags
+                    if granularity:
+                        s_tag = size_tag["{}_{}".format(s_size, s["font"])]
+                    else:
+                        s_tag = size_tag[s_size]
+                    s["tag"] = s_tag
 
-                            # whether to distinguish between font type in tags
-                            if granularity:
-                                s_tag = size_tag["{}_{}".format(s_size, s["font"])]
-                            else:
-                                s_tag = size_tag[s_size]
-                            s["tag"] = s_tag
+                    # Is the span a page number?
+                    is_page_number = False
+                    if page_number and page_number["bbox"] == s_bbox:
+                        is_page_number = True
 
-                            # Is the span a page number?
-                            is_page_number = False
-                            if page_number and page_number["bbox"] == s_bbox:
-                                is_page_number = True
-
-                            # create a temporary table of content text storage for header identification below
-                            if page_id < 20:
-                                if "..." in s_text or page_id in toc_page_ids:
-
-                                    if is_page_number == False:
-                                        toc += s["text"]
-                                        toc_number = re.search(
-                                            _SECTION_DIGIT_PATTERN[1:], s_text
-                                        )
-                                        if toc_number and not re.search(
-                                            r"[\.]{2,}[\s]?[0-9]+", s_text
-                                        ):
-                                            toc_numbers.append(toc_number.group())
-                                        toc_page_ids.add(page_id)
-
-                            # if line contains only one span and this span only contains whitespace then we assume a new paragraph has started -> store and commence new block
-                            if spans_length == 1 and len(s_text) == 0:
-                                if block_dict:
-                                    parsed_content.append(block_dict)
-                                block_dict = {}
-                                last_new_paragraph_line = (block_id, line_id)
-                                break
-
-                            s_color = s["color"]
-                            s["line_id"] = line_id
-                            s["block_id"] = block_id
-
-                            if s_text:
-                                cnt_spans += 1
-                                for footnote in page_footnotes:
-                                    if (
-                                        s_text == footnote["text"]
-                                        and s_bbox == footnote["bbox"]
-                                    ):
-                                        is_new_footnote = True
-                                        s_footnote = footnote
-                                        break
-
-                                font_type_changed = s["font"] != ps.get("font")
-                                block_or_line_change = line_id != ps.get(
-                                    "line_id"
-                                ) or block_id != ps.get("block_id")
-
-                                # A new paragraph should imply a switch either a new line_id or block_id.
-                                # The difference between current span y0 and previous span y1 should also be close to previous text size.
-                                # Current span y0 and y1 should also differ significantly
-                                if (
-                                    ps
-                                    and block_or_line_change
-                                    and abs(s_bbox[1] - ps["bbox"][3])
-                                    > ps.get("size", 5) * 0.85
-                                    and abs(s_bbox[1] - ps["bbox"][1]) > 2
-                                    and abs(s_bbox[3] - ps["bbox"][3]) > 2
-                                ):
-                                    plausible_new_paragraph = True
-                                else:
-                                    plausible_new_paragraph = False
-
-                                # Short lines may also signify plausible new paragraphs or lines starting with e.g. 3.1.
-                                if not plausible_new_paragraph:
-                                    if (
-                                        ps
-                                        and (
-                                            line_id != ps.get("line_id")
-                                            or block_id != ps.get("block_id")
-                                        )
-                                        and (
-                                            (
-                                                font_type_changed
-                                                and line_length * 0.7 > prev_line_length
-                                            )
-                                            or re.search(
-                                                _SECTION_DIGIT_DOT_SPACE_PATTERN,
-                                                s["text"],
-                                            )
-                                        )
-                                    ):
-                                        plausible_new_paragraph = True
-
-                                # Is there a space between spans
-                                no_space_between_spans = False
-                                if (
-                                    prev_s
-                                    and block_or_line_change == False
-                                    and prev_s.get("text")[-1] != " "
-                                ) and s["text"][0] != " ":
-                                    no_space_between_spans = True
-
-                                # header detection
-                                # if page_id == 31 and re.search(
-                                #     _SECTION_DIGIT_PATTERN[1:], s_text
-                                # ):
-                                #     print(
-                                #         "potential_header",
-                                #         s_text,
-                                #         s_text.lower() in toc.lower(),
-                                #     )
-                                #     # print(toc)
-
-                                end_of_header = False
+                    # create a temporary table of content text storage for header identification below
+                    if page_id < 20:
+                        if "..." in s_text or page_id in toc_page_ids:
+
+                            if is_page_number == False:
+                                toc.append(s["text"])
+                                toc_number = _SECTION_DIGIT_REGEX.search(s_text)
                                 if (
-                                    potential_header == ""
-                                    and re.search(_SECTION_DIGIT_PATTERN[1:], s_text)
-                                    and s["text"].lower() in toc.lower()
+                                    toc_number
+                                    and not _TOC_DOTS_PAGE_NUMBER_REGEX.search(s_text)
                                 ):
-                                    potential_header = s["text"].lower()
-                                elif (
-                                    potential_header
-                                    and (potential_header + s["text"].lower()).strip()
-                                    in toc.lower()
-                                ):
-                                    potential_header += s["text"].lower()
-                                elif (
-                                    len(potential_header) > 10
-                                    and potential_header.lower() in toc.lower()
-                                ):
-                                    end_of_header = True
-                                    potential_header = ""
-                                else:
-                                    potential_header = ""
-
-                                # if (
-                                #     potential_header
-                                #     and font_type_changed == False
-                                #     and is_page_number == False
-                                #     and potential_header.lower() in toc.lower()
-                                #     # and s_size == ps.get("size", 0)
-                                # ):
-                                #     if page_id == 31:
-                                #         print(
-                                #             "xxxx", potential_header, font_type_changed
-                                #         )
-                                #     potential_header += s["text"]
-                                # elif (
-                                #     len(potential_header) > 10
-                                #     and potential_header.lower() in toc.lower()
-                                # ):
-                                #     end_of_header = True
-                                #     potential_header = ""
-                                # else:
-                                #     potential_header = ""
-
-                                # if not plausible_new_paragraph:
-                                #     if ps and (
-                                #         line_id != ps.get("line_id")
-                                #         or block_id != ps.get("block_id")
-                                #     ):
-                                #         if (
-                                #             ps.get("font") != s["font"]
-                                #             and line_length * 0.4 > prev_line_length
-                                #         ) or re.search(_SECTION_DIGIT_PATTERN, s_text):
-                                #             plausible_new_paragraph = True
-
-                                # # # Short lines may also signify plausible new paragraphs
-                                # if not plausible_new_paragraph:
-                                #     if (
-                                #         ps
-                                #         and (
-                                #             line_id != ps.get("line_id")
-                                #             or block_id != ps.get("block_id")
-                                #         )
-                                #         and abs(s_bbox[1] - ps["bbox"][3])
-                                #         > ps.get("size", 5) * 0.85
-                                #         and abs(s_bbox[0] - s_bbox[2]) * 0.5
-                                #         > abs(ps["bbox"][0] - ps["bbox"][2])
-                                #     ):
-                                #         plausible_new_paragraph = True
-
-                                # if page_id == 31 and 0 < block_id < 10:
-                                #     # print("toc", toc_numbers)
-                                #     print(
-                                #         s_text,
-                                #         # round(abs(s_bbox[0] - s_bbox[2])),
-                                #         # round(abs(ps["bbox"][0] - ps["bbox"][2])),
-                                #         # ps.get("block_id"),
-                                #         # block_id,
-                                #         # ps.get("line_id"),
-                                #         # line_id,
-                                #         # "-->",
-                                #         # len(s["text"] + " "),
-                                #         # ps.get("text"),
-                                #         # plausible_new_paragraph == False,
-                                #         # s_size,
-                                #         # no_space_between_spans,
-                                #         # block_or_line_change,
-                                #         end_of_header,
-                                #         "-->",
-                                #         s_size == ps.get("size", 0)
-                                #         or no_space_between_spans,
-                                #         bool((1 - plausible_new_paragraph)),
-                                #         prev_page_id + 1 == page_id,
-                                #         s_color == ps.get("color"),
-                                #     )
-
-                                # if font size and color is the same as previous span then we assume that they are connected in a paragraph
-                                if (
+                                    toc_numbers.append(toc_number.group())
+                                toc_page_ids.add(page_id)
+
+                    # if line contains only one span and this span only contains whitespace then we assume a new paragraph has started -> store and commence new block
+                    if spans_length == 1 and len(s_text) == 0:
+                        if block_dict:
+                            parsed_content.append(block_dict)
+                            last_block = block_dict
+                        block_dict = {}
+                        last_new_paragraph_line = (block_id, line_id)
+                        break
+
+                    s_color = s["color"]
+                    s["line_id"] = line_id
+                    s["block_id"] = block_id
+
+                    if s_text:
+                        cnt_spans += 1
+                        footnote = self.footnotes_by_span.get((page_id, s_text, s_bbox))
+                        if footnote:
+                            is_new_footnote = True
+                            s_footnote = footnote
+
+                        font_type_changed = s["font"] != ps.get("font")
+                        block_or_line_change = line_id != ps.get(
+                            "line_id"
+                        ) or block_id != ps.get("block_id")
+
+                        # A new paragraph should imply a switch either a new line_id or block_id.
+                        # The difference between current span y0 and previous span y1 should also be close to previous text size.
+                        # Current span y0 and y1 should also differ significantly
+                        if (
+                            ps
+                            and block_or_line_change
+                            and features.prev_gap[span_idx] > ps.get("size", 5) * 0.85
+                            and features.vertical_shift[span_idx]
+                        ):
+                            plausible_new_paragraph = True
+                        else:
+                            plausible_new_paragraph = False
+
+                        # Short lines may also signify plausible new paragraphs or lines starting with e.g. 3.1.
+                        if not plausible_new_paragraph:
+                            if (
+                                ps
+                                and (
+                                    line_id != ps.get("line_id")
+                                    or block_id != ps.get("block_id")
+                                )
+                                and (
                                     (
-                                        s_size == ps.get("size", 0)
-                                        or no_space_between_spans
-                                        or not block_or_line_change
-                                    )
-                                    and (1 - plausible_new_paragraph)
-                                    and len(block_dict.get("text", "")) > 0
-                                    and prev_page_id + 1 == page_id
-                                    and is_new_footnote == False
-                                    and is_page_number == False
-                                    and end_of_header == False
-                                    # and s_color == ps.get("color")
-                                ):
-                                    # if (
-                                    #     s_size == ps.get("size", 0)
-                                    #     and len(block_dict.get("text", "")) > 0
-                                    #     and prev_page_id + 1 == page_id
-                                    #     and (
-                                    #         1
-                                    #         - font_type_changed
-                                    #         * plausible_new_paragraph
-                                    #         * granularity
-                                    #     )
-                                    #     and plausible_new_paragraph == False
-                                    #     and is_new_footnote == False
-                                    #     and s_color == ps.get("color")
-                                    # ):
-
-                                    block_dict["text"] = self._remove_rowbreak_dashes(
-                                        ps,
-                                        s_text,
-                                        block_dict["text"],
-                                        line_id,
-                                        no_space_between_spans,
-                                    )
-                                    block_dict["bbox"] = self._max_bbox(
-                                        s_bbox, block_dict["bbox"]
+                                        font_type_changed
+                                        and line_length * 0.7 > prev_line_length
                                     )
+                                    or features.starts_with_section_number[span_idx]
+                                )
+                            ):
+                                plausible_new_paragraph = True
 
-                                    # if (
-                                    #     page_id == 3
-                                    #     and 0 < block_id < 10
-                                    #     and "1" == s_text  # "Introdu" in s_text
-                                    # ):
-                                    #     print("--->>", s_text)
-                                    #     print(block_dict["text"])
-
-                                elif (
-                                    block_dict.get("type") == "footnote_text"
-                                    and is_new_footnote == False
-                                    and is_page_number == False
-                                ):
-                                    block_dict["text"] = self._remove_rowbreak_dashes(
-                                        ps,
-                                        s_text,
-                                        block_dict["text"],
-                                        line_id,
-                                        no_space_between_spans,
-                                    )
-                                    block_dict["merged_tags"] += "_" + s_tag
+                        # Is there a space between spans
+                        no_space_between_spans = False
+                        if (
+                            prev_s
+                            and block_or_line_change == False
+                            and prev_s.get("text")[-1] != " "
+                        ) and s["text"][0] != " ":
+                            no_space_between_spans = True
+
+                        # header detection
+                        # if page_id == 31 and re.search(
+                        #     _SECTION_DIGIT_PATTERN[1:], s_text
+                        # ):
+                        #     print(
+                        #         "potential_header",
+                        #         s_text,
+                        #         s_text.lower() in toc.lower(),
+                        #     )
+                        #     # print(toc)
+
+                        end_of_header = False
+                        if (
+                            potential_header == ""
+                            and features.has_section_digit[span_idx]
+                            and s["text"].lower() in toc
+                        ):
+                            potential_header = s["text"].lower()
+                        elif (
+                            potential_header
+                            and (potential_header + s["text"].lower()).strip() in toc
+                        ):
+                            potential_header += s["text"].lower()
+                        elif (
+                            len(potential_header) > 10
+                            and potential_header.lower() in toc
+                        ):
+                            end_of_header = True
+                            potential_header = ""
+                        else:
+                            potential_header = ""
+
+                        # if (
+                        #     potential_header
+                        #     and font_type_changed == False
+                        #     and is_page_number == False
+                        #     and potential_header.lower() in toc.lower()
+                        #     # and s_size == ps.get("size", 0)
+                        # ):
+                        #     if page_id == 31:
+                        #         print(
+                        #             "xxxx", potential_header, font_type_changed
+                        #         )
+                        #     potential_header += s["text"]
+                        # elif (
+                        #     len(potential_header) > 10
+                        #     and potential_header.lower() in toc.lower()
+                        # ):
+                        #     end_of_header = True
+                        #     potential_header = ""
+                        # else:
+                        #     potential_header = ""
+
+                        # if not plausible_new_paragraph:
+                        #     if ps and (
+                        #         line_id != ps.get("line_id")
+                        #         or block_id != ps.get("block_id")
+                        #     ):
+                        #         if (
+                        #             ps.get("font") != s["font"]
+                        #             and line_length * 0.4 > prev_line_length
+                        #         ) or re.search(_SECTION_DIGIT_PATTERN, s_text):
+                        #             plausible_new_paragraph = True
+
+                        # # # Short lines may also signify plausible new paragraphs
+                        # if not plausible_new_paragraph:
+                        #     if (
+                        #         ps
+                        #         and (
+                        #             line_id != ps.get("line_id")
+                        #             or block_id != ps.get("block_id")
+                        #         )
+                        #         and abs(s_bbox[1] - ps["bbox"][3])
+                        #         > ps.get("size", 5) * 0.85
+                        #         and abs(s_bbox[0] - s_bbox[2]) * 0.5
+                        #         > abs(ps["bbox"][0] - ps["bbox"][2])
+                        #     ):
+                        #         plausible_new_paragraph = True
+
+                        # if page_id == 31 and 0 < block_id < 10:
+                        #     # print("toc", toc_numbers)
+                        #     print(
+                        #         s_text,
+                        #         # round(abs(s_bbox[0] - s_bbox[2])),
+                        #         # round(abs(ps["bbox"][0] - ps["bbox"][2])),
+                        #         # ps.get("block_id"),
+                        #         # block_id,
+                        #         # ps.get("line_id"),
+                        #         # line_id,
+                        #         # "-->",
+                        #         # len(s["text"] + " "),
+                        #         # ps.get("text"),
+                        #         # plausible_new_paragraph == False,
+                        #         # s_size,
+                        #         # no_space_between_spans,
+                        #         # block_or_line_change,
+                        #         end_of_header,
+                        #         "-->",
+                        #         s_size == ps.get("size", 0)
+                        #         or no_space_between_spans,
+                        #         bool((1 - plausible_new_paragraph)),
+                        #         prev_page_id + 1 == page_id,
+                        #         s_color == ps.get("color"),
+                        #     )
+
+                        # if font size and color is the same as previous span then we assume that they are connected in a paragraph
+                        if (
+                            (
+                                s_size == ps.get("size", 0)
+                                or no_space_between_spans
+                                or not block_or_line_change
+                            )
+                            and (1 - plausible_new_paragraph)
+                            and len(block_dict.get("text", "")) > 0
+                            and prev_page_id + 1 == page_id
+                            and is_new_footnote == False
+                            and is_page_number == False
+                            and end_of_header == False
+                            # and s_color == ps.get("color")
+                        ):
+                            # if (
+                            #     s_size == ps.get("size", 0)
+                            #     and len(block_dict.get("text", "")) > 0
+                            #     and prev_page_id + 1 == page_id
+                            #     and (
+                            #         1
+                            #         - font_type_changed
+                            #         * plausible_new_paragraph
+                            #         * granularity
+                            #     )
+                            #     and plausible_new_paragraph == False
+                            #     and is_new_footnote == False
+                            #     and s_color == ps.get("color")
+                            # ):
+
+                            block_dict["text"] = self._remove_rowbreak_dashes(
+                                ps,
+                                s_text,
+                                block_dict["text"],
+                                line_id,
+                                no_space_between_spans,
+                            )
+                            block_dict["bbox"] = self._max_bbox(
+                                s_bbox, block_dict["bbox"]
+                            )
 
-                                elif (
-                                    s_text in ["th"]
-                                    and ps.get("size", 0) > s_size
-                                    and len(block_dict.get("text", "")) > 0
-                                    and prev_page_id + 1 == page_id
-                                ):
-                                    block_dict["text"] += s_text
-                                    s["size"] = ps[
-                                        "size"
-                                    ]  # set size to previous tag to avoid new paragraph
-                                    block_dict["merged_tags"] += "_" + s_tag
-                                else:
-                                    if block_dict:
-                                        # rlbi = block_dict["linebreak_indexes"][::-1]
-                                        # block_dict["linebreak_indexes"] = [
-                                        #     v
-                                        #     for i, v in enumerate(rlbi)
-                                        #     if not rlbi[max(i - 1, 0)]
-                                        #     in no_space_between_spans_set
-                                        # ][::-1]
-                                        parsed_content.append(block_dict)
-                                    block_dict = {}
-                                    block_dict["text"] = s_text
-                                    block_dict["tag"] = s_tag
-                                    block_dict["size"] = s_size
-                                    block_dict["color"] = s_color
-                                    block_dict["page_id"] = page_id
-                                    block_dict["merged_tags"] = s_tag
-                                    block_dict["linebreak_indexes"] = []
-                                    block_dict["block_id"] = block_id
-                                    block_dict["line_id"] = line_id
-                                    block_dict["bbox"] = s_bbox
-                                    no_space_between_spans_set = set()
-
-                                    if page_number and page_number["bbox"] == s_bbox:
-                                        block_dict["type"] = "page_number"
-                                    else:
-                                        block_dict["type"] = "text"
-
-                                    if (
-                                        is_new_footnote
-                                        and not s_footnote["is_page_bottom"]
-                                    ):
-                                        block_dict[
-                                            "type"
-                                        ] = "footnote_id"  # The footnote placement
-                                        is_new_footnote = False
-                                        last_footnote_id_pos = len(
-                                            parsed_content[-1]["text"]
-                                        )
-                                        block_dict[
-                                            "footnote_id_pos"
-                                        ] = last_footnote_id_pos
-                                    elif (
-                                        is_new_footnote
-                                        and s_footnote["is_page_bottom"]
-                                        and s_footnote["text"] == s_text
-                                    ):
-                                        block_dict["type"] = "footnote_text_id"
-                                    elif is_new_footnote:
-                                        block_dict["type"] = "footnote_text"
-                                        is_new_footnote = False
-                                ps = s
-
-                            prev_s = s
-                            # if page_id == 4 and 0 < block_id < 10:
+                            # if (
+                            #     page_id == 3
+                            #     and 0 < block_id < 10
+                            #     and "1" == s_text  # "Introdu" in s_text
+                            # ):
+                            #     print("--->>", s_text)
                             #     print(block_dict["text"])
 
-                            # if text spans were found on line and added then append them to the block_dict
-                            block_text_length = len(block_dict.get("text", ""))
-                            last_linebreak_index = (
-                                block_dict["linebreak_indexes"][-1]
-                                if block_dict.get("linebreak_indexes", None)
-                                else 0
+                        elif (
+                            block_dict.get("type") == "footnote_text"
+                            and is_new_footnote == False
+                            and is_page_number == False
+                        ):
+                            block_dict["text"] = self._remove_rowbreak_dashes(
+                                ps,
+                                s_text,
+                                block_dict["text"],
+                                line_id,
+                                no_space_between_spans,
                             )
-                            if (
-                                block_text_length > 0
-                                and last_linebreak_index != block_text_length
-                            ):
-                                # remove dashes binding together to lines
-                                block_dict["linebreak_indexes"].append(
-                                    block_text_length
-                                    if block_dict["text"][-1] != "-"
-                                    else block_text_length - 1
+                            block_dict["merged_tags"] += "_" + s_tag
+
+                        elif (
+                            s_text in ["th"]
+                            and ps.get("size", 0) > s_size
+                            and len(block_dict.get("text", "")) > 0
+                            and prev_page_id + 1 == page_id
+                        ):
+                            block_dict["text"] += s_text
+                            s["size"] = ps[
+                                "size"
+                            ]  # set size to previous tag to avoid new paragraph
+                            block_dict["merged_tags"] += "_" + s_tag
+                        else:
+                            if block_dict:
+                                # rlbi = block_dict["linebreak_indexes"][::-1]
+                                # block_dict["linebreak_indexes"] = [
+                                #     v
+                                #     for i, v in enumerate(rlbi)
+                                #     if not rlbi[max(i - 1, 0)]
+                                #     in no_space_between_spans_set
+                                # ][::-1]
+                                parsed_content.append(block_dict)
+                                last_block = block_dict
+                            block_dict = {}
+                            block_dict["text"] = s_text
+                            block_dict["tag"] = s_tag
+                            block_dict["size"] = s_size
+                            block_dict["color"] = s_color
+                            block_dict["page_id"] = page_id
+                            block_dict["merged_tags"] = s_tag
+                            block_dict["linebreak_indexes"] = []
+                            block_dict["block_id"] = block_id
+                            block_dict["line_id"] = line_id
+                            block_dict["bbox"] = s_bbox
+                            no_space_between_spans_set = set()
+
+                            if page_number and page_number["bbox"] == s_bbox:
+                                block_dict["type"] = "page_number"
+                            else:
+                                block_dict["type"] = "text"
+
+                            if is_new_footnote and not s_footnote["is_page_bottom"]:
+                                block_dict["type"] = (
+                                    "footnote_id"  # The footnote placement
                                 )
-                                if no_space_between_spans:
-                                    no_space_between_spans_set.add(
-                                        block_dict["linebreak_indexes"][-1]
-                                    )
-                                if (
-                                    len(block_dict["linebreak_indexes"]) > 1
-                                    and block_dict["linebreak_indexes"][-1]
-                                    in no_space_between_spans_set
-                                ):
-                                    del block_dict["linebreak_indexes"][-2]
-
-                        prev_line_id = line_id
-                        prev_line_length = line_length
-                # if page_id == 4 and block_id == 9:  # 0 < block_id < 10:
-                #     print(block_id)
-                #     print("no_space_between_spans", block_dict["text"])
-                #     print("no_space_between_spans", block_dict["linebreak_indexes"])
-                #     print("no_space_between_spans", no_space_between_spans_set)
-                prev_block_id = block_id
+                                is_new_footnote = False
+                                last_footnote_id_pos = len(last_block["text"])
+                                block_dict["footnote_id_pos"] = last_footnote_id_pos
+                            elif (
+                                is_new_footnote
+                                and s_footnote["is_page_bottom"]
+                                and s_footnote["text"] == s_text
+                            ):
+                                block_dict["type"] = "footnote_text_id"
+                            elif is_new_footnote:
+                                block_dict["type"] = "footnote_text"
+                                is_new_footnote = False
+                        ps = s
+
+                    prev_s = s
+                    # if page_id == 4 and 0 < block_id < 10:
+                    #     print(block_dict["text"])
+
+                    # if text spans were found on line and added then append them to the block_dict
+                    block_text_length = len(block_dict.get("text", ""))
+                    last_linebreak_index = (
+                        block_dict["linebreak_indexes"][-1]
+                        if block_dict.get("linebreak_indexes", None)
+                        else 0
+                    )
+                    if (
+                        block_text_length > 0
+                        and last_linebreak_index != block_text_length
+                    ):
+                        # remove dashes binding together to lines
+                        block_dict["linebreak_indexes"].append(
+                            block_text_length
+                            if block_dict["text"][-1] != "-"
+                            else block_text_length - 1
+                        )
+                        if no_space_between_spans:
+                            no_space_between_spans_set.add(
+                                block_dict["linebreak_indexes"][-1]
+                            )
+                        if (
+                            len(block_dict["linebreak_indexes"]) > 1
+                            and block_dict["linebreak_indexes"][-1]
+                            in no_space_between_spans_set
+                        ):
+                            del block_dict["linebreak_indexes"][-2]
+
+                prev_line_id = line_id
+                prev_line_length = line_length
             # Next page: check if text block has been generated an i.e. differs from previous stored block. If so append it and commence new block.
-            if block_dict and block_dict != parsed_content[-1]:
+            if block_dict and block_dict != last_block:
                 parsed_content.append(block_dict)
+                last_block = block_dict
                 block_dict = {}
             prev_page_id = page_id
 
-        # Merge all paragrahs broken up by footnotes
-        prev_bl, next_bl_add = None, dict()
-        footnote_breaks_to_remove = []
-        for idx, bl in reversed(list(enumerate(parsed_content))):
-            if bl["type"] == "footnote_id" and prev_bl:
-                next_bl_add = prev_bl
-            elif (
-                next_bl_add
-                and bl["tag"] == next_bl_add["tag"]
-                and bl["page_id"] == next_bl_add["page_id"]
-            ):
-                parsed_content[idx + 1]["footnote_id_pos"] = len(
-                    parsed_content[idx]["text"]
-                )
-                footnote_breaks_to_remove.append(idx + 2)
-                parsed_content[idx]["text"] += (
-                    next_bl_add["text"]
-                    if next_bl_add["text"][0] in ",.!?:;-"
-                    else " " + next_bl_add["text"]
-                )
-                next_bl_add = None
-            else:
-                next_bl_add = None
-
-            prev_bl = bl
-            # Remove line breaks etc. from text
-            bl["text"] = re.sub(_SPECIAL_CHAR_PATTERNS, " ", bl["text"])
+            # Merge all paragrahs broken up by footnotes (both parts of a paragraph are on the same page)
+            prev_bl, next_bl_add = None, dict()
+            footnote_breaks_to_remove = []
+            for idx, bl in reversed(list(enumerate(parsed_content))):
+                if bl["type"] == "footnote_id" and prev_bl:
+                    next_bl_add = prev_bl
+                elif (
+                    next_bl_add
+                    and bl["tag"] == next_bl_add["tag"]
+                    and bl["page_id"] == next_bl_add["page_id"]
+                ):
+                    parsed_content[idx + 1]["footnote_id_pos"] = len(
+                        parsed_content[idx]["text"]
+                    )
+                    footnote_breaks_to_remove.append(idx + 2)
+                    parsed_content[idx]["text"] += (
+                        next_bl_add["text"]
+                        if next_bl_add["text"][0] in ",.!?:;-"
+                        else " " + next_bl_add["text"]
+                    )
+                    next_bl_add = None
+                else:
+                    next_bl_add = None
 
-        for idx in sorted(footnote_breaks_to_remove, reverse=True):
-            del parsed_content[idx]
+                prev_bl = bl
+                # Remove line breaks etc. from text
+                bl["text"] = re.sub(_SPECIAL_CHAR_PATTERNS, " ", bl["text"])
 
-        self.parsed_content = parsed_content
+            for idx in sorted(footnote_breaks_to_remove, reverse=True):
+                del parsed_content[idx]
 
-        return parsed_content
+            yield parsed_content
 
     def parse_toc(self, block: dict):
         text = block["text"]
@@ -1274,24 +1530,193 @@ class ParseDoc:
             prev_lidx = lidx
             prev_line_text = line_text
 
+    def extract_outline(self) -> List:
+        """The pdf outline as returned by doc.getToC(simple=True): list of [level, title, page]."""
+        self.extract_spans()
+        return self.outline
+
+    def extract_outline_toc(self) -> List[Dict]:
+        """Extract a table of contents from the pdf outline (bookmarks).
+        Outline entries link to their page, hence each row also contains the page_id of the section. Rows are only
+        extracted if the outline contains at least _OUTLINE_MIN_ROWS entries with page targets.
+
+        :returns: table of contents rows (empty list if the outline is missing or poor).
+        """
+        outline = [
+            (level, " ".join(title.split()), page - 1)
+            for level, title, page in self.extract_outline()
+            if 0 < page <= self.doc_length and title.strip()
+        ]
+        if len(outline) < _OUTLINE_MIN_ROWS:
+            return []
+
+        toc = []
+        section_type = "Main"
+        sections = {}  # section of the last row on each level
+        for level, text, page_id in outline:
+            if (
+                "Annex" in text
+                or "ANNEX" in text
+                or "Appendix" in text
+                or "APPENDIX" in text
+            ):
+                section_type = "Annex"
+            roman_numeral_header = _ROMAN_NUMERAL_REGEX.search(text)
+            arabic_numeral_header = re.search(_SECTION_DIGIT_PATTERN, text)
+            if roman_numeral_header and roman_numeral_header.group():
+                section = roman_numeral_header.group()
+            elif arabic_numeral_header:
+                section = arabic_numeral_header.group()
+            else:
+                section = None
+            # Unnumbered annex rows have no section level (as rows of the printed table of contents)
+            if section_type == "Annex" and section is None:
+                section_level = None
+            else:
+                section_level = level - 1
+            sections = {lvl: s for lvl, s in sections.items() if lvl < level - 1}
+            page_number = self.page_numbers_by_page_id.get(page_id)
+            toc.append(
+                {
+                    "text": text,
+                    "page_number": (
+                        page_number["text"] if page_number else str(page_id + 1)
+                    ),
+                    "page_id": page_id,
+                    "section": section,
+                    "section_level": section_level,
+                    "section_type": section_type,
+                    "parent_section": (
+                        sections[max(sections)]
+                        if sections and section_level is not None
+                        else None
+                    ),
+                }
+            )
+            sections[level - 1] = section
+
+        print("ToC length (outline):", len(toc))
+        self.toc = toc
+        return toc
+
+    def toc_candidate_blocks(self) -> List[Tuple[int, Dict]]:
+        """Content blocks of the pages where a table of contents is searched for.
+
+        :returns: list of (content_idx, block)
+        """
+        blocks = []
+        for idx, bl in enumerate(self.parsed_content):
+            # We assume toc is located within the first _TOC_PAGE_LIMIT pages.
+            if bl["page_id"] > _TOC_PAGE_LIMIT:
+                break
+            blocks.append((idx, bl))
+        return blocks
+
+    @staticmethod
+    def toc_confidence(toc: List[Dict], max_page_number: int) -> float:
+        """Share of table of contents rows with a page number that is within the document and not smaller
+        than the page number of the previous valid row (0 if toc is empty)."""
+        if not toc:
+            return 0.0
+        valid_rows, prev_page_number = 0, 0
+        for row in toc:
+            page_number = str(row.get("page_number") or "")
+            if (
+                page_number.isdigit()
+                and prev_page_number <= int(page_number) <= max_page_number
+            ):
+                valid_rows += 1
+                prev_page_number = int(page_number)
+        return valid_rows / len(toc)
+
+    def extract_toc(self) -> Tuple[str, Optional[float]]:
+        """Extract the table of contents from the pdf outline or else from the content blocks
+        (see detect_table_of_contents).
+
+        :returns: table of contents layout ("outline", "dots" or "no_dots") and confidence (None for the outline).
+        """
+        outline_toc = self.extract_outline_toc()
+        if outline_toc:
+            # The printed table of contents is not content even if the rows are taken from the outline
+            _, _, _, toc_bl_idxs = self._printed_toc()
+            for idx in toc_bl_idxs:
+                self.parsed_content[idx]["type"] = "toc_orig_text"
+            self.toc = outline_toc
+            return "outline", None
+        return self.detect_table_of_contents()
+
+    def detect_table_of_contents(self) -> Tuple[str, float]:
+        """Extract a table of contents by evaluating both table of contents layouts on the same candidate blocks:
+        dotted leaders (see extract_table_of_contents) and no dots (see extract_table_of_contents_v2).
+        The layout whose rows have the highest toc_confidence is kept, the dotted layout wins ties.
+
+        :returns: chosen layout ("dots" or "no_dots") and its confidence.
+        """
+        layout, confidence, toc, toc_bl_idxs = self._printed_toc()
+        for idx in toc_bl_idxs:
+            self.parsed_content[idx]["type"] = "toc_orig_text"
+        self.toc = toc
+
+        if len(toc) == 0:
+            print("Warning no Table of Contents identified.")
+        else:
+            print("ToC length:", len(toc), layout, round(confidence, 2))
+        return layout, confidence
+
+    def _printed_toc(self) -> Tuple[str, float, List[Dict], List]:
+        """Evaluate both table of contents layouts on the candidate blocks (see detect_table_of_contents).
+
+        :returns: chosen layout, its confidence and rows, and content_idx of the table of contents blocks of the
+            chosen layout. Blocks found by the dotted layout are only included with the no dots layout if the
+            dotted layout has no rows (the no dots layout is the fallback of the dotted layout).
+        """
+        blocks = self.toc_candidate_blocks()
+        dotted_toc, dotted_bl_idxs = self._dotted_toc(blocks)
+        no_dots_toc, no_dots_bl_idxs = self._no_dots_toc(blocks)
+        max_page_number = self.doc_length + 50
+        dotted_confidence = self.toc_confidence(dotted_toc, max_page_number)
+        no_dots_confidence = self.toc_confidence(no_dots_toc, max_page_number)
+
+        if dotted_toc and dotted_confidence >= no_dots_confidence:
+            return "dots", dotted_confidence, dotted_toc, dotted_bl_idxs
+        if dotted_toc:
+            return "no_dots", no_dots_confidence, no_dots_toc, no_dots_bl_idxs
+        return (
+            "no_dots",
+            no_dots_confidence,
+            no_dots_toc,
+            dotted_bl_idxs + no_dots_bl_idxs,
+        )
+
     def extract_table_of_contents(self) -> List[Dict]:
         """Extract a table of contents. 
         Method identifies all lines in the document that belong to the table of contents. 
         Actual parsing is done by the parse_toc() method.
         """
-        parsed_content = self.parsed_content
+        toc, toc_bl_idxs = self._dotted_toc(self.toc_candidate_blocks())
+        for idx in toc_bl_idxs:
+            self.parsed_content[idx]["type"] = "toc_orig_text"
+        self.toc = toc
+
+        if len(toc_bl_idxs) == 0:
+            print("Warning no Table of Contents identified.")
+        else:
+            print("ToC length:", len(self.toc))
+
+        return self.toc
+
+    def _dotted_toc(self, blocks: List[Tuple[int, Dict]]) -> Tuple[List[Dict], List]:
+        """Table of contents with dotted leaders found in candidate blocks.
+
+        :returns: table of contents rows and content_idx of all blocks belonging to the table of contents.
+        """
         # Identify table of contents (toc)
         toc_last_page_id = 0
-        toc_page_limit = 20
         toc_page_ids = []
         toc_font_sizes = set()
         toc_bl_ids = []
 
-        for idx, bl in enumerate(parsed_content):
-            # We assume toc is located within the first toc_page_limit pages.
-            if bl["page_id"] > toc_page_limit:
-                break
-
+        for idx, bl in blocks:
             # We assume toc contains dot sequences or that the page_id has already been identified as a table of content
             if bl["text"].count("...") > 2 or bl["page_id"] in toc_page_ids:
                 if toc_last_page_id == 0 or (bl["page_id"] - toc_last_page_id) < 2:
@@ -1312,11 +1737,8 @@ class ParseDoc:
 
         # We create a toc dict where we store all text and linebreak_indexes identified as a toc
         toc = {"text": "", "merged_tags": "", "size": None, "linebreak_indexes": []}
-        for idx, bl in enumerate(parsed_content):
-            # Once again we assume toc contains dot sequences and is located within the first toc_page_limit pages.
-            if bl["page_id"] > toc_page_limit:
-                break
-
+        toc_orig_text_ids = []
+        for idx, bl in blocks:
             # if the page_id was previously identified as a table of content page
             if (
                 bl["page_id"] in toc_page_ids
@@ -1383,34 +1805,43 @@ class ParseDoc:
                     if _correct_split_word:
                         toc["linebreak_indexes"][-1] = len(toc["text"])
 
-                bl["type"] = "toc_orig_text"
+                toc_orig_text_ids.append(idx)
         # print("----")
         # print(toc)
         # We remove specific control characters such as newline, return, tab and spaces (\xa0)
         toc["text"] = re.sub(_SPECIAL_CHAR_PATTERNS, " ", toc["text"])
         # print(toc)
 
-        # Parse toc which gets stored in self.toc
+        # Parse toc rows (parse_toc stores the rows in self.toc)
+        self.toc = []
         self.parse_toc(toc)
 
-        if len(toc_page_ids) == 0:
-            print("Warning no Table of Contents identified.")
-        else:
-            print("ToC length:", len(self.toc))
-
-        return self.toc
+        return self.toc, toc_orig_text_ids
 
     def extract_table_of_contents_v2(self) -> List[Dict]:
         """Extract a table of contents (version 2). 
         Method for parsing toc which don't contain dots
         """
-        parsed_content = self.parsed_content
-        # Identify table of contents (toc)
-        toc_last_page_id = 0
-        toc_page_limit = 20
-        toc_page_ids = []
-        toc_font_sizes = set()
-        toc_bl_ids = []
+        toc, toc_bl_idxs = self._no_dots_toc(self.toc_candidate_blocks())
+        for idx in toc_bl_idxs:
+            self.parsed_content[idx]["type"] = "toc_orig_text"
+
+        if len(toc) == 0:
+            print("Warning no Table of Contents identified.")
+        else:
+            print("ToC length:", len(toc))
+
+        # print("ToC")
+        # for t in toc:
+        #     print(t)
+        self.toc = toc
+
+    def _no_dots_toc(self, blocks: List[Tuple[int, Dict]]) -> Tuple[List[Dict], List]:
+        """Table of contents without dots found in candidate blocks (rows are parsed from the page with the
+        "Table of contents" heading).
+
+        :returns: table of contents rows and content_idx of all blocks belonging to the table of contents.
+        """
 
         def itemgetter(idxs):
             idxs = [0] + idxs
@@ -1433,11 +1864,8 @@ class ParseDoc:
         section_level = 0
         parent_section = None
         toc_row = {"text": "", "page_number": None, "section": None}
-        for idx, bl in enumerate(parsed_content):
-            # We assume toc is located within the first toc_page_limit pages.
-            if bl["page_id"] > toc_page_limit:
-                break
-
+        toc_orig_text_ids = []
+        for idx, bl in blocks:
             if not toc_match:
                 toc_match = re.match(
                     r"(table)[\s]+(of)[\s]+(contents)", bl["text"], re.IGNORECASE
@@ -1451,7 +1879,7 @@ class ParseDoc:
                 and toc_match.group(0) != bl["text"]
             ):
                 linebreak_indexes = bl["linebreak_indexes"]
-                bl["type"] = "toc_orig_text"
+                toc_orig_text_ids.append(idx)
                 matches = itemgetter(linebreak_indexes)(bl["text"])
 
                 # print(matches)
@@ -1535,104 +1963,124 @@ class ParseDoc:
                     prev_mtype = mtype
                     prev_text = text
 
-        if len(toc) == 0:
-            print("Warning no Table of Contents identified.")
-        else:
-            print("ToC length:", len(toc))
+        return toc, toc_orig_text_ids
 
-        # print("ToC")
-        # for t in toc:
-        #     print(t)
-        self.toc = toc
+    def match_table_of_contents(self, matcher: TocMatcher = None) -> List[Dict]:
+        """Match a header to the corresponding table of contents row.
 
-    def match_table_of_contents(self) -> List[Dict]:
-        """ Match a header to the corresponding table of contents row. """
+        :param matcher: TocMatcher of the content blocks (default: index self.parsed_content).
+        """
         toc = self.toc
-        page_numbers = self.page_numbers
-        parsed_content = self.parsed_content
-        toc_length = len(toc)
-
-        # Find best matching header without considering page_number info
-        for toc_idx, toc_row in enumerate(toc):
-            for content_idx, content in enumerate(parsed_content):
-                if content["type"] == "text":  # "<h" in content["tag"]:
-                    token_sort_ratio = fuzz.token_sort_ratio(
-                        content["text"], toc_row["text"]
-                    )
-                    if "toc_match" in toc_row.keys():
-                        if token_sort_ratio > toc_row["toc_match"]["token_sort_ratio"]:
-                            toc_row["toc_match"] = {
-                                "content_idx": content_idx,
-                                "token_sort_ratio": token_sort_ratio,
-                            }
-                    else:
-                        toc_row["toc_match"] = {
-                            "content_idx": content_idx,
-                            "token_sort_ratio": token_sort_ratio,
-                        }
+        if matcher is None:
+            matcher = TocMatcher(self.parsed_content, self.page_numbers)
+
+        # Rows from the pdf outline are matched on their page, otherwise find best matching header
+        # without considering page_number info
+        for toc_row in toc:
+            toc_match = None
+            if "page_id" in toc_row:
+                toc_match = matcher.best_page_id_match(
+                    toc_row["text"], toc_row["page_id"]
+                )
+            if not toc_match:
+                toc_match = matcher.best_text_match(toc_row["text"])
+            if toc_match:
+                toc_row["toc_match"] = toc_match
 
         # If previous match was poor find best matching header on corresponding page_number
-        for toc_idx, toc_row in enumerate(toc):
+        for toc_row in toc:
+            if "page_id" in toc_row:
+                continue
             if toc_row["toc_match"]["token_sort_ratio"] < 80:
-                for pp in page_numbers:
-                    if pp["text"] == toc_row["page_number"]:
-                        page_id = pp["page_id"]
-                        prev_page_token_sort_ratio = 0
-                        for content_idx, content in enumerate(parsed_content):
-                            if (
-                                page_id == content["page_id"]
-                            ):  # and "<h" in content["tag"]:
-                                page_token_sort_ratio = fuzz.token_sort_ratio(
-                                    content["text"], toc_row["text"]
-                                )
-                                if page_token_sort_ratio > prev_page_token_sort_ratio:
-                                    toc_row["toc_match"] = {
-                                        "content_idx": content_idx,
-                                        "token_sort_ratio": page_token_sort_ratio,
-                                    }
-                                    prev_page_token_sort_ratio = page_token_sort_ratio
-                            elif content["page_id"] > page_id:
-                                break
-                        break
+                toc_match = matcher.best_page_match(
+                    toc_row["text"], toc_row["page_number"]
+                )
+                if toc_match:
+                    toc_row["toc_match"] = toc_match
         self.toc = toc
         return toc
 
-    def write_files(self, output_path):
-        """ Write parsed content to a json file and a markdown file. """
-        parsed_content = self.parsed_content
-        filename = self.filename.split(".")[0]
+    def write_files(self, output_path, content_format: str = "json"):
+        """Write parsed content to a json file and a markdown file.
+
+        :param content_format: json: json lines content file; store: binary content file (see ContentStore).
+        """
+        file_path = self._output_file_path(output_path)
+        with _atomic_write("{}.md".format(file_path)) as md_file, _content_writer(
+            file_path, content_format
+        ) as write_content:
+            for bl in self.parsed_content:
+                self._write_markdown(bl, md_file)
+                write_content(bl)
+        self._write_meta(file_path)
+
+    def stream_files(
+        self, output_path, content_format: str = "json"
+    ) -> Tuple[int, str, Optional[float]]:
+        """Parse the content page by page and write the output files while parsing (same files as write_files).
+        Only the content blocks of the pages searched for a table of contents are kept (self.parsed_content), the
+        table of contents is extracted once these pages are parsed and matched to the content blocks through a
+        TocMatcher, which keeps only the processed block texts. Memory therefore does not grow with the content
+        blocks of the document. The parse_content checkpoint of the parse cache is not used.
+
+        :param content_format: json or store (see write_files).
+        :returns: number of content blocks, table of contents layout and confidence (see extract_toc).
+        """
+        file_path = self._output_file_path(output_path)
+        blocks = chain.from_iterable(self.iter_content())
+        self.parsed_content = []
+        next_blocks = []
+        for bl in blocks:
+            if bl["page_id"] > _TOC_PAGE_LIMIT:
+                next_blocks.append(bl)
+                break
+            self.parsed_content.append(bl)
+        toc_layout, toc_confidence = self.extract_toc()
+
+        matcher = TocMatcher([], self.page_numbers)
+        with _atomic_write("{}.md".format(file_path)) as md_file, _content_writer(
+            file_path, content_format
+        ) as write_content:
+            for bl in chain(self.parsed_content, next_blocks, blocks):
+                matcher.add(bl)
+                self._write_markdown(bl, md_file)
+                write_content(bl)
+        self.match_table_of_contents(matcher)
+        self._write_meta(file_path)
+        return len(matcher.keys), toc_layout, toc_confidence
+
+    def _output_file_path(self, output_path) -> str:
+        """Output file path without suffix, creates output_path if needed."""
         if output_path and not os.path.exists(output_path):
             os.mkdir(output_path)
-        file_path = os.path.join(output_path, filename)
-        with open("{}.md".format(file_path), "w") as f:
-            for bl in parsed_content:
-                if bl["type"] == "text":
-                    text = bl["text"]
-                elif bl["type"] == "page_number":
-                    text = "<b>p. {}</b>".format(bl["text"])
-                elif bl["type"] == "footnote_id":
-                    text = "<i>{}</i>".format(bl["text"])
-                elif bl["type"] == "footnote_text":
-                    text = "<i>{}</i>".format(bl["text"])
-                elif bl["type"] == "footnote_text_id":
-                    text = "<i>{}</i>".format(bl["text"])
-                else:
-                    text = bl["text"]
+        return os.path.join(output_path, self.filename.split(".")[0])
 
-                if bl["tag"][0:2] != "<s":
-                    f.write(bl["tag"] + text + "</" + bl["tag"][1:])
-                else:
-                    f.write(
-                        "<p style='font-size:{}px'>{}</p>".format(
-                            round(bl["size"]), text
-                        )
-                    )
-        with open("{}_content.json".format(file_path), "w") as f:
-            for bl in parsed_content:
-                f.write(json.dumps(bl, ensure_ascii=False))
-                f.write("\n")
+    @staticmethod
+    def _write_markdown(bl: Dict, md_file):
+        """Write a content block to the markdown file."""
+        if bl["type"] == "text":
+            text = bl["text"]
+        elif bl["type"] == "page_number":
+            text = "<b>p. {}</b>".format(bl["text"])
+        elif bl["type"] == "footnote_id":
+            text = "<i>{}</i>".format(bl["text"])
+        elif bl["type"] == "footnote_text":
+            text = "<i>{}</i>".format(bl["text"])
+        elif bl["type"] == "footnote_text_id":
+            text = "<i>{}</i>".format(bl["text"])
+        else:
+            text = bl["text"]
+
+        if bl["tag"][0:2] != "<s":
+            md_file.write(bl["tag"] + text + "</" + bl["tag"][1:])
+        else:
+            md_file.write(
+                "<p style='font-size:{}px'>{}</p>".format(round(bl["size"]), text)
+            )
 
-        with open("{}_meta.json".format(file_path), "w") as f:
+    def _write_meta(self, file_path: str):
+        """Write the table of contents rows to the json lines meta file."""
+        with _atomic_write("{}_meta.json".format(file_path)) as f:
             for row in self.toc:
                 row["type"] = "toc"
                 f.write(json.dumps(row, ensure_ascii=False))
@@ -1641,15 +2089,532 @@ class ParseDoc:
             # f.write(json.dumps({"table_of_contents": self.toc}))
 
 
-def parse_pdf_directory(replace_files: str):
-    """ Parse all pdf files in a directory """
+class ParseCache:
+    """
+    On-disk checkpoints of the parsing of a pdf document, stored in a folder per document.
+
+    The raw extraction (SpanStore, page count and outline) is keyed by the sha256 of the pdf, the page range, the
+    MuPDF version and the span_store source code. Stage checkpoints are keyed by ParseDoc.stage_key. Checkpoints
+    are pickled and replaced whenever their key changes, so re-running a stage after editing it overwrites the
+    stale checkpoint.
+    """
+
+    def __init__(
+        self, cache_path: str, doc_path: str, page_range: Sequence[int] = None
+    ):
+        self.path = Path(cache_path) / Path(doc_path).stem
+        sha256 = hashlib.sha256(file_sha256(doc_path).encode())
+        sha256.update(repr(page_range).encode())
+        sha256.update(str(fitz.VersionBind).encode())
+        sha256.update(inspect.getsource(span_store).encode())
+        self.raw_key = sha256.hexdigest()
+
+    def load(self, name: str, key: str) -> Optional[Any]:
+        """Checkpoint data or None if there is no checkpoint with the key."""
+        file_path = self.path / "{}.pkl".format(name)
+        if not file_path.exists():
+            return None
+        with open(file_path, "rb") as f:
+            checkpoint = pickle.load(f)
+        return checkpoint["data"] if checkpoint["key"] == key else None
+
+    def save(self, name: str, key: str, data: Any):
+        self.path.mkdir(parents=True, exist_ok=True)
+        with _atomic_write(self.path / "{}.pkl".format(name), mode="wb") as f:
+            pickle.dump({"key": key, "data": data}, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def load_raw(self) -> Optional[Dict]:
+        return self.load("raw", self.raw_key)
+
+    def save_raw(self, raw: Dict):
+        self.save("raw", self.raw_key, raw)
+
+
+@contextmanager
+def _atomic_write(file_path: str, mode: str = "w"):
+    """Opens a temporary file for writing which replaces file_path once it has been written completely.
+    Readers (and parallel parse workers) never see a partially written output file."""
+    tmp_path = "{}.{}.tmp".format(file_path, os.getpid())
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+@contextmanager
+def _timed(timings: Optional[Dict], stage: str):
+    """Adds the duration (seconds) of the with block to timings[stage] unless timings is None."""
+    start = time.perf_counter()
+    yield
+    if timings is not None:
+        timings[stage] = time.perf_counter() - start
+
+
+@contextmanager
+def _content_writer(file_path: str, content_format: str):
+    """Opens the content file of a document (file_path without suffix) in the given format and yields a function
+    which writes a content block. The content file in the other format is removed once the file is written.
+    """
+    if content_format == "store":
+        with _atomic_write(file_path + _CONTENT_STORE_SUFFIX, mode="wb") as f:
+            writer = ContentStoreWriter(f)
+            yield writer.add
+            writer.close()
+        stale_path = file_path + _CONTENT_JSON_SUFFIX
+    else:
+        with _atomic_write(file_path + _CONTENT_JSON_SUFFIX) as f:
+            yield lambda bl: f.write(json.dumps(bl, ensure_ascii=False) + "\n")
+        stale_path = file_path + _CONTENT_STORE_SUFFIX
+    if os.path.exists(stale_path):
+        os.remove(stale_path)
+
+
+def file_sha256(file_path: str) -> str:
+    """Returns the sha256 hex digest of a file's content."""
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def parser_version() -> str:
+    """Returns a version hash of the parser source code. Any edit to the parsing heuristics changes the version."""
+    sha256 = hashlib.sha256()
+    for source_file in _PARSER_SOURCE_FILES:
+        with open(source_file, "rb") as f:
+            sha256.update(f.read())
+    return sha256.hexdigest()[:16]
+
+
+def load_parsing_manifest(output_path: str) -> Dict:
+    """Loads the parsing manifest which maps each parsed pdf file name to the pdf sha256,
+    parser version and ParseDoc settings used to produce its output files."""
+    manifest_path = os.path.join(output_path, _PARSING_MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, "r") as f:
+        return json.loads(f.read())
+
+
+def parsing_manifest_entry(
+    file_path: str, settings: Dict, content_format: str, version: str = None
+) -> Dict:
+    """Parsing manifest entry of a pdf file parsed with settings by the parser version (default: current version)."""
+    return {
+        "sha256": file_sha256(file_path),
+        "parser_version": version or parser_version(),
+        "settings": settings,
+        "content_format": content_format,
+    }
+
+
+def write_parsing_manifest(manifest: Dict, output_path: str):
+    with _atomic_write(os.path.join(output_path, _PARSING_MANIFEST_FILE)) as f:
+        f.write(json.dumps(dict(sorted(manifest.items())), indent=1))
+
+
+def parse_pdf_file(
+    file_path: str,
+    output_path: str,
+    settings: Dict = _PARSE_SETTINGS,
+    cache_path: str = None,
+    page_workers: int = 1,
+    timings: Dict = None,
+    stream: bool = False,
+    content_format: str = "json",
+) -> Dict:
+    """Parse a single pdf file and write the parsed content to output_path.
+
+    :param settings: ParseDoc keyword arguments (granularity, font_size_remainder, pageNumberStyleMatch)
+    :param cache_path: folder of the parse cache (default: no cache).
+    :param page_workers: number of processes extracting the pages of the file.
+    :param timings: if given, the duration (seconds) of each parsing stage is added to the dict. The raw text
+        extraction is part of the first stage (fonts_and_page_numbers).
+    :param stream: write the parsed content page by page while parsing (see ParseDoc.stream_files), the output
+        files are the same.
+    :param content_format: json: json lines content file; store: binary content file (see ContentStore).
+    :returns: dict with parsing stats for the file.
+    """
+    pdoc = ParseDoc(
+        file_path, cache_path=cache_path, page_workers=page_workers, **settings
+    )
+    with _timed(timings, "fonts_and_page_numbers"):
+        font_counts, styles, page_numbers = pdoc.fonts_and_page_numbers()
+    with _timed(timings, "font_tags"):
+        size_tags = pdoc.font_tags()
+    with _timed(timings, "get_footnotes"):
+        footnotes = pdoc.get_footnotes()
+    if stream:
+        with _timed(timings, "stream_files"):
+            content_length, toc_layout, toc_confidence = pdoc.stream_files(
+                output_path, content_format
+            )
+    else:
+        with _timed(timings, "parse_content"):
+            content_length = len(pdoc.parse_content())
+        with _timed(timings, "table_of_contents"):
+            toc_layout, toc_confidence = pdoc.extract_toc()
+            pdoc.match_table_of_contents()
+    toc = pdoc.toc
+    token_sort_ratio_sum = 0
+
+    for t in toc:
+        show_keys = ["text", "page_number", "parent_section"]
+        token_sort_ratio = t["toc_match"]["token_sort_ratio"]
+        print(
+            token_sort_ratio,
+            " / ",
+            t["toc_match"]["content_idx"],
+            ": ",
+            {key: t[key] for key in show_keys},
+        )
+        token_sort_ratio_sum += token_sort_ratio
+
+    accuracy_score = None
+    if toc:
+        accuracy_score = token_sort_ratio_sum / (100 * len(toc))
+
+    print("font_counts:", int(len(font_counts)))
+    print("styles:", int(len(styles)))
+    print("page_numbers:", int(len(page_numbers)))
+    print("size_tag:", int(len(size_tags)))
+    print("footnotes:", int(len(footnotes)))
+    print("parsed_content:", int(content_length))
+
+    print("")
+    if not stream:
+        with _timed(timings, "write_files"):
+            pdoc.write_files(output_path=output_path, content_format=content_format)
+
+    return {
+        "font_counts": len(font_counts),
+        "styles": len(styles),
+        "page_numbers": len(page_numbers),
+        "size_tag": len(size_tags),
+        "footnotes": len(footnotes),
+        "parsed_content": content_length,
+        "table_of_contents_length": len(toc) if toc else None,
+        "table_of_contents_layout": toc_layout if toc else None,
+        "table_of_contents_confidence": toc_confidence if toc else None,
+        "accuracy_score": accuracy_score,
+    }
+
+
+def _parse_pdf_file_task(
+    task: Tuple[int, str, str, str, Dict, Optional[str], Dict], page_workers: int = 1
+) -> Tuple[str, Dict]:
+    """Process pool task: parses one pdf file and returns (file, stats).
+    The last task item are the output options of parse_pdf_file (stream, content_format).
+    """
+    idx, file, input_path, output_path, settings, cache_path, output_options = task
+    print(idx, file)
+    return (
+        file,
+        parse_pdf_file(
+            os.path.join(input_path, file),
+            output_path,
+            settings,
+            cache_path,
+            page_workers,
+            **output_options,
+        ),
+    )
+
+
+class SupervisedProcess:
+    """
+    Runs a function in a child process with a wall-clock and memory budget.
+
+    The memory limit is the address space (RLIMIT_AS) the child may allocate in addition to the address space it
+    starts with, i.e. the interpreter and modules inherited from the parent are not counted. It is a limit per
+    process: processes started by the child (e.g. the page workers of SpanStore.from_file) inherit the same limit
+    each. Failed allocations of Python (MemoryError) and MuPDF are reported as "memory".
+    The child runs in its own process group, a child exceeding the timeout is killed together with all processes
+    it started.
+
+    poll() returns the outcome once the child has finished as (status, value):
+        ("done", return value), ("error", exception raised by the function),
+        ("timeout" / "memory" / "crashed", description of why the child was stopped).
+    """
+
+    def __init__(
+        self,
+        target,
+        args: Tuple = (),
+        timeout: float = None,
+        memory_limit: int = None,
+    ):
+        """
+        :param timeout: wall-clock time limit (seconds) of the child process (None: no limit).
+        :param memory_limit: address space (MB) the child process and each process it starts may allocate
+            (None: no limit).
+        """
+        self.timeout = timeout
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.connection, child_connection = Pipe(duplex=False)
+        self.process = Process(
+            target=_supervised_call,
+            args=(target, args, memory_limit, child_connection),
+        )
+        self.process.start()
+        child_connection.close()
+
+    @staticmethod
+    def wait(processes: List["SupervisedProcess"]):
+        """Blocks until one of the processes has an outcome or reached its deadline."""
+        deadlines = [p.deadline for p in processes if p.deadline is not None]
+        timeout = None
+        if deadlines:
+            timeout = max(min(deadlines) - time.monotonic(), 0)
+        wait(
+            [p.connection for p in processes] + [p.process.sentinel for p in processes],
+            timeout,
+        )
+
+    def poll(self) -> Optional[Tuple[str, Any]]:
+        """Returns the outcome of the child process or None if it is still running within its limits."""
+        if self.connection.poll():
+            try:
+                outcome = self.connection.recv()
+            except EOFError:
+                outcome = None
+            if outcome is not None:
+                self.process.join()
+                return outcome
+        if not self.process.is_alive():
+            self.process.join()
+            self.kill()  # processes left by the crashed child
+            return "crashed", f"exit code {self.process.exitcode}"
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.kill()
+            self.process.join()
+            return "timeout", f"exceeded time limit of {self.timeout} s"
+        return None
+
+    def kill(self):
+        """Kills the process group of the child, i.e. the child and all processes it started."""
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+def _supervised_call(target, args: Tuple, memory_limit: Optional[int], connection):
+    """Child process of SupervisedProcess: sends the outcome of target(*args) to the parent."""
+    os.setsid()  # own process group, which is killed on timeout
+    if memory_limit:
+        limit = _address_space() + memory_limit * 2 ** 20
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    try:
+        outcome = "done", target(*args)
+    except MemoryError:
+        outcome = "memory", f"exceeded memory limit of {memory_limit} MB"
+    except RuntimeError as e:
+        if _MUPDF_MEMORY_ERROR.search(str(e)):
+            outcome = "memory", f"exceeded memory limit of {memory_limit} MB ({e})"
+        else:
+            outcome = "error", e
+    except Exception as e:
+        outcome = "error", e
+    try:
+        connection.send(outcome)
+    except pickle.PicklingError:
+        connection.send(("error", RuntimeError(repr(outcome[1]))))
+    connection.close()
+
+
+def _address_space() -> int:
+    """Current address space (bytes) of the process, as limited by RLIMIT_AS (0 if /proc is not available)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[0]) * resource.getpagesize()
+    except OSError:
+        return 0
+
+
+def load_quarantine(output_path: str) -> Dict:
+    """Loads the quarantine list which maps the name of each pdf file that exceeded the limits of batch parsing
+    or failed to its pdf sha256 and the reason it was stopped."""
+    quarantine_path = os.path.join(output_path, _QUARANTINE_FILE)
+    if not os.path.exists(quarantine_path):
+        return {}
+    with open(quarantine_path, "r") as f:
+        return json.loads(f.read())
+
+
+def write_quarantine(quarantine: Dict, output_path: str):
+    with _atomic_write(os.path.join(output_path, _QUARANTINE_FILE)) as f:
+        f.write(json.dumps(dict(sorted(quarantine.items())), indent=1))
+
+
+def pdf_page_count(file_path: str, page_range: Sequence[int] = None) -> int:
+    """Number of pages of a pdf file (only reads the page tree).
+
+    :param page_range: only count pages in (start, stop) page range.
+    """
+    doc = fitz.open(file_path)
+    page_count = len(doc)
+    doc.close()
+    if page_range:
+        return len(range(page_count)[slice(*page_range)])
+    return page_count
+
+
+def estimated_parse_memory(page_count: int) -> int:
+    """Estimated peak memory (MB) of parsing a document with page_count pages."""
+    return _PARSE_BASE_MEMORY_MB + _PARSE_PAGE_MEMORY_MB * page_count
+
+
+def next_scheduled_task(
+    pending: List[Tuple],
+    page_counts: Dict[str, int],
+    running_memory: int,
+    memory_budget: int = None,
+) -> Optional[Tuple]:
+    """Longest processing time first scheduling with a memory budget. Returns the pending task with the most pages
+    whose estimated memory fits into the memory budget next to the running tasks (see estimated_parse_memory).
+
+    :param pending: parse tasks (file is the second task item).
+    :param running_memory: estimated memory (MB) of the running tasks (0: no task is running, any task is started).
+    :param memory_budget: memory budget (MB) for all running tasks (None: no budget).
+    :returns: task or None if no pending task fits into the budget.
+    """
+    for task in sorted(pending, key=lambda task: -page_counts[task[1]]):
+        if (
+            memory_budget is None
+            or running_memory == 0
+            or running_memory + estimated_parse_memory(page_counts[task[1]])
+            <= memory_budget
+        ):
+            return task
+    return None
+
+
+def _parse_scheduled(
+    tasks: List[Tuple],
+    page_counts: Dict[str, int],
+    workers: int,
+    memory_budget: int,
+    record_result,
+    record_quarantine,
+    limits: Dict,
+):
+    """Parses tasks in supervised worker processes (one process per file) in the order given by
+    next_scheduled_task. Results are recorded in the order in which files finish, files exceeding the limits are
+    quarantined.
+
+    :param limits: SupervisedProcess keyword arguments (timeout, memory_limit).
+    """
+    pending = list(tasks)
+    running = {}  # file -> (process, estimated memory)
+    try:
+        while pending or running:
+            while pending and len(running) < workers:
+                task = next_scheduled_task(
+                    pending,
+                    page_counts,
+                    sum(memory for _, memory in running.values()),
+                    memory_budget,
+                )
+                if task is None:
+                    break
+                pending.remove(task)
+                running[task[1]] = (
+                    SupervisedProcess(_parse_pdf_file_task, (task,), **limits),
+                    estimated_parse_memory(page_counts[task[1]]),
+                )
+
+            SupervisedProcess.wait([process for process, _ in running.values()])
+            for file, (process, _) in list(running.items()):
+                outcome = process.poll()
+                if outcome is not None:
+                    del running[file]
+                    _record_outcome(file, outcome, record_result, record_quarantine)
+    finally:
+        # Stop the running children (and their page workers) if the batch is interrupted
+        for process, _ in running.values():
+            process.kill()
+            process.process.join()
+
+
+def _parse_supervised(
+    task: Tuple, page_workers: int, record_result, record_quarantine, limits: Dict
+):
+    """Parses a single task in a supervised process (see _parse_scheduled)."""
+    process = SupervisedProcess(_parse_pdf_file_task, (task, page_workers), **limits)
+    outcome = None
+    try:
+        while outcome is None:
+            SupervisedProcess.wait([process])
+            outcome = process.poll()
+    finally:
+        if outcome is None:
+            process.kill()
+            process.process.join()
+    _record_outcome(task[1], outcome, record_result, record_quarantine)
+
+
+def _record_outcome(file: str, outcome: Tuple, record_result, record_quarantine):
+    """Records the result of a parsed file, files which exceeded the limits or failed are quarantined."""
+    status, value = outcome
+    if status == "done":
+        record_result(*value)
+    else:
+        if status == "error":
+            value = repr(value)
+        print(f"Quarantined: {file} ({status}: {value})")
+        record_quarantine(file, status, value)
+
+
+def parse_pdf_directory(
+    replace_files: str,
+    workers: int = 1,
+    front_matter: bool = False,
+    use_cache: bool = False,
+    memory_budget: int = None,
+    timeout: float = None,
+    memory_limit: int = None,
+    corpus_only: bool = False,
+    stream: bool = False,
+    content_format: str = "json",
+):
+    """Parse all pdf files in a directory
+
+    :param replace_files: y: parse all files; n: skip files with existing parsed content;
+        changed: skip files whose pdf content, parser version and settings are unchanged since they were last parsed (see parsing manifest).
+    :param workers: number of worker processes (1: parse files sequentially in the current process).
+    :param front_matter: only parse the first _FRONT_MATTER_PAGES pages of each file and write the results to
+        _FRONT_MATTER_PARSED_FILES_PATH (e.g. for extracting titles, series and authors).
+    :param use_cache: checkpoint the raw extraction and the parsing stages in the cache folder of the output path
+        and resume from valid checkpoints (see ParseCache).
+    :param memory_budget: memory budget (MB) for all documents parsed at the same time (None: no budget). Documents
+        are scheduled by page count, largest first (see next_scheduled_task).
+    :param timeout: wall-clock time limit (seconds) for parsing a single file.
+    :param memory_limit: memory limit (MB) for parsing a single file, per process if the pages are extracted by
+        several page workers (see SupervisedProcess). With a timeout or memory limit each file is
+        parsed in a supervised process (see SupervisedProcess), files exceeding the limits or failing are added to
+        the quarantine list and skipped until their pdf content changes.
+    :param corpus_only: skip files excluded from the eba analysis by their crawler metadata (see files_to_exclude).
+    :param stream: write the parsed content of each file page by page while parsing, which bounds the memory of
+        a worker by the pages instead of the content of a document (see ParseDoc.stream_files).
+    :param content_format: json: json lines content files; store: binary content files (see ContentStore).
+    """
 
     input_path, output_path = _FETCHED_FILES_PATH, _PARSED_FILES_PATH
+    settings = _PARSE_SETTINGS
+    if front_matter:
+        output_path = _FRONT_MATTER_PARSED_FILES_PATH
+        settings = {**_PARSE_SETTINGS, "page_range": [0, _FRONT_MATTER_PAGES]}
+    cache_path = str(os.path.join(output_path, "cache")) if use_cache else None
     if not os.path.exists(input_path):
         os.mkdir(output_path)
         print("Created input_path: {}".format(input_path))
     if not os.path.exists(output_path):
-        os.mkdir(output_path)
+        os.makedirs(output_path)
         print("Created input_path: {}".format(output_path))
     if not os.path.exists(os.path.join(output_path, "summary")):
         os.mkdir(os.path.join(output_path, "summary"))
@@ -1660,94 +2625,136 @@ def parse_pdf_directory(replace_files: str):
         )
 
     files_already_parsed = [
-        file.replace("_content.json", "")
+        get_file_id(file)
         for file in os.listdir(output_path)
-        if file.endswith("_content.json")
+        if is_parsed_content_file(file)
     ]
+    manifest = load_parsing_manifest(output_path)
+    quarantine = load_quarantine(output_path)
+    excluded_file_ids = set(
+        files_to_exclude(crawler_metadata=True) if corpus_only else []
+    )
+    version = parser_version()
+    manifest_entries = {}
     summary_stats = {"accuracy_scores": []}
     print("Number of files: ", len(os.listdir(input_path)))
-    results = {}
-    table_of_contents_cnt = 0
+    output_options = {"stream": stream, "content_format": content_format}
+    tasks = []
     for idx, file in enumerate(sorted(os.listdir(input_path)), start=0):
-        # if idx not in [57]:
-        #     # if idx < 227:
-        #     continue
-
-        # process_files = [
-        #     # "2013:38_15359",
-        #     # "2014:22_15415",
-        #     # "2014:52_15491",
-        #     # "2014:53_15493",
-        #     # "2014:67_15509",
-        #     "2014:55_15494",
-        # ]
-        # if file.split(".pdf")[0] not in process_files:
-        #     continue
+        if file.replace(".pdf", "") in excluded_file_ids:
+            print(f"Excluded: {file}")
+            continue
 
         if replace_files == "n" and file.replace(".pdf", "") in files_already_parsed:
             print(f"Already parsed: {file}")
             continue
 
         if file.endswith(".pdf"):
-            print(idx, file)
-            granularity = True
-            font_size_remainder = 1
-            pdoc = ParseDoc(
-                os.path.join(input_path, file),
-                font_size_remainder=font_size_remainder,
-                granularity=granularity,
+            manifest_entries[file] = parsing_manifest_entry(
+                os.path.join(input_path, file), settings, content_format, version
             )
-            font_counts, styles, page_numbers = pdoc.fonts_and_page_numbers()
-            size_tags = pdoc.font_tags()
-            footnotes = pdoc.get_footnotes()
-            parsed_content = pdoc.parse_content()
-            pdoc.extract_table_of_contents()
-            if len(pdoc.toc) == 0:
-                print("Try v2 extraction...")
-                pdoc.extract_table_of_contents_v2()
-            toc = pdoc.match_table_of_contents()
-            token_sort_ratio_sum = 0
-
-            for t in toc:
-                show_keys = ["text", "page_number", "parent_section"]
-                token_sort_ratio = t["toc_match"]["token_sort_ratio"]
-                print(
-                    token_sort_ratio,
-                    " / ",
-                    t["toc_match"]["content_idx"],
-                    ": ",
-                    {key: t[key] for key in show_keys},
+            if (
+                quarantine.get(file, {}).get("sha256")
+                == manifest_entries[file]["sha256"]
+            ):
+                print(f"Quarantined: {file}")
+                continue
+            quarantine.pop(file, None)
+            if (
+                replace_files == "changed"
+                and manifest.get(file) == manifest_entries[file]
+                and file.replace(".pdf", "") in files_already_parsed
+            ):
+                print(f"Unchanged: {file}")
+                continue
+            tasks.append(
+                (
+                    idx,
+                    file,
+                    str(input_path),
+                    str(output_path),
+                    settings,
+                    cache_path,
+                    output_options,
                 )
-                token_sort_ratio_sum += token_sort_ratio
-
-            accuracy_score = None
-            if toc:
-                accuracy_score = token_sort_ratio_sum / (100 * len(toc))
-                summary_stats["accuracy_scores"].append(accuracy_score)
-
-            results[file] = {
-                "font_counts": len(font_counts),
-                "styles": len(styles),
-                "page_numbers": len(page_numbers),
-                "size_tag": len(size_tags),
-                "footnotes": len(footnotes),
-                "parsed_content": len(parsed_content),
-                "table_of_contents_length": len(toc) if toc else None,
-                "accuracy_score": accuracy_score,
-            }
-            table_of_contents_cnt += min(len(toc), 1)
-
-            print("font_counts:", int(len(font_counts)))
-            print("styles:", int(len(styles)))
-            print("page_numbers:", int(len(page_numbers)))
-            print("size_tag:", int(len(size_tags)))
-            print("footnotes:", int(len(footnotes)))
-            print("parsed_content:", int(len(parsed_content)))
-
-            print("")
-            pdoc.write_files(output_path=output_path)
-        # if idx > 2:
-        #     break
+            )
+
+    def record_result(file: str, stats: Dict):
+        file_results[file] = stats
+        manifest[file] = manifest_entries[file]
+        write_parsing_manifest(manifest, output_path)
+
+    def record_quarantine(file: str, reason: str, description: str):
+        quarantine[file] = {
+            "sha256": manifest_entries[file]["sha256"],
+            "reason": reason,
+            "description": description,
+        }
+        write_quarantine(quarantine, output_path)
+
+    file_results = {}
+    limits = {"timeout": timeout, "memory_limit": memory_limit}
+    supervised = timeout is not None or memory_limit is not None
+    if workers > 1:
+        page_counts = {
+            task[1]: pdf_page_count(
+                os.path.join(input_path, task[1]), settings.get("page_range")
+            )
+            for task in tasks
+        }
+        # Very large documents which would take longer than the rest of the batch are parsed first, one at a time
+        # with their pages extracted by all workers, so that they do not become the long tail of the batch
+        pages_per_worker = sum(page_counts.values()) / workers
+        large_tasks = [
+            task
+            for task in tasks
+            if page_counts[task[1]] >= max(_PAGE_PARALLEL_MIN_PAGES, pages_per_worker)
+        ]
+        for task in large_tasks:
+            if supervised:
+                _parse_supervised(
+                    task, workers, record_result, record_quarantine, limits
+                )
+            else:
+                record_result(*_parse_pdf_file_task(task, page_workers=workers))
+        tasks = [task for task in tasks if task not in large_tasks]
+
+        print("Parsing {} files using {} workers".format(len(tasks), workers))
+        _parse_scheduled(
+            tasks,
+            page_counts,
+            workers,
+            memory_budget,
+            record_result,
+            record_quarantine,
+            limits,
+        )
+    elif supervised:
+        for task in tasks:
+            _parse_supervised(task, 1, record_result, record_quarantine, limits)
+    else:
+        for task in tasks:
+            record_result(*_parse_pdf_file_task(task))
+    write_quarantine(quarantine, output_path)
+
+    # Keep stats of files that were not re-parsed
+    results_path = os.path.join(output_path, "summary/parsing_results.json")
+    if replace_files != "y" and os.path.exists(results_path):
+        with open(results_path, "r") as f:
+            file_results = {**json.loads(f.read()), **file_results}
+    for file in quarantine:
+        file_results.pop(file, None)
+
+    # Merge per file stats in file name order regardless of the order in which files finished
+    results = {}
+    table_of_contents_cnt = 0
+    table_of_contents_layouts = Counter()
+    for file in sorted(file_results):
+        results[file] = file_results[file]
+        if results[file]["accuracy_score"] is not None:
+            summary_stats["accuracy_scores"].append(results[file]["accuracy_score"])
+        table_of_contents_cnt += min(results[file]["table_of_contents_length"] or 0, 1)
+        table_of_contents_layouts[results[file].get("table_of_contents_layout")] += 1
 
     print(summary_stats)
     print(
@@ -1757,8 +2764,10 @@ def parse_pdf_directory(replace_files: str):
         len(summary_stats["accuracy_scores"]),
     )
     print("table_of_contents_cnt:", table_of_contents_cnt)
+    print("table_of_contents_layouts:", dict(table_of_contents_layouts))
+    print("quarantined files:", len(quarantine))
     # Write results data
-    with open(os.path.join(output_path, "summary/parsing_results.json"), "w") as f:
+    with _atomic_write(results_path) as f:
         f.write(json.dumps(results))
 
 
@@ -1766,15 +2775,91 @@ def parse_pdf_directory(replace_files: str):
 @click.option(
     "--replace_parsed_files",
     default="y",
-    prompt="Replace already parsed files in path?",
-    type=click.Choice(["y", "n"]),
+    prompt="Replace already parsed files in path? (y: all / n: keep parsed files / changed: only new or changed files)",
+    type=click.Choice(["y", "n", "changed"]),
+)
+@click.option(
+    "--workers",
+    default=1,
+    type=click.IntRange(min=1),
+    help="Number of worker processes used for parsing pdf files in parallel.",
+)
+@click.option(
+    "--front_matter",
+    is_flag=True,
+    default=False,
+    help="Only parse the first pages of each pdf file (written to the front_matter results folder).",
+)
+@click.option(
+    "--memory_budget",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Memory budget (MB) for all pdf files parsed at the same time, limits how many large files run at once.",
+)
+@click.option(
+    "--use_cache",
+    is_flag=True,
+    default=False,
+    help="Checkpoint raw pdf extraction and parsing stages and resume from valid checkpoints.",
 )
-def main(replace_parsed_files):
+@click.option(
+    "--timeout",
+    default=None,
+    type=click.FloatRange(min=0),
+    help="Time limit (seconds) for parsing a single pdf file, files exceeding it are quarantined.",
+)
+@click.option(
+    "--memory_limit",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Memory limit (MB) per process for parsing a single pdf file, files exceeding it are quarantined.",
+)
+@click.option(
+    "--corpus_only",
+    is_flag=True,
+    default=False,
+    help="Skip pdf files excluded from the eba analysis by their crawler metadata.",
+)
+@click.option(
+    "--stream",
+    is_flag=True,
+    default=False,
+    help="Write parsed content page by page while parsing (lower memory per worker).",
+)
+@click.option(
+    "--content_format",
+    default="json",
+    type=click.Choice(["json", "store"]),
+    help="Format of the parsed content files: json lines or binary content store.",
+)
+def main(
+    replace_parsed_files,
+    workers,
+    front_matter,
+    memory_budget,
+    use_cache,
+    timeout,
+    memory_limit,
+    corpus_only,
+    stream,
+    content_format,
+):
     """ Command line method for parsing all pdf files in a directory """
     # Run from project level
-    # python -m parse_evaluations.parse_evaluation
-
-    parse_pdf_directory(replace_parsed_files)
+    # python -m parse_evaluations.parse_evaluation --workers 4
+
+    parse_pdf_directory(
+        replace_parsed_files,
+        workers,
+        front_matter,
+        use_cache,
+        memory_budget,
+        timeout,
+        memory_limit,
+        corpus_only,
+        stream,
+        content_format,
+    )
 
 
 if __name__ == "__main__":
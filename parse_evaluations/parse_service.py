@@ -0,0 +1,297 @@
+"""Long-lived local parse service which parses pdf files on request with all parser modules loaded once."""
+
+import os
+import pickle
+import socket
+import struct
+import tempfile
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import (
+    Client,
+    Listener,
+    answer_challenge,
+    deliver_challenge,
+)
+from pathlib import Path
+from typing import Dict, Tuple
+import click
+from parse_evaluations.parse_evaluation import (
+    _PARSE_SETTINGS,
+    _PARSING_MANIFEST_FILE,
+    SupervisedProcess,
+    _atomic_write,
+    load_parsing_manifest,
+    parse_pdf_file,
+    parsing_manifest_entry,
+    write_parsing_manifest,
+)
+from util import (
+    _PARSED_FILES_PATH,
+    load_jsonl,
+    load_parsed_content,
+    parsed_content_path,
+)
+
+_SERVICE_ADDRESS = ("localhost", 6010)
+# Seconds a client may take for the authentication and for sending (or receiving) a message
+_CONNECTION_TIMEOUT = 10
+# Random authentication key of the running service, only readable by the user running it
+_SERVICE_KEY_FILE = _PARSED_FILES_PATH / "summary" / "parse_service.key"
+
+
+class ParseService:
+    """
+    Resident parse worker listening on a local socket (multiprocessing.connection).
+
+    Imports (fitz, fuzzywuzzy, spaCy via util) and the interpreter are loaded once, requests are parsed one at a
+    time in the order they arrive, each in a supervised child process with the timeout and memory limit of the
+    service (see SupervisedProcess). Each connection sends a single request, clients which do not authenticate or
+    send their request within connection_timeout are dropped. A request is a dict with either
+        path: path of a pdf file readable by the service, or
+        name, pdf: file name and content (bytes) of a pdf file, e.g. a newly crawled evaluation,
+    and the optional keys
+        output_path: folder the parsed files are written to (default: output_path of the service),
+        settings: ParseDoc settings overriding the settings of the service,
+        content_format: format of the parsed content file, json (default) or store (see ContentStore),
+        return_content: also return the parsed content and table of contents,
+        stop: stop the service after answering the request (no pdf is parsed if neither path nor pdf is given).
+
+    The response contains file, output_path, the parsing stats, timings (seconds per parsing stage and total)
+    and error if parsing failed or exceeded the limits. Parsed files are added to the parsing manifest of the
+    output path like files parsed by parse_pdf_directory.
+    """
+
+    def __init__(
+        self,
+        address: Tuple[str, int] = _SERVICE_ADDRESS,
+        output_path: str = _PARSED_FILES_PATH,
+        settings: Dict = _PARSE_SETTINGS,
+        cache_path: str = None,
+        key_file: str = _SERVICE_KEY_FILE,
+        connection_timeout: float = _CONNECTION_TIMEOUT,
+        timeout: float = None,
+        memory_limit: int = None,
+    ):
+        """
+        :param address: (host, port) of the service, port 0 picks a free port (see address attribute).
+        :param cache_path: folder of the parse cache (default: no cache).
+        :param key_file: file the authentication key is written to, clients read it (see request_parse).
+        :param connection_timeout: seconds a client may take for the authentication and for sending its request
+            or receiving the response.
+        :param timeout: wall-clock time limit (seconds) for parsing a single file (None: no limit).
+        :param memory_limit: memory limit (MB) for parsing a single file (None: no limit).
+        """
+        self.output_path = str(output_path)
+        self.settings = settings
+        self.cache_path = cache_path
+        self.key_file = str(key_file)
+        self.connection_timeout = connection_timeout
+        self.limits = {"timeout": timeout, "memory_limit": memory_limit}
+        self.authkey = os.urandom(32)
+        # Clients are authenticated in serve with a timeout, Listener.accept would wait for them indefinitely
+        self.listener = Listener(address)
+        self.address = self.listener.address
+        Path(key_file).parent.mkdir(parents=True, exist_ok=True)
+        with _atomic_write(str(key_file), mode="wb") as f:
+            os.chmod(f.name, 0o600)
+            f.write(self.authkey)
+
+    def handle(self, request: Dict) -> Dict:
+        """Parses the pdf file of a request and returns the response."""
+        start = time.perf_counter()
+        output_path = str(request.get("output_path", self.output_path))
+        settings = {**self.settings, **request.get("settings", {})}
+        content_format = request.get("content_format", "json")
+        response = {"output_path": output_path, "timings": {}}
+        try:
+            with tempfile.TemporaryDirectory() as tmp_path:
+                if "pdf" in request:
+                    file_path = os.path.join(
+                        tmp_path, os.path.basename(request["name"])
+                    )
+                    with open(file_path, "wb") as f:
+                        f.write(request["pdf"])
+                else:
+                    file_path = request["path"]
+                response["file"] = os.path.basename(file_path)
+                process = SupervisedProcess(
+                    _parse_request,
+                    (file_path, output_path, settings, self.cache_path, content_format),
+                    **self.limits,
+                )
+                outcome = None
+                while outcome is None:
+                    SupervisedProcess.wait([process])
+                    outcome = process.poll()
+                status, value = outcome
+                if status == "done":
+                    response["stats"], response["timings"] = value
+                    _add_manifest_entry(
+                        response["file"],
+                        parsing_manifest_entry(file_path, settings, content_format),
+                        output_path,
+                    )
+                elif status == "error":
+                    response["error"] = repr(value)
+                else:
+                    response["error"] = "{}: {}".format(status, value)
+            if request.get("return_content") and "error" not in response:
+                file_id = response["file"].split(".")[0]
+                response["parsed_content"] = load_parsed_content(
+                    parsed_content_path(file_id, output_path)
+                )
+                response["table_of_contents"] = load_jsonl(
+                    os.path.join(output_path, f"{file_id}_meta.json")
+                )
+        except Exception as e:
+            response["error"] = repr(e)
+        response["timings"]["total"] = time.perf_counter() - start
+        return response
+
+    def serve(self):
+        """Answers requests until a request with stop is received, the key file is removed when the service stops.
+        Failing, slow or malformed connections and requests are answered with an error (if possible) or dropped.
+        """
+        print("Parse service listening on {}:{}".format(*self.address))
+        stop = False
+        try:
+            while not stop:
+                try:
+                    connection = self.listener.accept()
+                except OSError as e:
+                    print("Rejected connection: {!r}".format(e))
+                    continue
+                with connection:
+                    stop = self._answer(connection)
+        finally:
+            self.listener.close()
+            if os.path.exists(self.key_file):
+                os.remove(self.key_file)
+
+    def _answer(self, connection) -> bool:
+        """Authenticates the client and answers its request, returns whether the service should stop."""
+        _set_timeout(connection, self.connection_timeout)
+        try:
+            deliver_challenge(connection, self.authkey)
+            answer_challenge(connection, self.authkey)
+        except AuthenticationError:
+            print("Rejected connection: authentication failed")
+            return False
+        except (EOFError, OSError) as e:
+            print("Rejected connection: {!r}".format(e))
+            return False
+        try:
+            data = connection.recv_bytes()
+        except (EOFError, OSError) as e:
+            print("Closed connection: {!r}".format(e))
+            return False
+        try:
+            request = pickle.loads(data)
+        except Exception as e:
+            request = e
+        if not isinstance(request, dict):
+            stop = False
+            response = {"error": "Malformed request: {!r}".format(request)[:1000]}
+        else:
+            stop = request.get("stop", False)
+            if "path" in request or "pdf" in request:
+                response = self.handle(request)
+                print(response.get("file"), response["timings"])
+            else:
+                response = {}
+        try:
+            connection.send(response)
+        except OSError as e:
+            print("Closed connection: {!r}".format(e))
+        return stop
+
+
+def _parse_request(
+    file_path: str,
+    output_path: str,
+    settings: Dict,
+    cache_path: str,
+    content_format: str,
+) -> Tuple[Dict, Dict]:
+    """Supervised child of ParseService.handle: parses a pdf file, returns the parsing stats and stage timings."""
+    timings = {}
+    stats = parse_pdf_file(
+        file_path,
+        output_path,
+        settings,
+        cache_path,
+        timings=timings,
+        content_format=content_format,
+    )
+    return stats, timings
+
+
+def _add_manifest_entry(file: str, manifest_entry: Dict, output_path: str):
+    """Adds the manifest entry of a parsed file to the parsing manifest of output_path (see parse_pdf_directory)."""
+    os.makedirs(
+        os.path.dirname(os.path.join(output_path, _PARSING_MANIFEST_FILE)),
+        exist_ok=True,
+    )
+    manifest = load_parsing_manifest(output_path)
+    manifest[file] = manifest_entry
+    write_parsing_manifest(manifest, output_path)
+
+
+def _set_timeout(connection, timeout: float):
+    """Sets a timeout (seconds) for each blocking read and write of a connection, a timed out read or write
+    raises an OSError."""
+    seconds = int(timeout)
+    timeval = struct.pack("ll", seconds, int((timeout - seconds) * 1e6))
+    with socket.socket(fileno=os.dup(connection.fileno())) as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO, timeval)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, timeval)
+
+
+def request_parse(
+    request: Dict,
+    address: Tuple[str, int] = _SERVICE_ADDRESS,
+    key_file: str = _SERVICE_KEY_FILE,
+) -> Dict:
+    """Sends a request to a running parse service and returns the response (see ParseService)."""
+    with open(key_file, "rb") as f:
+        authkey = f.read()
+    with Client(address, authkey=authkey) as connection:
+        connection.send(request)
+        return connection.recv()
+
+
+@click.command()
+@click.option("--host", default=_SERVICE_ADDRESS[0], help="Host of the service.")
+@click.option("--port", default=_SERVICE_ADDRESS[1], help="Port of the service.")
+@click.option(
+    "--use_cache",
+    is_flag=True,
+    default=False,
+    help="Checkpoint raw pdf extraction and parsing stages and resume from valid checkpoints.",
+)
+@click.option(
+    "--timeout",
+    default=None,
+    type=click.FloatRange(min=0),
+    help="Time limit (seconds) for parsing a single pdf file.",
+)
+@click.option(
+    "--memory_limit",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Memory limit (MB) per process for parsing a single pdf file.",
+)
+def main(host, port, use_cache, timeout, memory_limit):
+    """ Command line method for running the parse service """
+    # Run from project level
+    # python -m parse_evaluations.parse_service
+    cache_path = str(_PARSED_FILES_PATH / "cache") if use_cache else None
+    ParseService(
+        (host, port), cache_path=cache_path, timeout=timeout, memory_limit=memory_limit
+    ).serve()
+
+
+if __name__ == "__main__":
+    # pylint: disable=no-value-for-parameter
+    main()
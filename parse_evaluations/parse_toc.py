@@ -1,10 +1,16 @@
-import json, re
+import io, json, re
+from contextlib import nullcontext
+from multiprocessing import Pool
 from pathlib import Path
+from typing import Optional, Tuple
+import click
 from util import (
     _PARSED_FILES_PATH,
     load_jsonl,
     dump_jsonl,
     files_to_exclude,
+    is_parsed_content_file,
+    dump_category_ranges,
 )
 from util import (
     _EXECUTIVE_SUMMARY_VARIATIONS,
@@ -14,171 +20,182 @@ from util import (
     _TERMS_OF_REFERENCE,
     _INTRODUCTION_VARIATIONS,
 )
+from parse_evaluations.section_classifier import SectionClassifier
 
+_SECTION_CLASSIFIER = SectionClassifier(
+    {
+        **_DAC_CRITERIA_VARIATIONS,
+        "introduction": _INTRODUCTION_VARIATIONS,
+        "recommendations": _RECOMMENDATION_SECTION_VARIATIONS,
+        "executive_summary": _EXECUTIVE_SUMMARY_VARIATIONS,
+        "concluding_sections": _CONCLUDING_SECTION_VARIATIONS,
+        "terms_of_reference": _TERMS_OF_REFERENCE,
+    }
+)
 
-def parse_toc(file_path):
-    """ Parsing table of contents for deriving categories - creates a "category" dict key 
-    in meta files which denotes whether entry belongs to a specific category e.g. Executive Summary, 
-    Conclusions, of Terms of Reference...
 
-    Method also outputs some summary stats in the summary folder."""
-    file_path = Path(file_path)
-    summary_stats = dict()
-    cnt_parsed_files = 0
-    invalid_file_ids = files_to_exclude()  # Files to not include in final report
+def category_ranges(toc: list) -> dict:
+    """Content ranges of the categories of toc rows: dict of category -> sorted list of [start, end) content_idx
+    ranges, end None: until the end of the content (see util.load_category_ranges).
 
-    for file in sorted(file_path.iterdir()):
-        if file.name.endswith("_meta.json"):  # and "2020:19" in file.name:
-            file_id = file.name.replace("_meta.json", "")
-            toc = load_jsonl(file)
-            executive_summary, concluding_sections, dac, terms_of_reference = (
-                None,
-                None,
-                None,
-                None,
-            )
-            if toc:
-                summary_stats[file_id] = dict()
+    A toc row covers the content from its matched block up to the block matched by the next row. Blocks covered
+    by several rows with categories (toc matches out of order) belong to the categories of the first of these rows.
+    """
+    ranges = {}
+    covered = []  # [start, end) ranges assigned to a preceding row
+    content_idxs = [c["toc_match"]["content_idx"] for c in toc]
+    for c, start, end in zip(toc, content_idxs, content_idxs[1:] + [None]):
+        end = float("inf") if end is None else end
+        if c.get("category") and start < end:
+            parts = [[start, end]]
+            for covered_start, covered_end in covered:
+                parts = [
+                    part
+                    for part_start, part_end in parts
+                    for part in (
+                        [part_start, min(part_end, covered_start)],
+                        [max(part_start, covered_end), part_end],
+                    )
+                    if part[0] < part[1]
+                ]
+            for category in dict.fromkeys(c["category"]):
+                ranges.setdefault(category, []).extend(parts)
+            covered.append([start, end])
+
+    for category, category_parts in ranges.items():
+        merged = []
+        for start, end in sorted(category_parts):
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
             else:
-                print("Table of contents not found for: ", file_id)
+                merged.append([start, end])
+        ranges[category] = [
+            [start, None if end == float("inf") else end] for start, end in merged
+        ]
+    return ranges
 
-            parent_categories = {}
-            for t_id, c in enumerate(toc):
-                if c["type"] == "toc":
-                    c["category"] = []
-                    if c["section_type"] == "Main":
-                        # print(c.get("section"), c["text"], dac_criteria_section_num)
-                        for dac_key, dac_val in _DAC_CRITERIA_VARIATIONS.items():
-                            dac_criteria = next(
-                                (
-                                    (idx, var)
-                                    for idx, var in enumerate(dac_val)
-                                    if var in c["text"].lower()
-                                ),
-                                None,
-                            )
-                            if dac_criteria:
-                                if c.get("section"):
-                                    parent_categories.setdefault(
-                                        c.get("section"), [dac_key]
-                                    ).append(dac_key)
-                                c["category"].append(dac_key)
-                                summary_stats[file_id][dac_key] = True
 
-                        # Identify intro section
-                        introduction_section = next(
-                            (
-                                (idx, var)
-                                for idx, var in enumerate(_INTRODUCTION_VARIATIONS)
-                                if var in c["text"].lower()
-                            ),
-                            None,
-                        )
-                        if introduction_section:
-                            if c.get("section"):
-                                parent_categories.setdefault(
-                                    c.get("section"), ["introduction"]
-                                ).append("introduction")
-                                # parent_categories[c.get("section")] = "recommendations"
-                            c["category"].append("introduction")
-                            summary_stats[file_id]["introduction"] = True
+def classify_toc(toc: list) -> Optional[dict]:
+    """Sets the "category" list of the toc rows of a document.
 
-                        # Identify recommendation section
-                        recommendation_section = next(
-                            (
-                                (idx, var)
-                                for idx, var in enumerate(
-                                    _RECOMMENDATION_SECTION_VARIATIONS
-                                )
-                                if var in c["text"].lower()
-                            ),
-                            None,
-                        )
-                        if recommendation_section:
-                            if c.get("section"):
-                                parent_categories.setdefault(
-                                    c.get("section"), ["recommendations"]
-                                ).append("recommendations")
-                                # parent_categories[c.get("section")] = "recommendations"
-                            c["category"].append("recommendations")
-                            summary_stats[file_id]["recommendations"] = True
+    :returns: dict of the categories found in the document (summary stats) or None if the document has no toc.
+    """
+    if not toc:
+        return None
+    file_stats = dict()
+    parent_categories = {}
+    for t_id, c in enumerate(toc):
+        if c["type"] == "toc":
+            c["category"] = []
+            categories = _SECTION_CLASSIFIER.classify(c["text"])
+            if c["section_type"] == "Main":
+                # print(c.get("section"), c["text"], dac_criteria_section_num)
+                for dac_key in _DAC_CRITERIA_VARIATIONS:
+                    if dac_key in categories:
+                        if c.get("section"):
+                            parent_categories.setdefault(
+                                c.get("section"), [dac_key]
+                            ).append(dac_key)
+                        c["category"].append(dac_key)
+                        file_stats[dac_key] = True
 
-                        # Identify Executive summary
-                        executive_summary = next(
-                            (
-                                (idx, var)
-                                for idx, var in enumerate(_EXECUTIVE_SUMMARY_VARIATIONS)
-                                if var in c["text"].lower()
-                            ),
-                            None,
-                        )
-                        if not summary_stats[file_id].get("executive_summary"):
-                            if executive_summary:
-                                c["category"].append("executive_summary")
-                                summary_stats[file_id]["executive_summary"] = True
-                            elif "Summary" in c["text"] and not summary_stats[
-                                file_id
-                            ].get("introduction"):
-                                c["category"].append("executive_summary")
-                                summary_stats[file_id]["executive_summary"] = True
+                # Identify intro section
+                if "introduction" in categories:
+                    if c.get("section"):
+                        parent_categories.setdefault(
+                            c.get("section"), ["introduction"]
+                        ).append("introduction")
+                        # parent_categories[c.get("section")] = "recommendations"
+                    c["category"].append("introduction")
+                    file_stats["introduction"] = True
 
-                        # Identify concluding sections
-                        concluding_sections = next(
-                            (
-                                (idx, var)
-                                for idx, var in enumerate(
-                                    _CONCLUDING_SECTION_VARIATIONS
-                                )
-                                if var in c["text"].lower()
-                            ),
-                            None,
-                        )
-                        if concluding_sections:
-                            parent_categories.setdefault(
-                                c.get("section"), ["concluding_sections"]
-                            ).append("concluding_sections")
-                            c["category"].append("concluding_sections")
-                            summary_stats[file_id]["concluding_sections"] = True
+                # Identify recommendation section
+                if "recommendations" in categories:
+                    if c.get("section"):
+                        parent_categories.setdefault(
+                            c.get("section"), ["recommendations"]
+                        ).append("recommendations")
+                        # parent_categories[c.get("section")] = "recommendations"
+                    c["category"].append("recommendations")
+                    file_stats["recommendations"] = True
+
+                # Identify Executive summary
+                if not file_stats.get("executive_summary"):
+                    if "executive_summary" in categories:
+                        c["category"].append("executive_summary")
+                        file_stats["executive_summary"] = True
+                    elif "Summary" in c["text"] and not file_stats.get("introduction"):
+                        c["category"].append("executive_summary")
+                        file_stats["executive_summary"] = True
+
+                # Identify concluding sections
+                if "concluding_sections" in categories:
+                    parent_categories.setdefault(
+                        c.get("section"), ["concluding_sections"]
+                    ).append("concluding_sections")
+                    c["category"].append("concluding_sections")
+                    file_stats["concluding_sections"] = True
+
+                # if current section is a subsection then we add the parent section category
+                if parent_categories.get(c.get("parent_section")):
+                    c["category"] += parent_categories.get(c.get("parent_section"))
+                c["category"] = list(set(c["category"]))
 
-                        # if current section is a subsection then we add the parent section category
-                        if parent_categories.get(c.get("parent_section")):
-                            c["category"] += parent_categories.get(
-                                c.get("parent_section")
-                            )
-                        c["category"] = list(set(c["category"]))
+            elif "terms_of_reference" in categories:
+                c["category"] = ["terms_of_reference"]
+                file_stats["terms_of_reference"] = True
+    return file_stats
 
-                    else:
-                        terms_of_reference = next(
-                            (
-                                (idx, var)
-                                for idx, var in enumerate(_TERMS_OF_REFERENCE)
-                                if var in c["text"].lower()
-                            ),
-                            None,
-                        )
-                        if terms_of_reference:
-                            c["category"] = ["terms_of_reference"]
-                            summary_stats[file_id]["terms_of_reference"] = True
-            print(file_id)
-            for r in toc:
-                print(r)
-            print("")
-            dump_jsonl(toc, file)
 
-            ## Adds category also to content file
-            prev_content_idx = None
-            content_filename = file_id + "_content.json"
-            contents = load_jsonl(_PARSED_FILES_PATH / content_filename)
-            for c in toc[::-1]:
-                if c["category"]:
-                    content_idx = c["toc_match"]["content_idx"]
-                    for content in contents[content_idx:prev_content_idx]:
-                        content["category"] = c["category"]
-                prev_content_idx = c["toc_match"]["content_idx"]
+def _parse_toc_file(file: Path) -> Tuple[str, Optional[dict], str]:
+    """Process pool task: categorizes the toc of a meta file, rewrites the meta file and writes the category
+    ranges of the document.
 
-            dump_jsonl(contents, _PARSED_FILES_PATH / content_filename)
-        elif file.name.endswith("_content.json"):
-            cnt_parsed_files += 1
+    :returns: (file_id, summary stats of the file, log)
+    """
+    file_id = file.name.replace("_meta.json", "")
+    log = io.StringIO()
+    toc = load_jsonl(file)
+    file_stats = classify_toc(toc)
+    if file_stats is None:
+        print("Table of contents not found for: ", file_id, file=log)
+    print(file_id, file=log)
+    for r in toc:
+        print(r, file=log)
+    print("", file=log)
+    dump_jsonl(toc, file)
+
+    ## Content ranges of the categories (the content file is not rewritten)
+    dump_category_ranges(category_ranges(toc), file_id, file.parent)
+    return file_id, file_stats, log.getvalue()
+
+
+def parse_toc(file_path, workers: int = 1):
+    """ Parsing table of contents for deriving categories - creates a "category" dict key 
+    in meta files which denotes whether entry belongs to a specific category e.g. Executive Summary, 
+    Conclusions, of Terms of Reference...
+    The content ranges of the categories are written to [file_id]_categories.json (see category_ranges).
+
+    Method also outputs some summary stats in the summary folder.
+
+    :param workers: number of worker processes categorizing files in parallel."""
+    file_path = Path(file_path)
+    summary_stats = dict()
+    invalid_file_ids = files_to_exclude()  # Files to not include in final report
+
+    files = sorted(file_path.iterdir())
+    meta_files = [file for file in files if file.name.endswith("_meta.json")]
+    cnt_parsed_files = sum(is_parsed_content_file(file) for file in files)
+    with Pool(processes=workers) if workers > 1 else nullcontext() as pool:
+        results = (
+            pool.imap(_parse_toc_file, meta_files, chunksize=16)
+            if pool
+            else map(_parse_toc_file, meta_files)
+        )
+        for file_id, file_stats, log in results:
+            print(log, end="")
+            if file_stats is not None:
+                summary_stats[file_id] = file_stats
 
     # Write results data
     with open(_PARSED_FILES_PATH / "summary/parsing_meta_results.json", "w") as f:
@@ -245,12 +262,19 @@ def parse_toc(file_path):
         f.write(json.dumps(stats))
 
 
-def main():
+@click.command()
+@click.option(
+    "--workers",
+    default=1,
+    type=click.IntRange(min=1),
+    help="Number of worker processes used for categorizing files in parallel.",
+)
+def main(workers):
     """ Command line method for parsing all table of contents in a directory """
     # Run from project level
     # python -m parse_evaluations.parse_toc
 
-    parse_toc(_PARSED_FILES_PATH)
+    parse_toc(_PARSED_FILES_PATH, workers)
     print("Success parsing table of contents!")
 
 
@@ -0,0 +1,57 @@
+"""Multi-pattern classification of table of contents headings."""
+
+from typing import Dict, List, Set
+
+
+class SectionClassifier:
+    """
+    Classifies headings into categories given by substring variations, e.g. {"introduction": ["introduction"]}.
+
+    A heading belongs to a category if any of the category's variations is a substring of the lower cased heading.
+    All variations are compiled into a single Aho-Corasick automaton, hence a heading is scanned once for all
+    categories instead of once per variation.
+    """
+
+    def __init__(self, variations: Dict[str, List[str]]):
+        self._next = [{}]  # transitions of each state
+        self._fail = [0]  # longest proper suffix state of each state
+        self._categories = [set()]  # categories of the variations ending in each state
+        for category, category_variations in variations.items():
+            for variation in category_variations:
+                self._add(variation, category)
+        self._link()
+
+    def _add(self, variation: str, category: str):
+        state = 0
+        for char in variation:
+            if char not in self._next[state]:
+                self._next.append({})
+                self._fail.append(0)
+                self._categories.append(set())
+                self._next[state][char] = len(self._next) - 1
+            state = self._next[state][char]
+        self._categories[state].add(category)
+
+    def _link(self):
+        """Sets the failure links breadth first, states inherit the categories of their failure state."""
+        queue = list(self._next[0].values())
+        for state in queue:
+            for char, next_state in self._next[state].items():
+                fail = self._fail[state]
+                while fail and char not in self._next[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._next[fail].get(char, 0)
+                self._categories[next_state] |= self._categories[self._fail[next_state]]
+                queue.append(next_state)
+
+    def classify(self, text: str) -> Set[str]:
+        """Categories of a heading."""
+        _next, _fail, _categories = self._next, self._fail, self._categories
+        state, categories = 0, set(_categories[0])
+        for char in text.lower():
+            while state and char not in _next[state]:
+                state = _fail[state]
+            state = _next[state].get(char, 0)
+            if _categories[state]:
+                categories |= _categories[state]
+        return categories
@@ -0,0 +1,217 @@
+"""Columnar storage of the text spans extracted from a PDF document."""
+
+from array import array
+from multiprocessing import Pool
+from typing import Dict, Iterator, Tuple
+import fitz
+
+
+class SpanStore:
+    """
+    Compact per-document store of all text spans extracted by PyMuPDF (page.getText("dict")).
+
+    Every page of a document is extracted once and flattened into array-backed columns (size, font id, color, bbox)
+    with the span texts kept in a single string heap. Lines and pages are stored as separate tables pointing into
+    the span columns so that the parsing passes of ParseDoc can walk the document page by page and line by line
+    without re-running the MuPDF text extraction or holding the nested span dicts in memory.
+
+    Note: block_id and line_id follow the enumeration of page.getText("dict"), i.e. block_id also counts non-text blocks.
+    """
+
+    def __init__(self):
+        # page table
+        self.page_width = array("d")
+        self.page_height = array("d")
+        self.page_line_start = array("q", [0])
+
+        # line table
+        self.line_block_id = array("q")
+        self.line_id = array("q")
+        self.line_x0 = array("d")
+        self.line_x1 = array("d")
+        self.line_span_start = array("q", [0])
+
+        # span table
+        self.size = array("d")
+        self.font_id = array("q")
+        self.color = array("q")
+        self.bbox = array("d")  # flat x0, y0, x1, y1 per span
+        self.text_offsets = array("q", [0])
+        self.fonts = []
+        self._font_ids = {}
+        self._text_parts = []
+        self._text = ""
+
+    @classmethod
+    def from_doc(cls, doc, page_ids: range = None) -> "SpanStore":
+        """Extract all pages of an opened fitz document.
+
+        :param page_ids: only extract these pages (default: all pages). Preceding pages are added without spans
+            so that page ids of the store are the page ids of the document.
+        """
+        store = cls()
+        if page_ids is None:
+            page_ids = range(len(doc))
+        for page_id in range(page_ids[-1] + 1 if page_ids else 0):
+            if page_id in page_ids:
+                store.add_page(doc[page_id].getText("dict"))
+            else:
+                store.add_page({"width": 0.0, "height": 0.0, "blocks": []})
+        store.pack()
+        return store
+
+    @classmethod
+    def from_file(
+        cls,
+        doc_path: str,
+        page_ids: range = None,
+        workers: int = 1,
+        chunk_size: int = 25,
+    ) -> "SpanStore":
+        """Extract the pages of a pdf file using several worker processes. Each worker opens the pdf and extracts
+        chunks of chunk_size consecutive pages, the chunks are joined in page order. The result is identical to
+        from_doc.
+
+        :param page_ids: only extract these pages (default: all pages).
+        """
+        doc = fitz.open(doc_path)
+        try:
+            if page_ids is None:
+                page_ids = range(len(doc))
+            if workers < 2 or len(page_ids) <= chunk_size:
+                return cls.from_doc(doc, page_ids)
+        finally:
+            doc.close()
+
+        chunks = [
+            (doc_path, page_ids[idx : idx + chunk_size])
+            for idx in range(0, len(page_ids), chunk_size)
+        ]
+        store = cls()
+        for _ in range(page_ids[0]):
+            store.add_page({"width": 0.0, "height": 0.0, "blocks": []})
+        with Pool(processes=min(workers, len(chunks))) as pool:
+            for chunk in pool.imap(_extract_pages, chunks):
+                store.extend(chunk)
+        return store
+
+    def add_page(self, page_dict: dict):
+        """Append the text spans of a page dict as returned by page.getText("dict")."""
+        self.page_width.append(page_dict["width"])
+        self.page_height.append(page_dict["height"])
+        for block_id, b in enumerate(page_dict["blocks"]):
+            if b["type"] != 0:  # only text blocks contain lines
+                continue
+            for line_id, l in enumerate(b["lines"]):
+                self.line_block_id.append(block_id)
+                self.line_id.append(line_id)
+                self.line_x0.append(l["bbox"][0])
+                self.line_x1.append(l["bbox"][2])
+                for s in l["spans"]:
+                    self.size.append(s["size"])
+                    self.font_id.append(self._font_id(s["font"]))
+                    self.color.append(s["color"])
+                    self.bbox.extend(s["bbox"])
+                    self._text_parts.append(s["text"])
+                    self.text_offsets.append(self.text_offsets[-1] + len(s["text"]))
+                self.line_span_start.append(len(self.size))
+        self.page_line_start.append(len(self.line_id))
+
+    def extend(self, other: "SpanStore"):
+        """Append all pages of another store, e.g. extracted from the following pages of the same document."""
+        line_offset, span_offset = len(self.line_id), len(self.size)
+        text_offset = self.text_offsets[-1]
+        font_ids = [self._font_id(font) for font in other.fonts]
+
+        self.page_width.extend(other.page_width)
+        self.page_height.extend(other.page_height)
+        self.page_line_start.extend(s + line_offset for s in other.page_line_start[1:])
+        self.line_block_id.extend(other.line_block_id)
+        self.line_id.extend(other.line_id)
+        self.line_x0.extend(other.line_x0)
+        self.line_x1.extend(other.line_x1)
+        self.line_span_start.extend(s + span_offset for s in other.line_span_start[1:])
+        self.size.extend(other.size)
+        self.font_id.extend(font_ids[font_id] for font_id in other.font_id)
+        self.color.extend(other.color)
+        self.bbox.extend(other.bbox)
+        self.text_offsets.extend(o + text_offset for o in other.text_offsets[1:])
+        self._text_parts.append(other._text + "".join(other._text_parts))
+        self.pack()
+
+    def _font_id(self, font: str) -> int:
+        font_id = self._font_ids.get(font)
+        if font_id is None:
+            font_id = self._font_ids[font] = len(self.fonts)
+            self.fonts.append(font)
+        return font_id
+
+    def pack(self):
+        """Join span texts appended since the last call into the string heap."""
+        if self._text_parts:
+            self._text += "".join(self._text_parts)
+            self._text_parts = []
+
+    def __len__(self) -> int:
+        return len(self.size)
+
+    @property
+    def page_count(self) -> int:
+        return len(self.page_width)
+
+    def text(self, idx: int) -> str:
+        return self._text[self.text_offsets[idx] : self.text_offsets[idx + 1]]
+
+    def font(self, idx: int) -> str:
+        return self.fonts[self.font_id[idx]]
+
+    def span_bbox(self, idx: int) -> Tuple[float, float, float, float]:
+        return tuple(self.bbox[4 * idx : 4 * idx + 4])
+
+    def span(self, idx: int) -> Dict:
+        """Returns span as a dict with the same keys as the PyMuPDF span dict used by the parser."""
+        return {
+            "text": self.text(idx),
+            "size": self.size[idx],
+            "font": self.font(idx),
+            "color": self.color[idx],
+            "bbox": self.span_bbox(idx),
+        }
+
+    def page_spans(self, page_id: int) -> range:
+        """Indexes of all spans on a page."""
+        return range(
+            self.line_span_start[self.page_line_start[page_id]],
+            self.line_span_start[self.page_line_start[page_id + 1]],
+        )
+
+    def page_lines(self, page_id: int) -> Iterator[Tuple[int, int, float, range]]:
+        """Iterate lines on a page.
+
+        :returns: tuples of (block_id, line_id, line_length, span indexes)
+        """
+        for line_idx in range(
+            self.page_line_start[page_id], self.page_line_start[page_id + 1]
+        ):
+            yield (
+                self.line_block_id[line_idx],
+                self.line_id[line_idx],
+                self.line_x1[line_idx] - self.line_x0[line_idx],
+                range(
+                    self.line_span_start[line_idx], self.line_span_start[line_idx + 1]
+                ),
+            )
+
+
+def _extract_pages(task: Tuple[str, range]) -> SpanStore:
+    """Process pool task: extracts a chunk of pages of a pdf file (without padding preceding pages)."""
+    doc_path, page_ids = task
+    store = SpanStore()
+    doc = fitz.open(doc_path)
+    try:
+        for page_id in page_ids:
+            store.add_page(doc[page_id].getText("dict"))
+    finally:
+        doc.close()
+    store.pack()
+    return store
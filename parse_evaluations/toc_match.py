@@ -0,0 +1,177 @@
+"""Candidate search for matching table of contents rows to parsed content blocks."""
+
+from typing import Dict, List, Optional
+from fuzzywuzzy import fuzz, utils
+
+
+def token_sort_key(text: str) -> str:
+    """Processed and token sorted string as compared by fuzz.token_sort_ratio."""
+    tokens = utils.full_process(text, force_ascii=True).split()
+    return " ".join(sorted(tokens)).strip()
+
+
+def ratio_upper_bound(len_a: int, len_b: int) -> int:
+    """Upper bound of fuzz.ratio for two strings of the given lengths. The ratio is 2 * M / (len_a + len_b)
+    where the number of matching characters M can at most be the length of the shorter string.
+    """
+    if len_a == 0 and len_b == 0:
+        return 100  # fuzz.ratio checks for equivalence before empty strings
+    if len_a == 0 or len_b == 0:
+        return 0
+    return utils.intr(200 * min(len_a, len_b) / (len_a + len_b))
+
+
+class TocMatcher:
+    """
+    Indexes the parsed content of a document for matching table of contents rows to content blocks.
+
+    All blocks are normalized once (fuzzywuzzy token sort processing) and indexed by page_id and by their tokens.
+    Candidates sharing tokens with a toc row are scored first so that a good match is found early, all remaining
+    candidates whose score upper bound (given by the string lengths) cannot beat the best match are skipped.
+    Results are identical to comparing every toc row to every block with fuzz.token_sort_ratio where the
+    first block (lowest content_idx) wins ties.
+    """
+
+    def __init__(self, parsed_content: List[Dict], page_numbers: List[Dict]):
+        self.keys = []
+        self.text_idxs = []
+        self.token_idxs = {}
+        self.page_idxs = {}
+        for bl in parsed_content:
+            self.add(bl)
+
+        # first page_id for each printed page number
+        self.page_number_ids = {}
+        for pp in page_numbers:
+            self.page_number_ids.setdefault(pp["text"], pp["page_id"])
+
+    def add(self, block: Dict):
+        """Indexes the next content block, e.g. while the content is written page by page.
+        Only the processed text of the block is kept."""
+        idx = len(self.keys)
+        self.keys.append(token_sort_key(block["text"]))
+        if block["type"] == "text":
+            self.text_idxs.append(idx)
+            for token in set(self.keys[idx].split()):
+                self.token_idxs.setdefault(token, []).append(idx)
+
+        # Content is ordered by page so blocks of a page are contiguous
+        self.page_idxs.setdefault(block["page_id"], []).append(idx)
+
+    def best_text_match(self, text: str) -> Optional[Dict]:
+        """Best matching text block for a toc row text (fuzz.token_sort_ratio).
+
+        :returns: toc_match dict with content_idx and token_sort_ratio or None if document has no text blocks.
+        """
+        key = token_sort_key(text)
+        key_length = len(key)
+
+        # Candidates sharing tokens with the toc text are scored first (most shared tokens first)
+        shared_tokens = {}
+        for token in set(key.split()):
+            for idx in self.token_idxs.get(token, []):
+                shared_tokens[idx] = shared_tokens.get(idx, 0) + 1
+        candidates = sorted(shared_tokens, key=lambda idx: (-shared_tokens[idx], idx))
+
+        best_idx, best_score = None, -1
+        for idx in candidates:
+            score = fuzz.ratio(self.keys[idx], key)
+            if score > best_score or (score == best_score and idx < best_idx):
+                best_idx, best_score = idx, score
+
+        # Remaining candidates are only scored if they can beat the best match
+        for idx in self.text_idxs:
+            if idx in shared_tokens:
+                continue
+            score_bound = ratio_upper_bound(len(self.keys[idx]), key_length)
+            if score_bound < best_score or (
+                score_bound == best_score and idx > best_idx
+            ):
+                continue
+            score = fuzz.ratio(self.keys[idx], key)
+            if score > best_score or (score == best_score and idx < best_idx):
+                best_idx, best_score = idx, score
+
+        if best_idx is None:
+            return None
+        return {"content_idx": best_idx, "token_sort_ratio": best_score}
+
+    def best_page_match(self, text: str, page_number: str) -> Optional[Dict]:
+        """Best matching block (any type) on the page with the printed page number.
+
+        :returns: toc_match dict or None if the page number is unknown or no block scores above 0.
+        """
+        page_id = self.page_number_ids.get(page_number)
+        if page_id is None:
+            return None
+        return self.best_page_id_match(text, page_id)
+
+    def best_page_id_match(self, text: str, page_id: int) -> Optional[Dict]:
+        """Best matching block (any type) on the page with page_id.
+
+        :returns: toc_match dict or None if no block on the page scores above 0.
+        """
+        key = token_sort_key(text)
+        key_length = len(key)
+        toc_match, best_score = None, 0
+        for idx in self.page_idxs.get(page_id, []):
+            if ratio_upper_bound(len(self.keys[idx]), key_length) <= best_score:
+                continue
+            score = fuzz.ratio(self.keys[idx], key)
+            if score > best_score:
+                toc_match = {"content_idx": idx, "token_sort_ratio": score}
+                best_score = score
+        return toc_match
+
+
+class TocTextIndex:
+    """
+    Lower cased table of contents text indexed by a suffix automaton.
+
+    Text is appended while the table of contents pages are parsed and `text in toc_index` answers whether text
+    is a substring of the lower cased table of contents text in O(len(text)), i.e. without rescanning the table of contents.
+    """
+
+    def __init__(self):
+        self._next = [{}]  # transitions of each state
+        self._link = [-1]  # suffix link of each state
+        self._length = [0]  # length of the longest string of each state
+        self._last = 0
+
+    def append(self, text: str):
+        for char in text.lower():
+            self._extend(char)
+
+    def _extend(self, char: str):
+        _next, _link, _length = self._next, self._link, self._length
+        state = len(_length)
+        _next.append({})
+        _length.append(_length[self._last] + 1)
+        _link.append(0)
+        p = self._last
+        while p != -1 and char not in _next[p]:
+            _next[p][char] = state
+            p = _link[p]
+        if p != -1:
+            q = _next[p][char]
+            if _length[p] + 1 == _length[q]:
+                _link[state] = q
+            else:
+                clone = len(_length)
+                _next.append(dict(_next[q]))
+                _length.append(_length[p] + 1)
+                _link.append(_link[q])
+                while p != -1 and _next[p].get(char) == q:
+                    _next[p][char] = clone
+                    p = _link[p]
+                _link[q] = clone
+                _link[state] = clone
+        self._last = state
+
+    def __contains__(self, text: str) -> bool:
+        state = 0
+        for char in text:
+            state = self._next[state].get(char)
+            if state is None:
+                return False
+        return True
@@ -1,15 +1,29 @@
 import os, json, time, re
+from pathlib import Path
+import click
 from util import (
     _PARSED_FILES_PATH,
-    load_jsonl,
+    load_parsed_content,
+    is_parsed_content_file,
     update_eba_evaluations_column,
     create_eba_evaluations_column,
     get_file_id,
 )
 
 
-def main():
-    """ Update eba evaluations with auxillary information. """
+@click.command()
+@click.option(
+    "--parsed_files_path",
+    default=str(_PARSED_FILES_PATH),
+    type=click.Path(exists=True, file_okay=False),
+    help="Folder with parsed content files, the front matter results (parse_evaluations/results/front_matter) are sufficient.",
+)
+def main(parsed_files_path):
+    """Update eba evaluations with auxillary information.
+
+    :param parsed_files_path: folder with parsed content files (the front matter results are sufficient).
+    """
+    parsed_files_path = Path(parsed_files_path)
     total_file_cnt, start_aux_cnt, end_aux_cnt = 0, 0, 0
     end_author_cnt = 0
     silence_updates = True
@@ -18,13 +32,13 @@ def main():
     create_eba_evaluations_column("publ_date")
     create_eba_evaluations_column("publisher")
     create_eba_evaluations_column("art_no")
-    for file_idx, file in enumerate(_PARSED_FILES_PATH.iterdir()):
-        if file.name.endswith("_content.json"):
+    for file_idx, file in enumerate(parsed_files_path.iterdir()):
+        if is_parsed_content_file(file):
             found_aux_page = False
             total_file_cnt += 1
             file_id = get_file_id(file)
             print(file_id)
-            data = load_jsonl(file)
+            data = load_parsed_content(file)
             aux_text = ""
             for row_id, content in enumerate(data):
                 text = content["text"]
@@ -115,5 +129,6 @@ def main():
 
 
 if __name__ == "__main__":
+    # pylint: disable=no-value-for-parameter
     # python -m q0.main
     main()
@@ -1,8 +1,13 @@
 import pytest
 import os
+import json
 import spacy
+from spacy.tokens import DocBin
+from nlp_processing import process_docs
+from nlp_processing.process_docs import create_spacy_doc_bins, load_doc_bin_manifest
 from util import load_spacy_docbin_file
 from util import _NLP_FILES_PATH
+from util import dump_parsed_content, dump_category_ranges
 
 
 def test_load_spacy_doc():
@@ -16,3 +21,147 @@ def test_load_spacy_doc():
     docs, nlp = load_spacy_docbin_file(version_file_path=file_path)
     assert isinstance(docs[0], spacy.tokens.doc.Doc)
     assert isinstance(nlp, spacy.lang.en.English)
+
+
+@pytest.fixture
+def doc_bin_paths(tmp_path, monkeypatch):
+    """Parsed files and nlp results folders of a blank english model (any model name)."""
+    parsed_path, nlp_path = tmp_path / "parsed", tmp_path / "nlp"
+    parsed_path.mkdir()
+    monkeypatch.setattr(process_docs, "_PARSED_FILES_PATH", parsed_path)
+    monkeypatch.setattr(process_docs, "_NLP_FILES_PATH", nlp_path)
+    monkeypatch.setattr(process_docs, "_load_model", lambda _: spacy.blank("en"))
+    monkeypatch.setattr(process_docs, "_nlp", None)
+    monkeypatch.setattr(process_docs, "_nlp_model", None)
+    return parsed_path, nlp_path
+
+
+def _dump_content(parsed_path, file_id, text):
+    contents = [
+        {"text": text, "type": "text", "page_id": 0},
+        {"text": "1", "type": "page_number", "page_id": 0},
+    ]
+    dump_parsed_content(contents, parsed_path / (file_id + "_content.json"))
+
+
+def _rebuilt(nlp_path, version):
+    """Bin files of a version which were processed instead of reused."""
+    with open(nlp_path / "v{}".format(version) / "meta.json") as f:
+        doc_bins = json.load(f)["doc_bins"]
+    return sorted(name for name, stats in doc_bins.items() if "reused" not in stats)
+
+
+def test_parallel_doc_bins(doc_bin_paths):
+    """Bin files should be the same when processed by pool workers or by nlp.pipe processes (large files)."""
+    parsed_path, nlp_path = doc_bin_paths
+    for file_id, n_blocks in [("2020_1", 1), ("2020_2", 3), ("2020_3", 200)]:
+        contents = [
+            {"text": "Evaluation {} of {}".format(idx, file_id), "page_id": idx}
+            for idx in range(n_blocks)
+        ]
+        dump_parsed_content(contents, parsed_path / (file_id + "_content.json"))
+    create_spacy_doc_bins("model_a")
+    create_spacy_doc_bins("model_a", workers=2, large_file_size=2000, rebuild=True)
+    with open(nlp_path / "v2" / "meta.json") as f:
+        meta = json.load(f)
+    assert meta["workers"] == 2 and len(meta["doc_bins"]) == 3
+    for name in meta["doc_bins"]:
+        assert (nlp_path / "v1" / name).read_bytes() == (
+            nlp_path / "v2" / name
+        ).read_bytes()
+
+
+def test_reuse_doc_bins(doc_bin_paths, monkeypatch):
+    """Only bin files with changed content, categories, model, attrs or routing should be processed again,
+    without changing the bin files of the previous version they were linked to."""
+    parsed_path, nlp_path = doc_bin_paths
+    bin_names = ["2020_1_content.bin", "2020_2_content.bin", "2020_3_content.bin"]
+    for file_id in ["2020_1", "2020_2", "2020_3"]:
+        _dump_content(parsed_path, file_id, "Evaluation of {}".format(file_id))
+    create_spacy_doc_bins("model_a")
+    assert _rebuilt(nlp_path, 1) == bin_names
+    v1_bins = {name: (nlp_path / "v1" / name).read_bytes() for name in bin_names}
+
+    create_spacy_doc_bins("model_a")
+    assert _rebuilt(nlp_path, 2) == []
+    for name in bin_names:
+        assert os.path.samefile(nlp_path / "v1" / name, nlp_path / "v2" / name)
+
+    # processed again into version 2 whose bin files are links to the bin files of version 1
+    _dump_content(parsed_path, "2020_1", "Changed evaluation")
+    dump_category_ranges({"introduction": [[0, None]]}, "2020_2", parsed_path)
+    create_spacy_doc_bins("model_a", version=2)
+    assert _rebuilt(nlp_path, 2) == bin_names[:2]
+    assert os.path.samefile(
+        nlp_path / "v1" / bin_names[2], nlp_path / "v2" / bin_names[2]
+    )
+    doc_bin = DocBin(store_user_data=True).from_bytes(
+        (nlp_path / "v2" / bin_names[0]).read_bytes()
+    )
+    docs = list(doc_bin.get_docs(spacy.blank("en").vocab))
+    assert docs[0].text == "Changed evaluation"
+
+    create_spacy_doc_bins("model_b")
+    assert _rebuilt(nlp_path, 3) == bin_names
+    create_spacy_doc_bins("model_b", full_pipeline=True)
+    assert _rebuilt(nlp_path, 4) == bin_names
+    monkeypatch.setattr(process_docs, "_DOC_BIN_ATTRS", ["TAG", "POS", "LEMMA"])
+    create_spacy_doc_bins("model_b", full_pipeline=True)
+    assert _rebuilt(nlp_path, 5) == bin_names
+    create_spacy_doc_bins("model_b", full_pipeline=True)
+    assert _rebuilt(nlp_path, 6) == []
+
+    assert {
+        name: (nlp_path / "v1" / name).read_bytes() for name in bin_names
+    } == v1_bins
+
+
+def test_reuse_partial_doc_bins(doc_bin_paths):
+    """Bin files should be reused from the newest previous version which has them unchanged, also after a run for
+    a single file, and files processed into an existing version should be added to its manifest."""
+    parsed_path, nlp_path = doc_bin_paths
+    bin_names = ["2020_1_content.bin", "2020_2_content.bin", "2020_3_content.bin"]
+    for file_id in ["2020_1", "2020_2", "2020_3"]:
+        _dump_content(parsed_path, file_id, "Evaluation of {}".format(file_id))
+    create_spacy_doc_bins("model_a")
+
+    _dump_content(parsed_path, "2020_1", "Changed evaluation")
+    create_spacy_doc_bins("model_a", file_name="2020_1_content.json")
+    assert _rebuilt(nlp_path, 2) == bin_names[:1]
+    assert list(load_doc_bin_manifest(nlp_path / "v2")) == bin_names[:1]
+
+    create_spacy_doc_bins("model_a")
+    assert _rebuilt(nlp_path, 3) == []
+    assert os.path.samefile(
+        nlp_path / "v2" / bin_names[0], nlp_path / "v3" / bin_names[0]
+    )
+    for name in bin_names[1:]:
+        assert os.path.samefile(nlp_path / "v1" / name, nlp_path / "v3" / name)
+
+    _dump_content(parsed_path, "2020_2", "Changed evaluation")
+    create_spacy_doc_bins("model_a", version=3, file_name="2020_2_content.json")
+    assert _rebuilt(nlp_path, 3) == bin_names[1:2]
+    with open(nlp_path / "v3" / "meta.json") as f:
+        assert sorted(json.load(f)["doc_bins"]) == bin_names
+    manifest = load_doc_bin_manifest(nlp_path / "v3")
+    assert list(manifest) == bin_names
+    assert (
+        manifest[bin_names[1]] != load_doc_bin_manifest(nlp_path / "v1")[bin_names[1]]
+    )
+    create_spacy_doc_bins("model_a")
+    assert _rebuilt(nlp_path, 4) == []
+
+
+def test_tokenizer_only_props(doc_bin_paths):
+    """Docs of blocks which are only tokenized should be marked in their props."""
+    parsed_path, nlp_path = doc_bin_paths
+    _dump_content(parsed_path, "2020_1", "Evaluation of 2020_1")
+    for full_pipeline in [False, True]:
+        create_spacy_doc_bins("model_a", full_pipeline=full_pipeline)
+    for version, tokenizer_only in [(1, [False, True]), (2, [False, False])]:
+        bin_path = nlp_path / "v{}".format(version) / "2020_1_content.bin"
+        docs, _ = load_spacy_docbin_file(bin_path, spacy.blank("en"))
+        assert [
+            doc._.props.get("tokenizer_only", False) for doc in docs
+        ] == tokenizer_only
+        assert docs[1]._.props["type"] == "page_number"
@@ -0,0 +1,101 @@
+import io
+import json
+import mmap
+from parse_evaluations import content_store
+from parse_evaluations.content_store import ContentStore, ContentStoreWriter
+from util import dump_parsed_content, load_parsed_content
+
+
+def _block(text, page_id, **fields):
+    return {
+        "text": text,
+        "tag": "<p>",
+        "size": 11.04,
+        "color": 0,
+        "page_id": page_id,
+        "merged_tags": "<p>",
+        "linebreak_indexes": [3],
+        "block_id": 2,
+        "line_id": 0,
+        "bbox": [72.0, 90.5, 523.2, 102.1],
+        "type": "text",
+        "footnote_id_pos": -1,
+        **fields,
+    }
+
+
+def test_content_store():
+    """Blocks must be read back exactly as json decoding the json lines content file (incl. key order)."""
+    blocks = [
+        _block("Évaluation – summary", 0),
+        _block("", 0, linebreak_indexes=[]),
+        _block("Annex", 2, category=["terms_of_reference"]),
+        {"text": "no columns", "page_id": 2, "size": 12, "bbox": None},
+        _block("1", 1, type="page_number"),  # out of page order
+    ]
+    store = ContentStore()
+    for bl in blocks:
+        store.add(bl)
+    f = io.BytesIO()
+    store.write(f)
+    f.seek(0)
+    store = ContentStore.read(f)
+
+    decoded = [json.loads(json.dumps(bl)) for bl in blocks]
+    assert [list(bl.items()) for bl in store] == [list(bl.items()) for bl in decoded]
+    assert store.text(0) == "Évaluation – summary"
+    assert store.page_block_idxs(2) == [2, 3]
+    assert store.page_blocks(1) == [decoded[4]]
+    assert store.page_blocks(5) == []
+
+
+def test_content_store_writer(monkeypatch):
+    """Spooling the blocks while they are added should write the same file as ContentStore.write."""
+    monkeypatch.setattr(content_store, "_SPOOL_BLOCKS", 2)
+    blocks = [
+        _block("Évaluation – summary", 0),
+        _block("", 0, linebreak_indexes=[]),
+        _block("Annex", 2, category=["terms_of_reference"]),
+        {"text": "no columns", "page_id": 2, "size": 12, "bbox": None},
+        _block("1", 1, type="page_number"),  # out of page order
+        _block("Text", 1, linebreak_indexes=[1, 2, 3]),
+        _block("More", 1),
+    ]
+    for n_blocks in [0, 1, 2, 5, 7]:
+        store = ContentStore()
+        expected, f = io.BytesIO(), io.BytesIO()
+        writer = ContentStoreWriter(f)
+        for bl in blocks[:n_blocks]:
+            store.add(bl)
+            writer.add(bl)
+        store.write(expected)
+        writer.close()
+        assert f.getvalue() == expected.getvalue()
+
+
+def test_content_store_from_file(tmp_path):
+    """Stores read from a file should be views of the memory mapped file instead of copies of its data."""
+    blocks = [_block("Title", 0), _block("Text", 1, linebreak_indexes=[1, 2])]
+    for n_blocks in [0, 2]:
+        store = ContentStore()
+        for bl in blocks[:n_blocks]:
+            store.add(bl)
+        with open(tmp_path / "doc_content.blocks", "wb") as f:
+            store.write(f)
+        store = ContentStore.from_file(tmp_path / "doc_content.blocks")
+        assert isinstance(store.fields.obj, mmap.mmap)
+        assert isinstance(store._heap.obj, mmap.mmap)
+        assert store.blocks() == blocks[:n_blocks]
+        assert store.page_blocks(1) == blocks[1:n_blocks]
+
+
+def test_load_parsed_content(tmp_path):
+    """Both content file formats should load the same blocks."""
+    blocks = [_block("Title", 0), _block("Text", 1), _block("More", 1)]
+    for suffix in ["_content.json", "_content.blocks"]:
+        dump_parsed_content(blocks, tmp_path / ("doc" + suffix))
+        assert load_parsed_content(tmp_path / ("doc" + suffix)) == blocks
+        assert load_parsed_content(tmp_path / ("doc" + suffix), range(1, 2)) == [
+            blocks[1],
+            blocks[2],
+        ]
@@ -0,0 +1,63 @@
+import fitz
+from parse_evaluations.parse_evaluation import _PARSE_SETTINGS, ParseDoc
+
+_SECTIONS = [
+    (1, "1 Introduction", 3),
+    (2, "1.1 Background", 3),
+    (1, "2 Findings", 4),
+    (1, "3 Conclusions", 5),
+    (1, "Annex Terms of Reference", 6),
+]
+
+
+def _outlined_pdf(file_path):
+    """Pdf with a printed (dotted) table of contents on page 2 and an outline of the same sections."""
+    doc = fitz.open()
+    page = doc.newPage(width=595, height=842)
+    page.insertText((72, 200), "Evaluation of the programme", fontsize=20)
+    page = doc.newPage(width=595, height=842)
+    page.insertText((72, 80), "Table of Contents", fontsize=16)
+    for row, (_, title, page_number) in enumerate(_SECTIONS):
+        line = "{} {} {}".format(title, "." * 40, page_number)
+        page.insertText((72, 120 + 18 * row), line, fontsize=10)
+    for page_number in range(3, 7):
+        page = doc.newPage(width=595, height=842)
+        y = 80
+        for _, title, section_page_number in _SECTIONS:
+            if section_page_number == page_number:
+                page.insertText((72, y), title, fontsize=14)
+                y += 30
+        for line in range(10):
+            page.insertText(
+                (72, y + 16 * line),
+                "The evaluation found that the programme results were mixed.",
+                fontsize=10,
+            )
+        page.insertText((297, 810), str(page_number), fontsize=9)
+    doc.setToC([[level, title, page] for level, title, page in _SECTIONS])
+    doc.save(str(file_path))
+    doc.close()
+
+
+def test_outline_toc(tmp_path):
+    """Rows are taken from the outline while the printed table of contents is still marked as toc text."""
+    doc_path = tmp_path / "2020_1.pdf"
+    _outlined_pdf(doc_path)
+    pdoc = ParseDoc(str(doc_path), **_PARSE_SETTINGS)
+    pdoc.fonts_and_page_numbers()
+    pdoc.font_tags()
+    pdoc.get_footnotes()
+    pdoc.parse_content()
+
+    assert pdoc.extract_toc() == ("outline", None)
+    assert [row["text"] for row in pdoc.toc] == [title for _, title, _ in _SECTIONS]
+    assert [row["page_id"] for row in pdoc.toc] == [2, 2, 3, 4, 5]
+    assert [row["section_level"] for row in pdoc.toc] == [0, 1, 0, 0, None]
+    assert [row["parent_section"] for row in pdoc.toc] == [None, "1", None, None, None]
+    assert pdoc.toc[-1]["section_type"] == "Annex"
+
+    toc_page_types = {bl["type"] for bl in pdoc.parsed_content if bl["page_id"] == 1}
+    assert "toc_orig_text" in toc_page_types
+    assert all(
+        bl["type"] != "toc_orig_text" for bl in pdoc.parsed_content if bl["page_id"] > 1
+    )
@@ -0,0 +1,21 @@
+from parse_evaluations.parse_evaluation import ParseCache
+
+
+def test_parse_cache(tmp_path):
+    """Checkpoints should only be restored with the key they were saved with."""
+    doc_path = tmp_path / "2020_1.pdf"
+    doc_path.write_bytes(b"%PDF-1.4")
+    cache = ParseCache(str(tmp_path / "cache"), str(doc_path))
+
+    assert cache.load_raw() is None
+    cache.save_raw({"doc_length": 1, "spans": None, "outline": []})
+    assert cache.load_raw() == {"doc_length": 1, "spans": None, "outline": []}
+
+    cache.save("parse_content", "key", {"result": [(1, 2)]})
+    assert cache.load("parse_content", "key") == {"result": [(1, 2)]}
+    assert cache.load("parse_content", "other key") is None
+    assert ParseCache(str(tmp_path / "cache"), str(doc_path), [0, 20]).load_raw() is None
+
+    # a changed pdf invalidates the raw extraction
+    doc_path.write_bytes(b"%PDF-1.5")
+    assert ParseCache(str(tmp_path / "cache"), str(doc_path)).load_raw() is None
@@ -0,0 +1,97 @@
+import os
+import socket
+import struct
+import threading
+import time
+from multiprocessing.connection import Client
+
+from parse_evaluations import parse_service
+from parse_evaluations.parse_evaluation import load_parsing_manifest
+from parse_evaluations.parse_service import ParseService, request_parse
+
+
+def test_parse_service(tmp_path):
+    """The service should answer requests over the local socket until it is stopped."""
+    key_file = tmp_path / "parse_service.key"
+    service = ParseService(("localhost", 0), str(tmp_path), key_file=key_file)
+    thread = threading.Thread(target=service.serve)
+    thread.start()
+
+    response = request_parse(
+        {"path": str(tmp_path / "missing.pdf")}, service.address, key_file
+    )
+    assert response["file"] == "missing.pdf" and "error" in response
+    assert response["timings"]["total"] >= 0
+
+    assert request_parse({"stop": True}, service.address, key_file) == {}
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+    assert not key_file.exists()
+
+
+def test_parse_service_bad_clients(tmp_path):
+    """Malformed requests should be answered with an error, broken or idle connections should not stop or block
+    the service."""
+    key_file = tmp_path / "parse_service.key"
+    service = ParseService(
+        ("localhost", 0), str(tmp_path), key_file=key_file, connection_timeout=0.5
+    )
+    thread = threading.Thread(target=service.serve)
+    thread.start()
+
+    # closed before authentication
+    socket.create_connection(service.address).close()
+    # reset after authentication
+    with Client(service.address, authkey=key_file.read_bytes()) as connection:
+        with socket.socket(fileno=os.dup(connection.fileno())) as sock:
+            sock.setsockopt(
+                socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0)
+            )
+    # never authenticates, respectively never sends a request
+    with socket.create_connection(service.address), Client(
+        service.address, authkey=key_file.read_bytes()
+    ):
+        assert "error" in request_parse(["path"], service.address, key_file)
+        with Client(service.address, authkey=key_file.read_bytes()) as connection:
+            connection.send_bytes(b"not a pickle")
+            assert "error" in connection.recv()
+        assert request_parse({"stop": True}, service.address, key_file) == {}
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+
+
+def _parse_pdf_file(file_path, output_path, settings, cache_path, **options):
+    if "slow" in file_path:
+        time.sleep(60)
+    options["timings"]["parse_content"] = 0.0
+    return {"pages": 1}
+
+
+def test_parse_service_supervised(tmp_path, monkeypatch):
+    """Parsing should be stopped at the time limit of the service and parsed files added to the manifest."""
+    monkeypatch.setattr(parse_service, "parse_pdf_file", _parse_pdf_file)
+    key_file = tmp_path / "parse_service.key"
+    service = ParseService(
+        ("localhost", 0), str(tmp_path), key_file=key_file, timeout=1
+    )
+    thread = threading.Thread(target=service.serve)
+    thread.start()
+
+    for name in ["doc.pdf", "slow.pdf"]:
+        (tmp_path / name).write_bytes(b"%PDF " + name.encode())
+    response = request_parse(
+        {"path": str(tmp_path / "doc.pdf")}, service.address, key_file
+    )
+    assert response["stats"] == {"pages": 1} and "error" not in response
+    assert set(response["timings"]) == {"parse_content", "total"}
+    response = request_parse(
+        {"path": str(tmp_path / "slow.pdf")}, service.address, key_file
+    )
+    assert response["error"].startswith("timeout")
+    assert response["timings"]["total"] < 30
+
+    assert request_parse({"stop": True}, service.address, key_file) == {}
+    thread.join(timeout=10)
+    manifest = load_parsing_manifest(str(tmp_path))
+    assert list(manifest) == ["doc.pdf"]
+    assert manifest["doc.pdf"]["content_format"] == "json"
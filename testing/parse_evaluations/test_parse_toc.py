@@ -0,0 +1,60 @@
+import random
+from parse_evaluations.parse_toc import category_ranges
+from util import (
+    add_content_categories,
+    dump_category_ranges,
+    dump_parsed_content,
+    load_section_content,
+)
+
+
+def _stamp_categories(toc, contents):
+    """Categories of the content blocks as previously written to the content files by parse_toc."""
+    prev_content_idx = None
+    for c in toc[::-1]:
+        if c["category"]:
+            content_idx = c["toc_match"]["content_idx"]
+            for content in contents[content_idx:prev_content_idx]:
+                content["category"] = c["category"]
+        prev_content_idx = c["toc_match"]["content_idx"]
+
+
+def test_category_ranges():
+    """Category ranges must give every block the categories of the toc row it was stamped with."""
+    random.seed(0)
+    categories = ["introduction", "executive_summary", "relevance", "annex"]
+    for _ in range(200):
+        toc = [
+            {
+                "toc_match": {"content_idx": random.randrange(30)},
+                "category": random.sample(categories, k=random.choice([0, 0, 1, 2])),
+            }
+            for _ in range(random.randrange(8))
+        ]
+        if random.random() < 0.7:
+            toc.sort(key=lambda c: c["toc_match"]["content_idx"])
+        expected = [{"text": str(idx)} for idx in range(30)]
+        _stamp_categories(toc, expected)
+        contents = [{"text": str(idx)} for idx in range(30)]
+        add_content_categories(contents, category_ranges(toc))
+
+        assert [set(c.get("category", [])) for c in contents] == [
+            set(c.get("category", [])) for c in expected
+        ]
+
+
+def test_load_section_content(tmp_path):
+    """Only blocks in the ranges of a section should be loaded, in either content format."""
+    toc = [
+        {"toc_match": {"content_idx": 1}, "category": ["executive_summary"]},
+        {"toc_match": {"content_idx": 3}, "category": []},
+        {"toc_match": {"content_idx": 4}, "category": ["annex", "executive_summary"]},
+    ]
+    contents = [{"text": str(idx), "page_id": idx // 2} for idx in range(6)]
+    dump_category_ranges(category_ranges(toc), "doc", tmp_path)
+    for suffix in ["_content.json", "_content.blocks"]:
+        dump_parsed_content(contents, tmp_path / ("doc" + suffix))
+        section = load_section_content(tmp_path / ("doc" + suffix))
+        assert [c["text"] for c in section] == ["1", "2", "4", "5"]
+        assert section[-1]["category"] == ["executive_summary", "annex"]
+        assert load_section_content(tmp_path / ("doc" + suffix), "relevance") == []
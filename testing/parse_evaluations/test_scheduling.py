@@ -0,0 +1,26 @@
+from parse_evaluations.parse_evaluation import (
+    estimated_parse_memory,
+    next_scheduled_task,
+)
+
+
+def test_next_scheduled_task():
+    """Largest documents should be started first as long as they fit into the memory budget."""
+    page_counts = {"a.pdf": 20, "b.pdf": 400, "c.pdf": 150, "d.pdf": 150}
+    pending = [(idx, file) for idx, file in enumerate(sorted(page_counts))]
+
+    assert next_scheduled_task(pending, page_counts, 0) == (1, "b.pdf")
+    # files with equal page counts keep their order
+    assert next_scheduled_task(pending[2:], page_counts, 500) == (2, "c.pdf")
+
+    budget = estimated_parse_memory(400) + estimated_parse_memory(150)
+    running = estimated_parse_memory(400)
+    assert next_scheduled_task(pending[2:], page_counts, running, budget) == (
+        2,
+        "c.pdf",
+    )
+    running += estimated_parse_memory(150)
+    assert next_scheduled_task(pending[3:], page_counts, running, budget) is None
+    assert next_scheduled_task(pending[:1], page_counts, 0, budget) == (0, "a.pdf")
+    # a document larger than the budget is started once no other document is running
+    assert next_scheduled_task(pending[1:2], page_counts, 0, 1) == (1, "b.pdf")
@@ -0,0 +1,24 @@
+import random
+from parse_evaluations.section_classifier import SectionClassifier
+
+
+def test_section_classifier():
+    """Categories must be the categories with any variation in the lower cased heading."""
+    variations = {
+        "sustainability": ["sustainability", "sustainable", "sustain"],
+        "executive_summary": ["executive summary", "summary", "sammanfattning"],
+        "concluding_sections": ["conclusions", "conclusion", "lessons learned"],
+        "abc": ["abcab", "bca", "c"],
+    }
+    classifier = SectionClassifier(variations)
+    headings = ["", "3. Sustainability and Conclusions", "Executive  Summary"]
+    random.seed(0)
+    alphabet = "abc sumary"
+    headings += ["".join(random.choices(alphabet, k=12)) for _ in range(500)]
+    for heading in headings:
+        expected = {
+            category
+            for category, category_variations in variations.items()
+            if any(var in heading.lower() for var in category_variations)
+        }
+        assert classifier.classify(heading) == expected
@@ -0,0 +1,50 @@
+from parse_evaluations.parse_evaluation import SpanFeatures
+from parse_evaluations.span_store import SpanStore
+
+
+def _span(text, size=10.04, bbox=(72.0, 0.0, 172.0, 10.0)):
+    return {"text": text, "size": size, "font": "Helvetica", "color": 0, "bbox": bbox}
+
+
+def test_span_features():
+    """Span features should match the per span checks of the parsing passes."""
+    spans = SpanStore()
+    spans.add_page(
+        {
+            "width": 595.0,
+            "height": 842.0,
+            "blocks": [
+                {
+                    "type": 0,
+                    "lines": [
+                        {
+                            "bbox": (72.0, 0.0, 172.0, 10.0),
+                            "spans": [_span("2.1. Scope "), _span("iv")],
+                        },
+                        {
+                            "bbox": (72.0, 12.0, 172.0, 22.0),
+                            "spans": [_span(" ", bbox=(72.0, 12.0, 172.0, 22.0))],
+                        },
+                        {
+                            "bbox": (72.0, 30.0, 172.0, 40.0),
+                            "spans": [_span(" 12 ", bbox=(72.0, 30.0, 172.0, 40.0))],
+                        },
+                    ],
+                }
+            ],
+        }
+    )
+    spans.pack()
+    features = SpanFeatures(spans, doc_length=10, font_size_remainder=1)
+
+    assert features.text == ["2.1. Scope", "iv", "", "12"]
+    assert features.size == [10.0, 10.0, 10.0, 10.0]
+    assert features.is_digit == [False, False, False, True]
+    assert features.is_page_number == [False, True, False, True]
+    assert features.has_section_digit == [True, False, False, True]
+    assert features.starts_with_section_number == [True, False, False, False]
+    # the empty span is skipped when looking up the previous span
+    assert features.prev_gap == [0.0, 10.0, 2.0, 20.0]
+    assert features.vertical_shift == [False, False, True, True]
+
+    assert SpanFeatures(SpanStore(), doc_length=0).prev_gap == []
@@ -0,0 +1,142 @@
+from parse_evaluations import span_store
+from parse_evaluations.span_store import SpanStore
+
+
+def _span(text, size=10.0, font="Helvetica", bbox=(0.0, 0.0, 10.0, 10.0)):
+    return {"text": text, "size": size, "font": font, "color": 0, "bbox": bbox}
+
+
+def test_span_store():
+    """Spans, lines and pages should be retrievable in the order of page.getText("dict")."""
+    page_dict = {
+        "width": 595.0,
+        "height": 842.0,
+        "blocks": [
+            {"type": 1},  # image block
+            {
+                "type": 0,
+                "lines": [
+                    {
+                        "bbox": (72.0, 0.0, 172.0, 10.0),
+                        "spans": [_span("Introduction "), _span("1", size=6.0)],
+                    },
+                    {"bbox": (72.0, 20.0, 122.0, 30.0), "spans": [_span(" ")]},
+                ],
+            },
+        ],
+    }
+    spans = SpanStore()
+    spans.add_page(page_dict)
+    spans.add_page({"width": 595.0, "height": 842.0, "blocks": []})
+    spans.add_page(page_dict)
+    spans.pack()
+
+    assert spans.page_count == 3
+    assert len(spans) == 6
+    assert list(spans.page_spans(1)) == []
+    assert list(spans.page_spans(2)) == [3, 4, 5]
+
+    lines = list(spans.page_lines(0))
+    assert [(block_id, line_id) for block_id, line_id, _, _ in lines] == [
+        (1, 0),
+        (1, 1),
+    ]
+    assert lines[0][2] == 100.0
+    assert spans.span(lines[0][3][1]) == _span("1", size=6.0)
+    assert spans.text(5) == " "
+    assert spans.fonts == ["Helvetica"]
+
+
+class _Page:
+    def __init__(self, page_dict):
+        self.page_dict = page_dict
+
+    def getText(self, option):
+        return self.page_dict
+
+
+def test_span_store_page_range():
+    """Only requested pages should be extracted while page ids still match the document."""
+    page_dict = {
+        "width": 595.0,
+        "height": 842.0,
+        "blocks": [
+            {
+                "type": 0,
+                "lines": [
+                    {"bbox": (72.0, 0.0, 172.0, 10.0), "spans": [_span("Title")]}
+                ],
+            }
+        ],
+    }
+    doc = [_Page(page_dict) for _ in range(5)]
+
+    spans = SpanStore.from_doc(doc, range(1, 3))
+    assert spans.page_count == 3
+    assert list(spans.page_spans(0)) == []
+    assert list(spans.page_spans(2)) == [1]
+    assert len(SpanStore.from_doc(doc)) == 5
+    assert SpanStore.from_doc(doc, range(0)).page_count == 0
+
+
+class _Doc(list):
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_span_store_from_file(monkeypatch):
+    """The pdf should be closed after extracting a small page range without workers."""
+    page_dict = {"width": 595.0, "height": 842.0, "blocks": []}
+    docs = []
+
+    def open_doc(doc_path):
+        docs.append(_Doc(_Page(page_dict) for _ in range(3)))
+        return docs[-1]
+
+    monkeypatch.setattr(span_store.fitz, "open", open_doc)
+    for workers in [1, 4]:
+        assert SpanStore.from_file("doc.pdf", workers=workers).page_count == 3
+    assert len(docs) == 2 and all(doc.closed for doc in docs)
+
+
+def test_span_store_extend():
+    """Joining stores of consecutive pages should give the same store as extracting all pages at once."""
+    pages = [
+        {
+            "width": 595.0,
+            "height": 842.0,
+            "blocks": [
+                {
+                    "type": 0,
+                    "lines": [
+                        {
+                            "bbox": (72.0, 0.0, 172.0, 10.0),
+                            "spans": [_span("Page {}".format(page_id), font=font)],
+                        }
+                    ],
+                }
+            ],
+        }
+        for page_id, font in enumerate(["Helvetica", "Times", "Courier", "Times"])
+    ]
+    spans = SpanStore()
+    for page_dict in pages:
+        spans.add_page(page_dict)
+    spans.pack()
+
+    joined = SpanStore()
+    for chunk in [pages[:1], pages[1:3], [], pages[3:]]:
+        chunk_spans = SpanStore()
+        for page_dict in chunk:
+            chunk_spans.add_page(page_dict)
+        chunk_spans.pack()
+        joined.extend(chunk_spans)
+
+    assert joined.fonts == spans.fonts == ["Helvetica", "Times", "Courier"]
+    assert joined.page_count == spans.page_count
+    assert [joined.span(idx) for idx in range(len(joined))] == [
+        spans.span(idx) for idx in range(len(spans))
+    ]
+    assert list(joined.page_lines(2)) == list(spans.page_lines(2))
@@ -0,0 +1,56 @@
+from parse_evaluations.parse_evaluation import ParseDoc
+
+
+def test_toc_confidence():
+    """Rows count as valid if their page numbers do not decrease and are within the document."""
+    toc = [
+        {"page_number": "1"},
+        {"page_number": "5"},
+        {"page_number": "3"},  # decreasing
+        {"page_number": None},
+        {"page_number": "7"},
+        {"page_number": "500"},  # beyond the document
+    ]
+    assert ParseDoc.toc_confidence(toc, max_page_number=100) == 0.5
+    assert ParseDoc.toc_confidence(toc[:2], max_page_number=100) == 1.0
+    assert ParseDoc.toc_confidence([], max_page_number=100) == 0.0
+
+
+def _detect(dotted, no_dots):
+    """Runs detect_table_of_contents with the given (rows, block indexes) of both layouts."""
+    pdoc = ParseDoc.__new__(ParseDoc)
+    pdoc.doc_length = 30
+    pdoc.parsed_content = [
+        {"text": str(idx), "type": "text", "page_id": idx} for idx in range(6)
+    ]
+    pdoc._dotted_toc = lambda blocks: dotted
+    pdoc._no_dots_toc = lambda blocks: no_dots
+    layout, _ = pdoc.detect_table_of_contents()
+    toc_idxs = [
+        idx
+        for idx, bl in enumerate(pdoc.parsed_content)
+        if bl["type"] == "toc_orig_text"
+    ]
+    return layout, pdoc.toc, toc_idxs
+
+
+def test_detect_table_of_contents():
+    """Only the blocks of the chosen layout are marked as toc text, the dotted blocks are kept as fallback
+    if the dotted layout has no rows."""
+    valid_rows = [{"page_number": "3"}, {"page_number": "5"}]
+    invalid_rows = [{"page_number": "9"}, {"page_number": "2"}]
+    assert _detect((valid_rows, [1, 2]), (invalid_rows, [2, 3])) == (
+        "dots",
+        valid_rows,
+        [1, 2],
+    )
+    assert _detect((invalid_rows, [1, 2]), (valid_rows, [3, 4])) == (
+        "no_dots",
+        valid_rows,
+        [3, 4],
+    )
+    assert _detect(([], [1]), (valid_rows, [3, 4])) == (
+        "no_dots",
+        valid_rows,
+        [1, 3, 4],
+    )
@@ -0,0 +1,65 @@
+import random
+from fuzzywuzzy import fuzz
+from parse_evaluations.toc_match import TocMatcher, TocTextIndex
+
+
+def test_best_text_match():
+    """Indexed matching must give the same match as comparing every block (first block wins ties)."""
+    random.seed(0)
+    words = "1 2.1 the of evaluation findings relevance sustainability introduction annex".split()
+    for _ in range(50):
+        parsed_content = [
+            {
+                "text": " ".join(random.choices(words, k=random.choice([1, 3, 30]))),
+                "type": random.choice(["text", "text", "page_number"]),
+                "page_id": idx // 5,
+            }
+            for idx in range(40)
+        ]
+        matcher = TocMatcher(parsed_content, [])
+        streamed_matcher = TocMatcher([], [])  # blocks added while content is written
+        for bl in parsed_content:
+            streamed_matcher.add(bl)
+        for _ in range(5):
+            toc_text = " ".join(random.choices(words, k=3))
+            expected = None
+            for content_idx, content in enumerate(parsed_content):
+                if content["type"] == "text":
+                    score = fuzz.token_sort_ratio(content["text"], toc_text)
+                    if expected is None or score > expected["token_sort_ratio"]:
+                        expected = {
+                            "content_idx": content_idx,
+                            "token_sort_ratio": score,
+                        }
+            assert matcher.best_text_match(toc_text) == expected
+            assert streamed_matcher.best_text_match(toc_text) == expected
+
+
+def test_best_page_match():
+    """Page matches should only consider blocks on the requested page."""
+    parsed_content = [
+        {"text": "1 Introduction", "type": "text", "page_id": 2},
+        {"text": "Introduction to the programme", "type": "text", "page_id": 3},
+        {"text": "5", "type": "page_number", "page_id": 3},
+    ]
+    matcher = TocMatcher(parsed_content, [{"text": "5", "page_id": 3}])
+    assert matcher.best_page_id_match("1 Introduction", 3)["content_idx"] == 1
+    assert matcher.best_page_match("1 Introduction", "5")["content_idx"] == 1
+    assert matcher.best_page_match("1 Introduction", "6") is None
+    assert matcher.best_page_id_match("1 Introduction", 2) == {
+        "content_idx": 0,
+        "token_sort_ratio": 100,
+    }
+
+
+def test_toc_text_index():
+    """Substring queries must agree with `in` on the lower cased text."""
+    random.seed(0)
+    toc_index, toc = TocTextIndex(), ""
+    for _ in range(30):
+        text = "".join(random.choices("abAB. 1", k=random.randint(0, 8)))
+        toc_index.append(text)
+        toc += text
+        for _ in range(20):
+            query = "".join(random.choices("ab. 1", k=random.randint(0, 6)))
+            assert (query in toc_index) == (query in toc.lower())
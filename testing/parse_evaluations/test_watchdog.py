@@ -0,0 +1,90 @@
+import os
+import time
+from multiprocessing import Pool
+
+from parse_evaluations.parse_evaluation import SupervisedProcess, _record_outcome
+
+def outcome(process: SupervisedProcess):
+    result = None
+    while result is None:
+        SupervisedProcess.wait([process])
+        result = process.poll()
+    return result
+
+
+def _mupdf_allocation_failure():
+    raise RuntimeError("malloc (1073741824 bytes) failed")
+
+
+def _sleeping_workers(pid_file: str):
+    """Starts workers (like the page workers of a large file) which outlive the timeout of the child."""
+    with Pool(processes=2) as pool:
+        with open(pid_file, "w") as f:
+            f.write(" ".join(str(pid) for pid in pool.map(_worker_pid, range(2))))
+        pool.map(time.sleep, [60, 60])
+
+
+def _worker_pid(_) -> int:
+    time.sleep(0.2)  # both workers get a task
+    return os.getpid()
+
+
+def _is_running(pid: int) -> bool:
+    try:
+        with open("/proc/{}/stat".format(pid)) as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"  # zombies wait for init
+    except FileNotFoundError:
+        return False
+
+
+def test_supervised_process():
+    """Children exceeding their time or memory limit should be stopped and reported."""
+    assert outcome(SupervisedProcess(divmod, (7, 2), timeout=60)) == ("done", (3, 1))
+
+    status, error = outcome(SupervisedProcess(divmod, (1, 0)))
+    assert status == "error" and isinstance(error, ZeroDivisionError)
+
+    start = time.monotonic()
+    status, _ = outcome(SupervisedProcess(time.sleep, (60,), timeout=0.5))
+    assert status == "timeout" and time.monotonic() - start < 30
+
+    status, _ = outcome(SupervisedProcess(bytearray, (2 ** 33,), memory_limit=4096))
+    assert status == "memory"
+
+    # the limit does not include the modules loaded by the parent
+    status, value = outcome(SupervisedProcess(bytearray, (2 ** 24,), memory_limit=64))
+    assert status == "done" and len(value) == 2 ** 24
+
+    status, _ = outcome(SupervisedProcess(_mupdf_allocation_failure, memory_limit=16))
+    assert status == "memory"
+
+
+def test_record_outcome():
+    """Failing files should be quarantined like files exceeding the limits instead of stopping the batch."""
+    results, quarantine = [], []
+    record_result = lambda *result: results.append(result)
+    record_quarantine = lambda *entry: quarantine.append(entry)
+    _record_outcome("a.pdf", ("done", ("a.pdf", {})), record_result, record_quarantine)
+    _record_outcome(
+        "b.pdf", ("error", ValueError("b")), record_result, record_quarantine
+    )
+    _record_outcome("c.pdf", ("timeout", "c"), record_result, record_quarantine)
+    assert results == [("a.pdf", {})]
+    assert quarantine == [
+        ("b.pdf", "error", "ValueError('b')"),
+        ("c.pdf", "timeout", "c"),
+    ]
+
+
+def test_supervised_process_workers(tmp_path):
+    """Processes started by a child exceeding the timeout should be killed with it."""
+    pid_file = tmp_path / "pids"
+    process = SupervisedProcess(_sleeping_workers, (str(pid_file),), timeout=3)
+    status, _ = outcome(process)
+    assert status == "timeout"
+    worker_pids = [int(pid) for pid in pid_file.read_text().split()]
+    assert len(worker_pids) == 2
+    deadline = time.monotonic() + 10
+    while any(_is_running(pid) for pid in worker_pids) and time.monotonic() < deadline:
+        time.sleep(0.1)
+    assert not any(_is_running(pid) for pid in worker_pids)
@@ -0,0 +1,30 @@
+import sqlite3
+
+import util
+from util import files_to_exclude
+
+
+def test_files_to_exclude(tmp_path, monkeypatch):
+    """Exclusion rules should select the same files on the parsed and on the crawler metadata."""
+    db_path = tmp_path / "processed_output.db"
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        "CREATE TABLE eba_evaluations(_id TEXT PRIMARY KEY, web_series TEXT, web_series_number TEXT, series TEXT, series_number TEXT)"
+    )
+    rows = [
+        ("2011:1_a", "Sida Decentralised Evaluation", "2011:1"),
+        ("2009:4_b", "Sida Decentralised Evaluation", "2009:4"),
+        ("2012:2_c", "Sida Evaluation", "2012:2"),
+        ("2013:3_d", None, None),
+    ]
+    for _id, series, series_number in rows:
+        conn.execute(
+            "INSERT INTO eba_evaluations VALUES (?, ?, ?, ?, ?)",
+            (_id, series, series_number, series, series_number),
+        )
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(util, "_DB_FILE_PATH", db_path)
+
+    assert sorted(files_to_exclude()) == ["2009:4_b", "2012:2_c"]
+    assert sorted(files_to_exclude(crawler_metadata=True)) == ["2009:4_b", "2012:2_c"]
@@ -1,13 +1,15 @@
 """ Variables and methods applicable to entire repository. """
 import os, logging, time
 from pathlib import Path, PosixPath
-from typing import Union, List
+from typing import Union, List, Optional, Tuple
 from collections import Counter
+from itertools import count
 import sqlite3
 import json
 import spacy
 from spacy.tokens import DocBin
 from spacy.tokens import Doc, Span
+from parse_evaluations.content_store import ContentStore
 
 _PROJECT_PATH = Path(__file__).parent
 
@@ -15,7 +17,13 @@ _DB_FILE_PATH = _PROJECT_PATH / "processed_output.db"
 
 _FETCHED_FILES_PATH = _PROJECT_PATH / "fetch_evaluations" / "documents" / "evaluations"
 _PARSED_FILES_PATH = _PROJECT_PATH / "parse_evaluations" / "results"
+_FRONT_MATTER_PARSED_FILES_PATH = _PARSED_FILES_PATH / "front_matter"
 _NLP_FILES_PATH = _PROJECT_PATH / "nlp_processing" / "results"
+# Parsed content files: json lines or binary content store (see ContentStore)
+_CONTENT_JSON_SUFFIX = "_content.json"
+_CONTENT_STORE_SUFFIX = "_content.blocks"
+# Content ranges of the table of contents categories of a document (see parse_toc)
+_CATEGORIES_SUFFIX = "_categories.json"
 
 _EBA_FILE_PATH = _PROJECT_PATH / "eba2017" / "original_data" / "eba2017_12.xlsx"
 _EBA_CASE_FILE_PATH = (
@@ -48,6 +56,20 @@ _DAC_CRITERIA_VARIATIONS = {
 }
 _TERMS_OF_REFERENCE = ["terms of reference"]
 
+# Evaluations excluded from the eba analysis: a file is excluded if any (column, operator, value) rule matches its
+# row in eba_evaluations. Rules refer to the metadata extracted from the parsed documents (q1_q2),
+# _CRAWLER_METADATA_COLUMNS maps them to the crawler metadata which is available before parsing.
+_CORPUS_EXCLUSION_RULES = [
+    ("series", "!=", "Sida Decentralised Evaluation"),
+    ("series_number", "LIKE", "2008:%"),
+    ("series_number", "LIKE", "2009:%"),
+    ("series_number", "LIKE", "2010:%"),
+]
+_CRAWLER_METADATA_COLUMNS = {
+    "series": "web_series",
+    "series_number": "web_series_number",
+}
+
 _DAC_CRITERIA_VALUES_FROM_CODE = {
     "sustainability": {
         "sustainable": "insatsen bedöms vara hållbar",
@@ -156,13 +178,30 @@ def get_eba2017_adjusted_probability_score(eba2017_col: str) -> dict:
     }
 
 
-def files_to_exclude():
-    """ Returns a list of files to exclude from the eba analyis """
+def corpus_exclusion_clause(crawler_metadata: bool = False) -> Tuple[str, list]:
+    """ Returns the SQL condition and its parameters matching the eba_evaluations rows excluded by
+    _CORPUS_EXCLUSION_RULES.
+    :param crawler_metadata: evaluate the rules on the crawler metadata columns """
+    conditions, params = [], []
+    for column, operator, value in _CORPUS_EXCLUSION_RULES:
+        if crawler_metadata:
+            column = _CRAWLER_METADATA_COLUMNS[column]
+        conditions.append("{} {} ?".format(column, operator))
+        params.append(value)
+    return " OR ".join(conditions), params
+
+
+def files_to_exclude(crawler_metadata: bool = False) -> List[str]:
+    """ Returns a list of files to exclude from the eba analyis
+    :param crawler_metadata: select files by the crawler metadata, e.g. for skipping excluded files before parsing """
     conn, cur = db_connect()
+    clause, params = corpus_exclusion_clause(crawler_metadata)
     rows = conn.execute(
-        "SELECT _id FROM eba_evaluations WHERE series!='Sida Decentralised Evaluation' OR series_number LIKE '2008:%' OR series_number LIKE '2009:%'  OR series_number LIKE '2010:%';"
+        "SELECT _id FROM eba_evaluations WHERE {};".format(clause), params
     )
-    return [row[0] for row in rows]
+    file_ids = [row[0] for row in rows]
+    conn.close()
+    return file_ids
 
 
 def get_file_id(file_path: Union[str, PosixPath]) -> str:
@@ -171,8 +210,10 @@ def get_file_id(file_path: Union[str, PosixPath]) -> str:
     file_name = file_path.name
     file_id = (
         file_name.replace("_content.bin", "")
-        .replace("_content.json", "")
+        .replace(_CONTENT_JSON_SUFFIX, "")
+        .replace(_CONTENT_STORE_SUFFIX, "")
         .replace("_meta.json", "")
+        .replace(_CATEGORIES_SUFFIX, "")
     )
     return file_id
 
@@ -182,15 +223,8 @@ def get_section_text(file_ids: tuple, section_name: str = "executive_summary") -
 
     for path_obj in _PARSED_FILES_PATH.iterdir():
         section_text = []
-        if (
-            path_obj.is_file()
-            and path_obj.name.replace("_content.json", "") in file_ids
-        ):
-            with open(path_obj, "r") as f:
-                for line in f:
-                    content = json.loads(line)
-                    if section_name in content.get("category", []):
-                        section_text.append(content)
+        if is_parsed_content_file(path_obj) and get_file_id(path_obj) in file_ids:
+            section_text = load_section_content(path_obj, section_name)
 
         yield section_text
 
@@ -281,6 +315,152 @@ def load_jsonl(input_path: Union[str, PosixPath], silenced=True) -> list:
     return data
 
 
+def is_parsed_content_file(file_path: Union[str, PosixPath]) -> bool:
+    """Whether file_path is a parsed content file (json lines or content store)"""
+    return str(file_path).endswith((_CONTENT_JSON_SUFFIX, _CONTENT_STORE_SUFFIX))
+
+
+def parsed_content_path(
+    file_id: str, parsed_files_path: Union[str, PosixPath] = _PARSED_FILES_PATH
+) -> PosixPath:
+    """Path of the parsed content file of a document, the content store if it exists else the json lines file"""
+    store_path = Path(parsed_files_path) / (file_id + _CONTENT_STORE_SUFFIX)
+    if store_path.exists():
+        return store_path
+    return Path(parsed_files_path) / (file_id + _CONTENT_JSON_SUFFIX)
+
+
+def load_parsed_content(
+    input_path: Union[str, PosixPath],
+    page_ids: range = None,
+    content_ranges: List[List[int]] = None,
+) -> list:
+    """
+    Read the content blocks of a parsed content file in either format (json lines or content store).
+    :param page_ids: only read blocks on these pages (content is ordered by page)
+    :param content_ranges: only read blocks with a content_idx in these [start, end) ranges, end None: until the
+        end of the content (see load_category_ranges)
+    """
+    if str(input_path).endswith(_CONTENT_STORE_SUFFIX):
+        store = ContentStore.from_file(input_path)
+        if page_ids is None:
+            content_idxs = range(len(store))
+        else:
+            content_idxs = [
+                idx for page_id in page_ids for idx in store.page_block_idxs(page_id)
+            ]
+        return [
+            store.block(idx)
+            for idx in content_idxs
+            if _in_content_ranges(idx, content_ranges)
+        ]
+
+    data = []
+    with open(input_path, "r", encoding="utf-8") as f:
+        for content_idx, line in enumerate(f):
+            if not _in_content_ranges(content_idx, content_ranges):
+                continue
+            content = json.loads(line.rstrip("\n|\r"))
+            if page_ids is not None and content.get("page_id") not in page_ids:
+                if page_ids and content.get("page_id", -1) > page_ids[-1]:
+                    break
+                continue
+            data.append(content)
+    return data
+
+
+def _in_content_ranges(content_idx: int, content_ranges: List[List[int]]) -> bool:
+    if content_ranges is None:
+        return True
+    return any(
+        start <= content_idx and (end is None or content_idx < end)
+        for start, end in content_ranges
+    )
+
+
+def dump_parsed_content(data: list, output_path: Union[str, PosixPath]):
+    """Write content blocks to a parsed content file in the format given by its suffix"""
+    if str(output_path).endswith(_CONTENT_STORE_SUFFIX):
+        store = ContentStore()
+        for content in data:
+            store.add(content)
+        with open(output_path, "wb") as f:
+            store.write(f)
+    else:
+        dump_jsonl(data, Path(output_path))
+
+
+def load_category_ranges(
+    file_id: str, parsed_files_path: Union[str, PosixPath] = _PARSED_FILES_PATH
+) -> Optional[dict]:
+    """
+    Read the category ranges of a document written by parse_toc: dict of category -> sorted list of
+    [start, end) content_idx ranges (end None: until the end of the content).
+    Returns None if parse_toc has not been run for the document.
+    """
+    file_path = Path(parsed_files_path) / (file_id + _CATEGORIES_SUFFIX)
+    if not file_path.exists():
+        return None
+    with open(file_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def dump_category_ranges(
+    category_ranges: dict,
+    file_id: str,
+    parsed_files_path: Union[str, PosixPath] = _PARSED_FILES_PATH,
+):
+    """Write the category ranges of a document (see load_category_ranges)"""
+    file_path = Path(parsed_files_path) / (file_id + _CATEGORIES_SUFFIX)
+    with open(file_path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(category_ranges))
+
+
+def add_content_categories(parsed_content: list, category_ranges: dict):
+    """Sets the "category" list of all content blocks of a document from its category ranges"""
+    for content in parsed_content:
+        content.pop("category", None)
+    for category, content_ranges in category_ranges.items():
+        for start, end in content_ranges:
+            for content in parsed_content[start:end]:
+                content.setdefault("category", []).append(category)
+
+
+def load_section_content(
+    input_path: Union[str, PosixPath], section_name: str = "executive_summary"
+) -> list:
+    """
+    Read the content blocks of a parsed content file which belong to a category, e.g. executive_summary.
+    Only the blocks in the category ranges are read, content files without category ranges are filtered by
+    the "category" of the blocks.
+    """
+    input_path = Path(input_path)
+    category_ranges = load_category_ranges(get_file_id(input_path), input_path.parent)
+    if category_ranges is None:
+        return [
+            content
+            for content in load_parsed_content(input_path)
+            if section_name in content.get("category", [])
+        ]
+    if section_name not in category_ranges:
+        return []
+    section_ranges = category_ranges[section_name]
+    parsed_content = load_parsed_content(input_path, content_ranges=section_ranges)
+    # content_idx of the loaded blocks (the ranges of a category are sorted and disjoint)
+    content_idxs = (
+        idx
+        for start, end in section_ranges
+        for idx in (range(start, end) if end is not None else count(start))
+    )
+    for content, content_idx in zip(parsed_content, content_idxs):
+        content["category"] = [
+            category
+            for category, content_ranges in category_ranges.items()
+            if _in_content_ranges(content_idx, content_ranges)
+        ]
+    return parsed_content
+
+
 def load_spacy_model(version_file_path: Union[PosixPath, str]) -> spacy.lang:
     """ Loads a Spacy model and props from a version folder. """
     # Make sure we load the same Spacy model which was used to save the doc